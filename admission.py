@@ -0,0 +1,280 @@
+"""Admission control in front of the auth endpoints.
+
+Checks run from cheapest to most expensive, before any DB or crypto work:
+
+1. `AdmissionMiddleware`: a per-IP token bucket (before the body or the
+   session cookie is read) and a hard cap on the request body size.
+2. `check_assertion` / `check_attestation`: structural validation of the
+   credential JSON. Shapes, base64url alphabets and length bounds, plus the
+   RP ID hash and UP flag of the authenticator data.
+3. `allow_username`: a per-username token bucket, applied by the routes.
+
+Buckets live in process memory, or in SQLite when several workers on one
+host should share them.
+"""
+import base64
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Protocol
+
+import db
+import metrics
+from config import (
+    MAX_BODY_BYTES,
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_IP_BURST,
+    RATE_LIMIT_IP_PER_SECOND,
+    RATE_LIMIT_MAX_KEYS,
+    RATE_LIMIT_STORE,
+    RATE_LIMIT_USER_BURST,
+    RATE_LIMIT_USER_PER_SECOND,
+    RP_ID,
+    TRUST_FORWARDED_FOR,
+)
+from executors import run_db
+
+class RateLimiter(Protocol):
+    # True when calls do I/O and should go through executors.run_db.
+    blocking: bool
+
+    def allow(self, key: str, cost: float = 1.0) -> bool: ...
+
+class MemoryRateLimiter:
+    """Token buckets in a bounded LRU. An evicted key comes back with a
+    full bucket, so `max_keys` should comfortably exceed the active keys."""
+
+    blocking = False
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        max_keys: int = RATE_LIMIT_MAX_KEYS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, list[float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, key: str, cost: float = 1.0) -> bool:
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < cost:
+                return False
+            bucket[0] -= cost
+            return True
+
+class SqliteRateLimiter:
+    """Token buckets in the `rate_limits` table, one statement per check."""
+
+    blocking = True
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        prefix: str,
+        clock: Callable[[], float] = time.time,
+        sweep_interval_seconds: float = 60.0,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self.clock = clock
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._next_sweep = 0.0
+
+    def allow(self, key: str, cost: float = 1.0) -> bool:
+        now = self.clock()
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval_seconds
+            # A bucket idle long enough to refill is the same as no bucket.
+            db.delete_rate_limits_before(now - self.burst / max(self.rate, 1e-9))
+        return db.take_rate_limit_token(self.prefix + key, self.rate, self.burst, now, cost)
+
+class _Unlimited:
+    blocking = False
+
+    def allow(self, key: str, cost: float = 1.0) -> bool:
+        return True
+
+def make_limiter(rate: float, burst: float, prefix: str, kind: str = RATE_LIMIT_STORE) -> RateLimiter:
+    if not RATE_LIMIT_ENABLED:
+        return _Unlimited()
+    if kind == "memory":
+        return MemoryRateLimiter(rate, burst)
+    if kind == "sqlite":
+        return SqliteRateLimiter(rate, burst, prefix)
+    raise RuntimeError(f"unknown RATE_LIMIT_STORE {kind!r} (expected 'memory' or 'sqlite')")
+
+ip_limiter = make_limiter(RATE_LIMIT_IP_PER_SECOND, RATE_LIMIT_IP_BURST, "ip:")
+user_limiter = make_limiter(RATE_LIMIT_USER_PER_SECOND, RATE_LIMIT_USER_BURST, "user:")
+
+async def allow_username(username: str) -> bool:
+    if user_limiter.blocking:
+        return await run_db(user_limiter.allow, username)
+    return user_limiter.allow(username)
+
+# --- structural validation -------------------------------------------------
+
+_B64URL = re.compile(r"[A-Za-z0-9_-]*")
+_RP_ID_HASH = hashlib.sha256(RP_ID.encode("utf-8")).digest()
+_FLAG_UP = 0x01
+
+def _b64url_field(obj: dict, name: str, min_bytes: int, max_bytes: int, required: bool = True):
+    """Decoded bytes, None if absent and optional, or False if malformed."""
+    value = obj.get(name)
+    if value is None or (value == "" and not required):
+        return False if required else None
+    # base64url length for n bytes without padding is ceil(4n / 3).
+    if not isinstance(value, str) or not (-(-4 * min_bytes // 3) <= len(value) <= -(-4 * max_bytes // 3)):
+        return False
+    if len(value) % 4 == 1 or not _B64URL.fullmatch(value):
+        return False
+    try:
+        return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+    except ValueError:
+        return False
+
+def _check_common(credential) -> Optional[str]:
+    if not isinstance(credential, dict):
+        return "not_an_object"
+    if credential.get("type") != "public-key":
+        return "bad_type"
+    if credential.get("rawId", credential.get("id")) != credential.get("id"):
+        return "id_mismatch"
+    # Credential IDs are at most 1023 bytes.
+    if _b64url_field(credential, "id", 1, 1023) is False:
+        return "bad_id"
+    if not isinstance(credential.get("response"), dict):
+        return "bad_response"
+    if _b64url_field(credential["response"], "clientDataJSON", 16, 4096) is False:
+        return "bad_client_data"
+    return None
+
+def check_assertion(credential) -> Optional[str]:
+    """Return a rejection reason, or None if `credential` is worth verifying."""
+    reason = _check_common(credential)
+    if reason:
+        return reason
+    response = credential["response"]
+    auth_data = _b64url_field(response, "authenticatorData", 37, 4096)
+    if auth_data is False:
+        return "bad_authenticator_data"
+    if auth_data[:32] != _RP_ID_HASH or not auth_data[32] & _FLAG_UP:
+        return "wrong_rp_or_no_presence"
+    # Ed25519 signatures are 64 bytes; RSA-4096 is the largest in practice.
+    if _b64url_field(response, "signature", 8, 1024) is False:
+        return "bad_signature"
+    if _b64url_field(response, "userHandle", 1, 64, required=False) is False:
+        return "bad_user_handle"
+    return None
+
+def check_attestation(credential) -> Optional[str]:
+    reason = _check_common(credential)
+    if reason:
+        return reason
+    if _b64url_field(credential["response"], "attestationObject", 37, MAX_BODY_BYTES) is False:
+        return "bad_attestation_object"
+    transports = credential["response"].get("transports")
+    if transports is not None and not (
+        isinstance(transports, list) and len(transports) <= 8 and all(isinstance(t, str) for t in transports)
+    ):
+        return "bad_transports"
+    return None
+
+# --- ASGI middleware ---------------------------------------------------------
+
+class BodyTooLarge(Exception):
+    pass
+
+def client_ip(scope) -> str:
+    if TRUST_FORWARDED_FOR:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-forwarded-for":
+                return value.split(b",", 1)[0].strip().decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class AdmissionMiddleware:
+    """Per-IP buckets and a body size cap for `routes` ({path: endpoint name}).
+
+    Over-limit requests get 429 or 413 without the body, the session cookie
+    or the route ever being touched. A chunked body that exceeds the cap
+    makes `receive()` raise BodyTooLarge, which the routes turn into a 413.
+    """
+
+    def __init__(
+        self,
+        app,
+        routes: dict[str, str],
+        limiter: Optional[RateLimiter] = None,
+        max_body_bytes: int = MAX_BODY_BYTES,
+    ) -> None:
+        self.app = app
+        self.routes = routes
+        self.limiter = limiter if limiter is not None else ip_limiter
+        self.max_body_bytes = max_body_bytes
+
+    async def _deny(self, send, endpoint: str, status: int, reason: str) -> None:
+        metrics.AUTH_FAILURES.labels(endpoint, reason).inc()
+        body = b'{"detail":"too many requests"}' if status == 429 else b'{"detail":"request too large"}'
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if status == 429:
+            headers.append((b"retry-after", b"1"))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send) -> None:
+        endpoint = self.routes.get(scope.get("path", "")) if scope["type"] == "http" else None
+        if endpoint is None:
+            await self.app(scope, receive, send)
+            return
+
+        ip = client_ip(scope)
+        if self.limiter.blocking:
+            allowed = await run_db(self.limiter.allow, ip)
+        else:
+            allowed = self.limiter.allow(ip)
+        if not allowed:
+            await self._deny(send, endpoint, 429, "rate_limited_ip")
+            return
+
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length":
+                if not value.isdigit() or int(value) > self.max_body_bytes:
+                    await self._deny(send, endpoint, 413, "body_too_large")
+                    return
+                break
+
+        seen = 0
+        limit = self.max_body_bytes
+
+        async def limited_receive():
+            nonlocal seen
+            message = await receive()
+            if message["type"] == "http.request":
+                seen += len(message.get("body", b""))
+                if seen > limit:
+                    raise BodyTooLarge()
+            return message
+
+        await self.app(scope, limited_receive, send)
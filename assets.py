@@ -0,0 +1,156 @@
+"""In-memory static assets: read once, precompressed, served with strong ETags.
+
+Every file in STATIC_DIR is loaded at import. Scripts and stylesheets also
+get a content-hashed URL (/static/webauthn.<hash>.js) that is cached for a
+year as immutable, and HTML pages are rewritten to reference it. Pages and
+the plain URLs are `no-cache`: browsers revalidate with If-None-Match and get
+a 304. Nothing here touches the filesystem after startup.
+
+gzip variants are always precomputed; brotli ones too when the optional
+`brotli` package is installed. A variant is kept only if it is smaller.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from typing import NamedTuple
+
+from starlette.responses import Response
+
+from config import STATIC_DIR
+
+try:
+    # Optional dependency.
+    import brotli
+except ImportError:
+    brotli = None
+
+URL_PREFIX = "/static/"
+HASHED_SUFFIXES = (".js", ".css")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# Content-Encoding token -> ETag suffix, in order of preference.
+ENCODINGS = {"br": "-br", "gzip": "-gz"}
+
+class Asset(NamedTuple):
+    media_type: str
+    cache_control: str
+    etag: str  # quoted, for the identity body
+    bodies: dict[str, bytes]  # "identity", "gzip", "br"
+
+    def etag_for(self, encoding: str) -> str:
+        if encoding == "identity":
+            return self.etag
+        return self.etag[:-1] + ENCODINGS[encoding] + '"'
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def build_asset(data: bytes, media_type: str, cache_control: str) -> Asset:
+    bodies = {"identity": data}
+    variants = {"gzip": lambda d: gzip.compress(d, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = lambda d: brotli.compress(d, quality=11)
+    for encoding, compress in variants.items():
+        packed = compress(data)
+        if len(packed) < len(data):
+            bodies[encoding] = packed
+    return Asset(media_type, cache_control, f'"{_digest(data)[:32]}"', bodies)
+
+def _media_type(name: str) -> str:
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+        media_type += "; charset=utf-8"
+    return media_type
+
+def load(directory: str = STATIC_DIR) -> dict[str, Asset]:
+    """URL path -> Asset for every file in `directory`; index.html is also "/"."""
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                files[name] = f.read()
+
+    assets, renames = {}, {}
+    for name, data in files.items():
+        if name.endswith(HASHED_SUFFIXES):
+            stem, ext = os.path.splitext(name)
+            hashed = f"{URL_PREFIX}{stem}.{_digest(data)[:12]}{ext}"
+            assets[hashed] = build_asset(data, _media_type(name), IMMUTABLE)
+            renames[URL_PREFIX + name] = hashed
+
+    for name, data in files.items():
+        if name.endswith(".html"):
+            for plain, hashed in renames.items():
+                data = data.replace(f'"{plain}"'.encode(), f'"{hashed}"'.encode())
+        assets[URL_PREFIX + name] = build_asset(data, _media_type(name), REVALIDATE)
+    if URL_PREFIX + "index.html" in assets:
+        assets["/"] = assets[URL_PREFIX + "index.html"]
+    return assets
+
+def _accepts(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for item in accept_encoding.split(","):
+        token, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+def negotiate(asset: Asset, accept_encoding: str) -> str:
+    if len(asset.bodies) > 1 and accept_encoding:
+        accepted = _accepts(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in asset.bodies and (encoding in accepted or "*" in accepted):
+                return encoding
+    return "identity"
+
+def not_modified(asset: Asset, if_none_match: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison (RFC 9110 13.1.2); any representation of the same bytes matches.
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return any(asset.etag_for(e) in tags for e in asset.bodies)
+
+def respond(asset: Asset, headers, method: str = "GET") -> Response:
+    """The response for `asset` given the request headers."""
+    encoding = negotiate(asset, headers.get("accept-encoding", ""))
+    out = {"etag": asset.etag_for(encoding), "cache-control": asset.cache_control}
+    if len(asset.bodies) > 1:
+        out["vary"] = "Accept-Encoding"
+    if not_modified(asset, headers.get("if-none-match", "")):
+        return Response(status_code=304, headers=out)
+    if encoding != "identity":
+        out["content-encoding"] = encoding
+    body = asset.bodies[encoding]
+    if method == "HEAD":
+        out["content-length"] = str(len(body))
+        body = b""
+    return Response(body, media_type=asset.media_type, headers=out)
+
+class StaticAssets:
+    """ASGI app serving `assets` by request path (mount it or route to it)."""
+
+    def __init__(self, assets: dict[str, Asset]) -> None:
+        self.assets = assets
+
+    async def __call__(self, scope, receive, send) -> None:
+        asset = self.assets.get(scope["path"])
+        if asset is None:
+            response = Response("Not Found", status_code=404, media_type="text/plain")
+        elif scope["method"] not in ("GET", "HEAD"):
+            response = Response(status_code=405, headers={"allow": "GET, HEAD"})
+        else:
+            headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+            response = respond(asset, headers, scope["method"])
+        await response(scope, receive, send)
+
+bundle = load()
@@ -0,0 +1,72 @@
+import builtins
+import gzip
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+import assets
+from main import app
+
+client = TestClient(app)
+
+
+def script_url() -> str:
+    html = client.get("/", headers={"accept-encoding": "identity"}).text
+    return re.search(r'<script src="([^"]+)"', html).group(1)
+
+
+def test_index_links_hashed_script():
+    url = script_url()
+    assert re.fullmatch(r"/static/webauthn\.[0-9a-f]{12}\.js", url)
+    r = client.get(url, headers={"accept-encoding": "identity"})
+    assert r.status_code == 200 and r.headers["cache-control"] == assets.IMMUTABLE
+    with open("static/webauthn.js", "rb") as f:
+        assert r.content == f.read()
+    assert r.headers["content-type"].startswith(("text/javascript", "application/javascript"))
+
+    plain = client.get("/static/webauthn.js")
+    assert plain.headers["cache-control"] == "no-cache" and plain.content == r.content
+
+
+def test_gzip_variant_and_etag_revalidation():
+    raw = client.get("/", headers={"accept-encoding": "identity"})
+    assert "content-encoding" not in raw.headers
+    packed = client.get("/", headers={"accept-encoding": "gzip, deflate"})
+    assert packed.headers["content-encoding"] == "gzip" and packed.headers["vary"] == "Accept-Encoding"
+    assert packed.content == raw.content  # httpx decodes it
+    assert packed.headers["etag"] != raw.headers["etag"]
+
+    for etag in (raw.headers["etag"], packed.headers["etag"], "W/" + packed.headers["etag"], '"x", ' + raw.headers["etag"]):
+        r = client.get("/", headers={"if-none-match": etag, "accept-encoding": "gzip"})
+        assert r.status_code == 304 and r.content == b""
+        assert r.headers["etag"] == packed.headers["etag"]
+    assert client.get("/", headers={"if-none-match": '"stale"'}).status_code == 200
+
+
+def test_encoding_negotiation():
+    asset = assets.build_asset(b"x" * 2000, "text/plain", assets.REVALIDATE)
+    assert assets.negotiate(asset, "gzip;q=0, identity") == "identity"
+    assert assets.negotiate(asset, "*") == "gzip"
+    assert assets.negotiate(asset, "") == "identity"
+    assert gzip.decompress(asset.bodies["gzip"]) == b"x" * 2000
+    # Too small to gain from compression.
+    assert set(assets.build_asset(b"x", "text/plain", assets.REVALIDATE).bodies) == {"identity"}
+
+
+def test_brotli_variant_when_installed():
+    brotli = pytest.importorskip("brotli")
+    asset = assets.build_asset(b"passkeys " * 500, "text/plain", assets.REVALIDATE)
+    assert assets.negotiate(asset, "gzip, br") == "br"
+    assert brotli.decompress(asset.bodies["br"]) == b"passkeys " * 500
+
+
+def test_served_without_touching_the_filesystem(monkeypatch):
+    def no_open(*args, **kwargs):
+        raise AssertionError("filesystem access while serving")
+
+    monkeypatch.setattr(builtins, "open", no_open)
+    assert client.get("/").status_code == 200
+    assert client.head(script_url()).headers["content-length"] != "0"
+    assert client.get("/static/missing.js").status_code == 404
+    assert client.post("/static/webauthn.js").status_code == 405
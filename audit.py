@@ -0,0 +1,379 @@
+"""Append-only log of auth outcomes: registrations, logins, and why they failed.
+
+Routes call `record()`, which only appends to a bounded in-memory queue; a
+background thread writes the queue out in batches, one transaction (sqlite
+sink) or one write + fsync (file sink) per batch, so a login never waits on
+an extra commit. When the queue is full new events are dropped, counted in
+passkeys_audit_dropped_total, and a single `audit/dropped` event carrying
+the count is written with the next batch, so gaps show up in the log itself.
+
+File segments are a sequence of records, each
+`<u32 payload length><f64 ts><JSON payload>` (little endian). Scans skip
+segments outside the time window, stream the rest record by record, and
+only read and decode payloads that can match.
+
+    python audit.py --since 2026-10-17T09:00 --username alice
+    python audit.py --event login_verify --outcome failure --count
+"""
+import argparse
+import contextvars
+import datetime
+import glob
+import heapq
+import itertools
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Iterator, NamedTuple, Optional, Protocol
+
+import db
+import metrics
+from config import (
+    AUDIT_BATCH_SIZE,
+    AUDIT_DIR,
+    AUDIT_FLUSH_INTERVAL_MS,
+    AUDIT_QUEUE_MAX,
+    AUDIT_SEGMENT_BYTES,
+    AUDIT_SINK,
+)
+
+AUDIT_DROPPED = metrics.counter(
+    "passkeys_audit_dropped_total",
+    "Auth events dropped because the audit queue was full.",
+)
+
+class AuditEvent(NamedTuple):
+    ts: float
+    event: str
+    outcome: str
+    reason: Optional[str] = None
+    username: Optional[str] = None
+    cred_hash: Optional[bytes] = None
+    ip: Optional[str] = None
+
+class AuditSink(Protocol):
+    def write(self, events: list[AuditEvent]) -> None: ...
+
+    def scan(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        username: Optional[str] = None,
+        event: Optional[str] = None,
+        outcome: Optional[str] = None,
+        limit: int = 1000,
+    ) -> list[AuditEvent]: ...
+
+class SqliteAuditSink:
+    def write(self, events: list[AuditEvent]) -> None:
+        db.insert_auth_events(events)
+
+    def scan(self, since=None, until=None, username=None, event=None, outcome=None, limit=1000) -> list[AuditEvent]:
+        rows = db.find_auth_events(since, until, username, event, outcome, limit)
+        return [AuditEvent(*(bytes(v) if isinstance(v, memoryview) else v for v in row)) for row in rows]
+
+_HEADER = struct.Struct("<Id")
+
+class FileAuditSink:
+    """Rotating segment files, one writer per process (the pid is in the name)."""
+
+    def __init__(self, directory: str = AUDIT_DIR, segment_bytes: int = AUDIT_SEGMENT_BYTES) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._file = None
+
+    def _segment(self):
+        if self._file is not None and self._file.tell() >= self.segment_bytes:
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            # Names sort by creation time.
+            name = f"{time.time_ns():020d}-{os.getpid()}.log"
+            self._file = open(os.path.join(self.directory, name), "ab")
+        return self._file
+
+    @staticmethod
+    def encode(e: AuditEvent) -> bytes:
+        payload = json.dumps(
+            [e.event, e.outcome, e.reason, e.username, e.cred_hash.hex() if e.cred_hash else None, e.ip],
+            separators=(",", ":"),
+        ).encode("utf-8")
+        return _HEADER.pack(len(payload), e.ts) + payload
+
+    def write(self, events: list[AuditEvent]) -> None:
+        f = self._segment()
+        f.write(b"".join(self.encode(e) for e in events))
+        f.flush()
+        os.fsync(f.fileno())
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def first_ts(path: str) -> Optional[float]:
+        """Timestamp of the segment's first record, or None if it has none."""
+        with open(path, "rb") as f:
+            head = f.read(_HEADER.size)
+        return _HEADER.unpack(head)[1] if len(head) == _HEADER.size else None
+
+    @staticmethod
+    def read_segment(path: str, since=None, until=None, needle: Optional[bytes] = None) -> Iterator[AuditEvent]:
+        """Stream a segment's records; payloads outside [since, until) are seeked over, not read."""
+        with open(path, "rb") as f:
+            while True:
+                head = f.read(_HEADER.size)
+                if len(head) < _HEADER.size:
+                    break
+                length, ts = _HEADER.unpack(head)
+                if (since is not None and ts < since) or (until is not None and ts >= until):
+                    f.seek(length, os.SEEK_CUR)
+                    continue
+                payload = f.read(length)
+                if len(payload) < length:
+                    break  # torn final record from a crash mid-write
+                if needle is not None and needle not in payload:
+                    continue
+                ev, outcome, reason, username, cred_hash, ip = json.loads(payload)
+                yield AuditEvent(ts, ev, outcome, reason, username, bytes.fromhex(cred_hash) if cred_hash else None, ip)
+
+    def segments(self, since=None, until=None) -> list[list[str]]:
+        """Per writing process, its segment paths in order, without those that
+        cannot hold events in [since, until).
+
+        A writer appends in time order, so a segment spans from its first
+        record to the next segment's first record.
+        """
+        writers: dict[str, list[str]] = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.log"))):
+            pid = os.path.basename(path)[: -len(".log")].partition("-")[2]
+            writers.setdefault(pid, []).append(path)
+
+        chains = []
+        for paths in writers.values():
+            starts = [(p, self.first_ts(p)) for p in paths]
+            starts = [(p, ts) for p, ts in starts if ts is not None]
+            kept = []
+            for i, (path, first) in enumerate(starts):
+                if until is not None and first >= until:
+                    break
+                following = starts[i + 1][1] if i + 1 < len(starts) else None
+                if since is not None and following is not None and following < since:
+                    continue
+                kept.append(path)
+            chains.append(kept)
+        return chains
+
+    def scan(self, since=None, until=None, username=None, event=None, outcome=None, limit=1000) -> list[AuditEvent]:
+        # Cheap byte test before decoding: the JSON-encoded username must
+        # appear in a matching payload.
+        needle = json.dumps(username).encode("utf-8") if username is not None else None
+        # Each writer's segments are read one after another; only the
+        # writers (workers) are merged, so one file per worker is open at a time.
+        streams = [
+            itertools.chain.from_iterable(self.read_segment(p, since, until, needle) for p in paths)
+            for paths in self.segments(since, until)
+        ]
+        merged = heapq.merge(*streams, key=lambda e: e.ts)
+        matches = (
+            e
+            for e in merged
+            if (username is None or e.username == username)
+            and (event is None or e.event == event)
+            and (outcome is None or e.outcome == outcome)
+        )
+        return list(itertools.islice(matches, limit))
+
+class AuditLog:
+    """Bounded queue in front of a sink, drained by a background thread.
+
+    `record()` never blocks on I/O. The thread wakes every
+    `interval_seconds`, or as soon as a full batch is waiting; `stop()`
+    drains what is left.
+    """
+
+    def __init__(
+        self,
+        sink: Optional[AuditSink],
+        max_queue: int = AUDIT_QUEUE_MAX,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        interval_seconds: float = AUDIT_FLUSH_INTERVAL_MS / 1000.0,
+    ) -> None:
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.dropped = 0
+        self._unreported_drops = 0
+        self._lock = threading.Lock()
+        self._queue: deque[AuditEvent] = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sink is not None
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def record(
+        self,
+        event: str,
+        outcome: str,
+        reason: Optional[str] = None,
+        username: Optional[str] = None,
+        cred_hash: Optional[bytes] = None,
+        ip: Optional[str] = None,
+    ) -> bool:
+        """Queue an event; False if the log is off or the queue is full."""
+        if self.sink is None:
+            return False
+        item = AuditEvent(time.time(), event, outcome, reason, username, cred_hash, ip)
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                self._unreported_drops += 1
+                AUDIT_DROPPED.inc()
+                return False
+            self._queue.append(item)
+            full = len(self._queue) >= self.batch_size
+        if full:
+            self._wake.set()
+        return True
+
+    def _take(self) -> list[AuditEvent]:
+        with self._lock:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            if self._unreported_drops and batch:
+                batch.append(AuditEvent(time.time(), "audit", "dropped", str(self._unreported_drops)))
+                self._unreported_drops = 0
+        return batch
+
+    def flush(self) -> int:
+        """Write everything queued so far; returns the number of events written."""
+        written = 0
+        while self.sink is not None:
+            batch = self._take()
+            if not batch:
+                break
+            try:
+                self.sink.write(batch)
+            except Exception:
+                # Back to the front of the queue, as far as it fits.
+                with self._lock:
+                    room = max(self.max_queue - len(self._queue), 0)
+                    self._queue.extendleft(reversed(batch[:room]))
+                    lost = len(batch) - room
+                    if lost > 0:
+                        self.dropped += lost
+                        self._unreported_drops += lost
+                        AUDIT_DROPPED.inc(lost)
+                raise
+            written += len(batch)
+        return written
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def start(self) -> None:
+        if self.sink is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+def make_sink(kind: str = AUDIT_SINK) -> Optional[AuditSink]:
+    if kind == "off":
+        return None
+    if kind == "sqlite":
+        return SqliteAuditSink()
+    if kind == "file":
+        return FileAuditSink()
+    raise RuntimeError(f"unknown AUDIT_SINK {kind!r} (expected 'sqlite', 'file' or 'off')")
+
+log = AuditLog(make_sink())
+
+# The verify route being served in this task, so `failure()` (called from
+# the routes' _reject) knows the username, credential and client address.
+_trail: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("audit_trail", default=None)
+
+def begin(event: str, ip: str, username: Optional[str] = None) -> dict:
+    trail = {"event": event, "ip": ip, "username": username, "cred_hash": None}
+    _trail.set(trail)
+    return trail
+
+def failure(event: str, reason: str) -> None:
+    trail = _trail.get()
+    if trail is not None and trail["event"] == event:
+        log.record(event, "failure", reason, trail["username"], trail["cred_hash"], trail["ip"])
+
+def success(trail: dict) -> None:
+    log.record(trail["event"], "success", None, trail["username"], trail["cred_hash"], trail["ip"])
+
+def _parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return parsed.timestamp()
+
+def _format(e: AuditEvent) -> str:
+    when = datetime.datetime.fromtimestamp(e.ts, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    cred = e.cred_hash.hex()[:16] if e.cred_hash else "-"
+    return f"{when} {e.event} {e.outcome} {e.reason or '-'} {e.username or '-'} {cred} {e.ip or '-'}"
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sink", default=AUDIT_SINK, choices=["sqlite", "file", "off"])
+    parser.add_argument("--since", type=_parse_time, help="epoch seconds or ISO time (UTC if no offset)")
+    parser.add_argument("--until", type=_parse_time)
+    parser.add_argument("--username")
+    parser.add_argument("--event", help="register_verify, login_verify or audit")
+    parser.add_argument("--outcome", help="success, failure or dropped")
+    parser.add_argument("--limit", type=int, help="max rows (default 1000; unlimited with --count)")
+    parser.add_argument("--count", action="store_true", help="totals per event/outcome/reason instead of rows")
+    parser.add_argument("--json", action="store_true", help="one JSON object per line")
+    args = parser.parse_args(argv)
+
+    sink = make_sink(args.sink)
+    if sink is None:
+        parser.error("AUDIT_SINK is off; pass --sink sqlite or --sink file")
+    limit = args.limit or (sys.maxsize if args.count else 1000)
+    events = sink.scan(args.since, args.until, args.username, args.event, args.outcome, limit=limit)
+    if args.count:
+        for (ev, outcome, reason), n in Counter((e.event, e.outcome, e.reason) for e in events).most_common():
+            print(f"{n:>8} {ev} {outcome} {reason or '-'}")
+        return
+    for e in events:
+        if args.json:
+            print(json.dumps(e._replace(cred_hash=e.cred_hash.hex() if e.cred_hash else None)._asdict()))
+        else:
+            print(_format(e))
+
+if __name__ == "__main__":
+    main()
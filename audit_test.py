@@ -0,0 +1,165 @@
+import os
+import secrets
+
+import pytest
+from fastapi.testclient import TestClient
+
+import audit
+from audit import AuditEvent, AuditLog, FileAuditSink, SqliteAuditSink
+from harness import enroll
+from main import app
+
+
+class ListSink:
+    def __init__(self, fail: bool = False) -> None:
+        self.batches = []
+        self.fail = fail
+
+    def write(self, events):
+        if self.fail:
+            raise OSError("disk full")
+        self.batches.append(list(events))
+
+
+def test_flush_writes_in_batches():
+    sink = ListSink()
+    log = AuditLog(sink, max_queue=100, batch_size=2, interval_seconds=60)
+    for i in range(5):
+        assert log.record("login_verify", "success", username=f"u{i}")
+    assert log.pending == 5
+    assert log.flush() == 5
+    assert [len(b) for b in sink.batches] == [2, 2, 1]
+    assert [e.username for b in sink.batches for e in b] == [f"u{i}" for i in range(5)]
+
+
+def test_full_queue_drops_and_reports_the_gap():
+    sink = ListSink()
+    log = AuditLog(sink, max_queue=2, batch_size=10, interval_seconds=60)
+    assert log.record("login_verify", "success") and log.record("login_verify", "success")
+    assert not log.record("login_verify", "failure", "verification_failed")
+    assert not log.record("login_verify", "failure", "verification_failed")
+    assert log.dropped == 2
+
+    log.flush()
+    [batch] = sink.batches
+    assert batch[-1][1:4] == ("audit", "dropped", "2")
+
+
+def test_failed_write_is_requeued():
+    sink = ListSink(fail=True)
+    log = AuditLog(sink, max_queue=10, batch_size=10, interval_seconds=60)
+    log.record("register_verify", "success", username="a")
+    with pytest.raises(OSError):
+        log.flush()
+    assert log.pending == 1
+    sink.fail = False
+    assert log.flush() == 1
+
+
+def test_disabled_log_records_nothing():
+    assert not AuditLog(None).record("login_verify", "success")
+
+
+def test_file_sink_rotates_and_scans(tmp_path):
+    sink = FileAuditSink(str(tmp_path), segment_bytes=200)
+    h = secrets.token_bytes(32)
+    for i in range(10):
+        sink.write([AuditEvent(1000.0 + i, "login_verify", "success" if i % 2 else "failure", None, f"u{i % 3}", h, "10.0.0.1")])
+    sink.close()
+    assert len(os.listdir(tmp_path)) > 1
+
+    assert [e.ts for e in sink.scan()] == [1000.0 + i for i in range(10)]
+    assert [e.ts for e in sink.scan(since=1003, until=1006)] == [1003.0, 1004.0, 1005.0]
+    assert [e.ts for e in sink.scan(username="u1", outcome="success")] == [1001.0, 1007.0]
+    assert sink.scan(limit=1)[0].cred_hash == h
+
+    # A record torn by a crash mid-write ends its segment.
+    last = sorted(os.listdir(tmp_path))[-1]
+    with open(tmp_path / last, "ab") as f:
+        f.write(FileAuditSink.encode(AuditEvent(2000.0, "login_verify", "success"))[:-3])
+    assert len(sink.scan()) == 10
+
+
+def _segment(directory, name: str, times) -> None:
+    with open(os.path.join(directory, name), "wb") as f:
+        f.write(b"".join(FileAuditSink.encode(AuditEvent(t, "login_verify", "success", None, f"t{t:g}")) for t in times))
+
+
+def test_file_scan_prunes_segments_and_merges_writers(tmp_path, monkeypatch):
+    # Two workers; each writes in time order, their segments interleave.
+    _segment(tmp_path, "00000000000000000001-11.log", [100, 101, 102])
+    _segment(tmp_path, "00000000000000000002-11.log", [200, 201])
+    _segment(tmp_path, "00000000000000000003-11.log", [300, 301])
+    _segment(tmp_path, "00000000000000000001-22.log", [150, 250])
+    _segment(tmp_path, "00000000000000000002-22.log", [350])
+    sink = FileAuditSink(str(tmp_path))
+    assert [e.ts for e in sink.scan()] == [100, 101, 102, 150, 200, 201, 250, 300, 301, 350]
+
+    read = []
+    real = FileAuditSink.read_segment
+    monkeypatch.setattr(
+        FileAuditSink, "read_segment", staticmethod(lambda p, *a: read.append(os.path.basename(p)) or real(p, *a))
+    )
+    assert [e.ts for e in sink.scan(since=201, until=260)] == [201, 250]
+    assert sorted(read) == ["00000000000000000001-22.log", "00000000000000000002-11.log"]
+
+    # Segments are opened lazily: a satisfied limit stops reading.
+    read.clear()
+    assert [e.ts for e in sink.scan(limit=1)] == [100]
+    assert sorted(read) == ["00000000000000000001-11.log", "00000000000000000001-22.log"]
+
+
+def test_file_segments_are_streamed(tmp_path, monkeypatch):
+    _segment(tmp_path, "00000000000000000001-11.log", range(1000, 1200))
+    sizes = []
+    real_open = open
+
+    class Tracked:
+        def __init__(self, f):
+            self.f = f
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.f.close()
+
+        def read(self, n=-1):
+            sizes.append(n)
+            return self.f.read(n)
+
+        def seek(self, *args):
+            return self.f.seek(*args)
+
+    monkeypatch.setattr(audit, "open", lambda *a, **k: Tracked(real_open(*a, **k)), raising=False)
+    assert len(FileAuditSink(str(tmp_path)).scan(since=1100)) == 100
+    assert -1 not in sizes and max(sizes) < 100
+
+
+def test_verify_routes_are_logged():
+    client = TestClient(app)
+    username = f"audit-{secrets.token_hex(4)}"
+    authenticator = enroll(client, username)
+    cred = next(iter(authenticator.credentials.values()))
+
+    options = client.post("/api/login/options", json={"username": username}).json()
+    assert client.post("/api/login/verify", json={"credential": authenticator.get(options)}).status_code == 200
+    cred.sign_count -= 2
+    options = client.post("/api/login/options", json={"username": username}).json()
+    assert client.post("/api/login/verify", json={"credential": authenticator.get(options)}).status_code == 400
+    audit.log.flush()
+
+    events = SqliteAuditSink().scan(username=username)
+    assert [(e.event, e.outcome, e.reason) for e in events] == [
+        ("register_verify", "success", None),
+        ("login_verify", "success", None),
+        ("login_verify", "failure", "sign_count_regression"),
+    ]
+    assert all(e.cred_hash == events[0].cred_hash and e.ip for e in events)
+
+
+def test_query_tool_counts(capsys):
+    audit.log.record("login_verify", "failure", "unknown_credential", username="cli-user")
+    audit.log.flush()
+    audit.main(["--sink", "sqlite", "--username", "cli-user", "--count"])
+    assert "login_verify failure unknown_credential" in capsys.readouterr().out
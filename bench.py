@@ -0,0 +1,369 @@
+"""Load generator and latency benchmark for the WebAuthn endpoints.
+
+Drives register/options, register/verify, login/options and login/verify end
+to end with a software authenticator, either in-process over ASGI (default,
+against a throwaway DB) or against a running server with --url.
+
+Closed loop: a fixed number of virtual users, each issuing its next flow as
+soon as the previous one finishes.
+
+    python bench.py --scenario login --concurrency 16 --flows 2000
+
+Enumeration check: time login/options for registered vs. never-seen
+usernames and fail if their medians drift apart.
+
+    python bench.py --scenario login-options-timing --flows 2000 --max-median-gap-ms 0.2
+
+Open loop: flows are started on a fixed schedule regardless of completions;
+latency is measured from the scheduled start, so queueing delay is included
+(no coordinated omission).
+
+    python bench.py --scenario login --rate 300 --duration 20 --json run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import secrets
+import sys
+import tempfile
+import time
+from typing import Callable, Optional
+
+ENDPOINTS = {
+    "register_options": "/api/register/options",
+    "register_verify": "/api/register/verify",
+    "login_options": "/api/login/options",
+    "login_verify": "/api/login/verify",
+}
+
+class LatencyHistogram:
+    """Log-linear latency histogram in the HdrHistogram layout.
+
+    Values (microseconds) below `2**sub_bucket_bits` are exact; above that,
+    each power-of-two range is split into `2**(sub_bucket_bits-1)` buckets,
+    so the relative error stays under `2**-(sub_bucket_bits-1)` at any scale
+    while memory stays proportional to the number of distinct buckets used.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 8) -> None:
+        self.bits = sub_bucket_bits
+        self.sub_count = 1 << sub_bucket_bits
+        self.half = self.sub_count >> 1
+        self.counts: dict[int, int] = {}
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def _index(self, v: int) -> int:
+        if v < self.sub_count:
+            return v
+        shift = v.bit_length() - self.bits
+        return self.sub_count + (shift - 1) * self.half + ((v >> shift) - self.half)
+
+    def _upper(self, idx: int) -> int:
+        if idx < self.sub_count:
+            return idx
+        shift = (idx - self.sub_count) // self.half + 1
+        sub = (idx - self.sub_count) % self.half + self.half
+        return ((sub + 1) << shift) - 1
+
+    def record(self, value_us: int) -> None:
+        v = max(0, int(value_us))
+        idx = self._index(v)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.total += 1
+        self.sum += v
+        self.max = max(self.max, v)
+        self.min = v if self.min is None else min(self.min, v)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for idx, n in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + n
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def percentile(self, p: float) -> int:
+        if not self.total:
+            return 0
+        target = max(1, int(-(-p * self.total // 100)))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= target:
+                return min(self._upper(idx), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        ms = lambda us: round(us / 1000.0, 3)
+        return {
+            "count": self.total,
+            "min_ms": ms(self.min or 0),
+            "mean_ms": ms(self.sum / self.total) if self.total else 0.0,
+            "p50_ms": ms(self.percentile(50)),
+            "p90_ms": ms(self.percentile(90)),
+            "p99_ms": ms(self.percentile(99)),
+            "p999_ms": ms(self.percentile(99.9)),
+            "max_ms": ms(self.max),
+        }
+
+class Recorder:
+    def __init__(self) -> None:
+        self.histograms = {name: LatencyHistogram() for name in list(ENDPOINTS) + ["flow"]}
+        self.status: dict[str, dict[str, int]] = {name: {} for name in self.histograms}
+        self.errors = {name: 0 for name in self.histograms}
+
+    def record(self, name: str, elapsed_ns: int, status: int) -> None:
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram()
+            self.status[name] = {}
+            self.errors[name] = 0
+        self.histograms[name].record(elapsed_ns // 1000)
+        codes = self.status[name]
+        codes[str(status)] = codes.get(str(status), 0) + 1
+        if status >= 400 or status < 0:
+            self.errors[name] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            name: {**h.summary(), "errors": self.errors[name], "status": self.status[name]}
+            for name, h in self.histograms.items()
+            if h.total
+        }
+
+class VirtualUser:
+    """One browser: its own cookie jar, username and authenticator."""
+
+    def __init__(self, client, username: str) -> None:
+        from soft_authenticator import SoftAuthenticator
+
+        self.client = client
+        self.username = username
+        self.authenticator = SoftAuthenticator()
+
+    async def _post(self, rec: Optional[Recorder], name: str, payload: dict, label: Optional[str] = None):
+        t0 = time.perf_counter_ns()
+        try:
+            r = await self.client.post(ENDPOINTS[name], json=payload)
+            status = r.status_code
+        except Exception:
+            r, status = None, -1
+        if rec is not None:
+            rec.record(label or name, time.perf_counter_ns() - t0, status)
+        if r is None or status != 200:
+            raise RuntimeError(f"{name} failed with status {status}")
+        return r.json()
+
+    async def register(self, rec: Optional[Recorder] = None) -> None:
+        options = await self._post(rec, "register_options", {"username": self.username})
+        credential = self.authenticator.create(options)
+        await self._post(rec, "register_verify", {"username": self.username, "credential": credential})
+
+    async def login(self, rec: Optional[Recorder] = None) -> None:
+        options = await self._post(rec, "login_options", {"username": self.username})
+        assertion = self.authenticator.get(options)
+        await self._post(rec, "login_verify", {"credential": assertion})
+
+    async def login_usernameless(self, rec: Optional[Recorder] = None) -> None:
+        options = await self._post(rec, "login_options", {})
+        assertion = self.authenticator.get(options)
+        await self._post(rec, "login_verify", {"credential": assertion})
+
+    async def login_options(self, rec: Optional[Recorder] = None) -> None:
+        await self._post(rec, "login_options", {"username": self.username})
+
+    async def login_options_timing(self, rec: Optional[Recorder] = None) -> None:
+        # A registered name, then a fresh unregistered one, as an enumerator would.
+        pair = [(self.username, "login_options_known"), (f"nobody-{secrets.token_hex(6)}", "login_options_unknown")]
+        random.shuffle(pair)
+        sizes = set()
+        for username, label in pair:
+            options = await self._post(rec, "login_options", {"username": username}, label)
+            sizes.add(len(options.get("allowCredentials") or []))
+        if len(sizes) != 1:
+            raise RuntimeError(f"allowCredentials sizes differ: {sorted(sizes)}")
+
+SCENARIOS: dict[str, Callable] = {
+    "register": VirtualUser.register,
+    "login": VirtualUser.login,
+    "login-usernameless": VirtualUser.login_usernameless,
+    "login-options": VirtualUser.login_options,
+    "login-options-timing": VirtualUser.login_options_timing,
+}
+
+def median_gap_ms(endpoints: dict) -> Optional[float]:
+    """|p50(known) - p50(unknown)| for the login-options-timing scenario."""
+    known, unknown = endpoints.get("login_options_known"), endpoints.get("login_options_unknown")
+    if not known or not unknown:
+        return None
+    return round(abs(known["p50_ms"] - unknown["p50_ms"]), 3)
+
+async def _timed_flow(user: VirtualUser, scenario: str, rec: Recorder, started_ns: int) -> None:
+    try:
+        await SCENARIOS[scenario](user, rec)
+        status = 200
+    except Exception:
+        status = -1
+    rec.record("flow", time.perf_counter_ns() - started_ns, status)
+
+async def closed_loop(users, scenario: str, rec: Recorder, flows: int, duration: float) -> None:
+    deadline = time.perf_counter() + duration if duration else None
+    remaining = flows
+
+    async def worker(user):
+        nonlocal remaining
+        while remaining > 0 and (deadline is None or time.perf_counter() < deadline):
+            remaining -= 1
+            await _timed_flow(user, scenario, rec, time.perf_counter_ns())
+
+    await asyncio.gather(*(worker(u) for u in users))
+
+async def open_loop(users, scenario: str, rec: Recorder, rate: float, duration: float, poisson: bool) -> None:
+    idle: asyncio.Queue = asyncio.Queue()
+    for u in users:
+        idle.put_nowait(u)
+
+    async def one(scheduled_ns: int) -> None:
+        user = await idle.get()
+        try:
+            await _timed_flow(user, scenario, rec, scheduled_ns)
+        finally:
+            idle.put_nowait(user)
+
+    tasks = []
+    start_ns = time.perf_counter_ns()
+    end_ns = start_ns + int(duration * 1e9)
+    next_ns = start_ns
+    while next_ns < end_ns:
+        delay = (next_ns - time.perf_counter_ns()) / 1e9
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(next_ns)))
+        gap = random.expovariate(rate) if poisson else 1.0 / rate
+        next_ns += int(gap * 1e9)
+    await asyncio.gather(*tasks)
+
+async def run(args) -> dict:
+    import httpx
+
+    if args.url:
+        app = None
+        make_client = lambda: httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        from main import app
+
+        transport = httpx.ASGITransport(app=app)
+        make_client = lambda: httpx.AsyncClient(transport=transport, base_url="http://testserver", timeout=args.timeout)
+
+    async def body() -> dict:
+        run_id = secrets.token_hex(3)
+        clients = [make_client() for _ in range(args.users)]
+        users = [VirtualUser(c, f"bench-{run_id}-{i}") for i, c in enumerate(clients)]
+        try:
+            # Every scenario needs registered users; setup is not measured.
+            await asyncio.gather(*(u.register() for u in users))
+            for u in users:
+                for _ in range(args.passkeys - 1):
+                    await u.register()
+
+            rec = Recorder()
+            t0 = time.perf_counter()
+            if args.rate:
+                await open_loop(users, args.scenario, rec, args.rate, args.duration, args.poisson)
+            else:
+                await closed_loop(users, args.scenario, rec, args.flows, args.duration)
+            elapsed = time.perf_counter() - t0
+        finally:
+            for c in clients:
+                await c.aclose()
+
+        flows = rec.histograms["flow"].total
+        endpoints = rec.to_dict()
+        return {
+            "scenario": args.scenario,
+            "target": args.url or "asgi",
+            "mode": "open" if args.rate else "closed",
+            "users": args.users,
+            "passkeys_per_user": args.passkeys,
+            "rate": args.rate,
+            "elapsed_s": round(elapsed, 3),
+            "flows": flows,
+            "throughput_fps": round(flows / elapsed, 2) if elapsed else 0.0,
+            "endpoints": endpoints,
+            "login_options_median_gap_ms": median_gap_ms(endpoints),
+            "python": platform.python_version(),
+            "started_at": int(time.time() - elapsed),
+        }
+
+    if app is None:
+        return await body()
+    async with app.router.lifespan_context(app):
+        return await body()
+
+def print_report(result: dict) -> None:
+    print(
+        f"scenario={result['scenario']} target={result['target']} mode={result['mode']} "
+        f"users={result['users']} flows={result['flows']} "
+        f"elapsed={result['elapsed_s']}s throughput={result['throughput_fps']} flows/s"
+    )
+    print(f"{'endpoint':<22}{'count':>8}{'err':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'p99.9':>9}{'max':>9}  (ms)")
+    for name, s in result["endpoints"].items():
+        print(
+            f"{name:<22}{s['count']:>8}{s['errors']:>6}{s['p50_ms']:>9.2f}{s['p90_ms']:>9.2f}"
+            f"{s['p99_ms']:>9.2f}{s['p999_ms']:>9.2f}{s['max_ms']:>9.2f}"
+        )
+    if result.get("login_options_median_gap_ms") is not None:
+        print(f"login_options known/unknown p50 gap: {result['login_options_median_gap_ms']:.3f} ms")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="login")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--users", type=int, default=8, help="virtual users (browsers)")
+    parser.add_argument("--concurrency", type=int, dest="users", help="alias for --users")
+    parser.add_argument("--passkeys", type=int, default=1, help="passkeys registered per user")
+    parser.add_argument("--flows", type=int, default=1000, help="closed loop: total flows")
+    parser.add_argument("--rate", type=float, default=0.0, help="open loop: flows per second")
+    parser.add_argument("--duration", type=float, default=0.0, help="seconds (required with --rate)")
+    parser.add_argument("--poisson", action="store_true", help="open loop: exponential inter-arrivals")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--db", help="in-process DB path (default: fresh temp file)")
+    parser.add_argument("--json", dest="json_path", help="write the result as JSON to this path")
+    parser.add_argument(
+        "--max-median-gap-ms",
+        type=float,
+        help="login-options-timing: fail if known/unknown p50 differ by more than this",
+    )
+    args = parser.parse_args(argv)
+    if args.rate and not args.duration:
+        parser.error("--rate needs --duration")
+    return args
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    if not args.url:
+        # Must happen before config is imported through main.
+        os.environ["DB_PATH"] = args.db or os.path.join(tempfile.mkdtemp(prefix="passkeys-bench-"), "bench.sqlite3")
+        os.environ.setdefault("ORIGIN", "http://localhost:8000")
+        # Every simulated client shares one IP and a few usernames.
+        os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if any(s["errors"] for s in result["endpoints"].values()):
+        sys.exit(1)
+    gap = result.get("login_options_median_gap_ms")
+    if args.max_median_gap_ms is not None and gap is not None and gap > args.max_median_gap_ms:
+        print(f"median gap {gap:.3f} ms exceeds {args.max_median_gap_ms} ms", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import asyncio
+import random
+
+import bench
+
+
+def test_histogram_percentiles_within_precision():
+    h = bench.LatencyHistogram()
+    values = [random.randint(1, 5_000_000) for _ in range(20000)]
+    for v in values:
+        h.record(v)
+    values.sort()
+    for p in (50, 90, 99, 99.9):
+        exact = values[max(0, int(-(-p * len(values) // 100)) - 1)]
+        assert abs(h.percentile(p) - exact) <= exact / 100 + 1
+    assert h.percentile(100) == values[-1]
+
+
+def test_histogram_merge():
+    a, b = bench.LatencyHistogram(), bench.LatencyHistogram()
+    for v in range(1, 101):
+        (a if v % 2 else b).record(v)
+    a.merge(b)
+    assert a.total == 100 and a.min == 1 and a.max == 100
+    assert a.percentile(50) == 50
+
+
+def test_in_process_login_flow():
+    args = bench.parse_args(["--scenario", "login", "--users", "2", "--flows", "6"])
+    result = asyncio.run(bench.run(args))
+    endpoints = result["endpoints"]
+    assert endpoints["flow"]["count"] == 6
+    assert endpoints["login_verify"]["errors"] == 0
+    assert endpoints["login_verify"]["status"] == {"200": 6}
+
+
+def test_login_options_timing_scenario_pads_unknown_users():
+    args = bench.parse_args(["--scenario", "login-options-timing", "--users", "2", "--flows", "4"])
+    result = asyncio.run(bench.run(args))
+    endpoints = result["endpoints"]
+    assert endpoints["flow"]["errors"] == 0
+    assert endpoints["login_options_known"]["count"] == 4
+    assert endpoints["login_options_unknown"]["count"] == 4
+    assert result["login_options_median_gap_ms"] is not None
+
+
+def test_in_process_usernameless_login_flow():
+    args = bench.parse_args(["--scenario", "login-usernameless", "--users", "2", "--flows", "4"])
+    result = asyncio.run(bench.run(args))
+    endpoints = result["endpoints"]
+    assert endpoints["login_verify"]["status"] == {"200": 4}
+
+
+def test_options_bench_runs():
+    import options_bench
+
+    results = options_bench.run(iterations=20, credentials=2)
+    assert results["login/template-json"]["bytes"] == results["login/legacy"]["bytes"]
+    assert results["register/template-json"]["bytes"] == results["register/legacy"]["bytes"]
+
+
+def test_session_bench_runs():
+    import session_bench
+
+    results = session_bench.run(iterations=20)
+    assert set(results) == {f"{k}/{m}" for k in ("untouched", "read", "write") for m in ("starlette", "compact")}
+    assert results["read/compact"]["cookie_bytes"] < results["read/starlette"]["cookie_bytes"]
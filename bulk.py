@@ -0,0 +1,250 @@
+"""Bulk export/import of users and credentials in a streaming binary format.
+
+    python bulk.py export dump.pkb [--reencrypt]
+    python bulk.py import dump.pkb [--reencrypt] [--batch-size 1000]
+
+Use "-" for stdout/stdin. Both directions read and write in fixed-size
+batches, one transaction per batch, so memory use does not grow with the
+table.
+
+Format: the 8-byte magic b"PKBULK\\x00\\x01", then frames of a 1-byte tag and
+a 4-byte big-endian length, then the payload. A payload is a sequence of
+fields, each with a 4-byte length prefix:
+
+    U  username, user_handle, source user id
+    C  source user id, credential_id_hash, credential_id_enc, public_key_enc,
+       sign_count, transports_mask, device_type, backed_up
+    E  user count, credential count (must be last)
+
+Every user's C frames directly follow its U frame. Blobs stay encrypted in the
+file. Their AAD binds them to the source user id. An import that lands a user
+on a different id decrypts and re-encrypts the user's credentials under the
+current key, so the importing node needs the source key in CRED_ENC_OLD_KEYS
+if the keys differ. With --reencrypt every blob is rewritten under the
+current key: on export, so the receiver only needs that key, or on import.
+"""
+import argparse
+import struct
+import sys
+import time
+from typing import BinaryIO, Iterator, NamedTuple, Optional
+
+import crypto_store
+import db
+from config import BULK_BATCH_SIZE
+
+MAGIC = b"PKBULK\x00\x01"
+_FRAME = struct.Struct(">cI")
+_LEN = struct.Struct(">I")
+_U64 = struct.Struct(">Q")
+
+class BulkFormatError(ValueError):
+    pass
+
+class BulkStats(NamedTuple):
+    users: int
+    credentials: int
+    skipped_users: int = 0
+    skipped_credentials: int = 0
+    reencrypted: int = 0
+
+def _u64(n: int) -> bytes:
+    return _U64.pack(n)
+
+def _int(b: bytes) -> int:
+    return int.from_bytes(b, "big")
+
+def write_frame(out: BinaryIO, tag: bytes, *fields: bytes) -> None:
+    payload = b"".join(_LEN.pack(len(f)) + f for f in fields)
+    out.write(_FRAME.pack(tag, len(payload)))
+    out.write(payload)
+
+def _read_exact(inp: BinaryIO, n: int) -> bytes:
+    buf = inp.read(n)
+    if len(buf) != n:
+        raise BulkFormatError("truncated input")
+    return buf
+
+def read_frames(inp: BinaryIO) -> Iterator[tuple[bytes, list[bytes]]]:
+    if inp.read(len(MAGIC)) != MAGIC:
+        raise BulkFormatError("not a passkeys bulk file")
+    while True:
+        head = inp.read(_FRAME.size)
+        if not head:
+            raise BulkFormatError("missing end frame")
+        if len(head) != _FRAME.size:
+            raise BulkFormatError("truncated input")
+        tag, length = _FRAME.unpack(head)
+        payload = memoryview(_read_exact(inp, length))
+        fields, pos = [], 0
+        while pos < length:
+            if pos + _LEN.size > length:
+                raise BulkFormatError("corrupt frame")
+            (n,) = _LEN.unpack_from(payload, pos)
+            pos += _LEN.size
+            if pos + n > length:
+                raise BulkFormatError("corrupt frame")
+            fields.append(bytes(payload[pos : pos + n]))
+            pos += n
+        yield tag, fields
+        if tag == b"E":
+            return
+
+def _rewrap(
+    keyring: crypto_store.Keyring, blobs: list[bytes], src_user_id: int, dst_user_id: int, force: bool
+) -> Optional[list[bytes]]:
+    """Re-encrypt `blobs` for `dst_user_id`'s AAD, or None if they can be copied."""
+    if not force and src_user_id == dst_user_id:
+        return None
+    src_aad = crypto_store._aad(src_user_id)
+    dst_aad = crypto_store._aad(dst_user_id)
+    plain = [keyring.decrypt(b, src_aad) for b in blobs]
+    return keyring.encrypt_many([(p, dst_aad) for p in plain])
+
+def export_credentials(
+    out: BinaryIO,
+    batch_size: int = BULK_BATCH_SIZE,
+    reencrypt: bool = False,
+    keyring: crypto_store.Keyring = crypto_store.keyring,
+) -> BulkStats:
+    out.write(MAGIC)
+    users = creds = rewrapped = 0
+    last_id = 0
+    while True:
+        batch, cred_rows = db.export_batch(last_id, batch_size)
+        if not batch:
+            break
+        last_id = int(batch[-1]["id"])
+        by_user: dict[int, list] = {}
+        for row in cred_rows:
+            by_user.setdefault(int(row["user_id"]), []).append(row)
+
+        for u in batch:
+            uid = int(u["id"])
+            write_frame(out, b"U", u["username"].encode("utf-8"), bytes(u["user_handle"]), _u64(uid))
+            users += 1
+            for c in by_user.get(uid, ()):
+                blobs = [bytes(c["credential_id_enc"]), bytes(c["public_key_enc"])]
+                if reencrypt:
+                    blobs = _rewrap(keyring, blobs, uid, uid, force=True)
+                    rewrapped += 1
+                write_frame(
+                    out,
+                    b"C",
+                    _u64(uid),
+                    bytes(c["credential_id_hash"]),
+                    blobs[0],
+                    blobs[1],
+                    _u64(int(c["sign_count"])),
+                    _u64(int(c["transports_mask"])),
+                    (c["device_type"] or "").encode("utf-8"),
+                    b"\x01" if c["backed_up"] else b"\x00",
+                )
+                creds += 1
+    write_frame(out, b"E", _u64(users), _u64(creds))
+    return BulkStats(users, creds, reencrypted=rewrapped)
+
+class _ImportBatch:
+    def __init__(self) -> None:
+        self.users: list[tuple[str, bytes, int]] = []
+        self.creds: list[list[bytes]] = []
+
+    def __len__(self) -> int:
+        return len(self.users) + len(self.creds)
+
+def import_credentials(
+    inp: BinaryIO,
+    batch_size: int = BULK_BATCH_SIZE,
+    reencrypt: bool = False,
+    keyring: crypto_store.Keyring = crypto_store.keyring,
+) -> BulkStats:
+    """Load a bulk file; existing credentials (by hash) are left untouched."""
+    totals = {"users": 0, "credentials": 0, "skipped_users": 0, "skipped_credentials": 0, "reencrypted": 0}
+    seen_users = seen_creds = 0
+    batch = _ImportBatch()
+
+    def flush() -> None:
+        if not batch.users and not batch.creds:
+            return
+        ids = db.upsert_users([(name, handle) for name, handle, _ in batch.users])
+        id_map = {src: dst for (_, _, src), dst in zip(batch.users, ids)}
+        totals["users"] += sum(1 for i in ids if i is not None)
+        totals["skipped_users"] += sum(1 for i in ids if i is None)
+
+        rows = []
+        for f in batch.creds:
+            src = _int(f[0])
+            dst = id_map.get(src)
+            if dst is None:
+                totals["skipped_credentials"] += 1
+                continue
+            blobs = [f[2], f[3]]
+            new = _rewrap(keyring, blobs, src, dst, force=reencrypt)
+            if new is not None:
+                blobs = new
+                totals["reencrypted"] += 1
+            device_type = f[6].decode("utf-8") or None
+            rows.append((dst, f[1], blobs[0], blobs[1], _int(f[4]), _int(f[5]), device_type, f[7] == b"\x01"))
+
+        inserted = db.insert_credentials(rows) if rows else 0
+        totals["credentials"] += inserted
+        totals["skipped_credentials"] += len(rows) - inserted
+        for dst in set(r[0] for r in rows):
+            crypto_store.forget_credential(None, dst)
+        batch.users.clear()
+        batch.creds.clear()
+
+    for tag, fields in read_frames(inp):
+        if tag == b"U":
+            if len(fields) != 3:
+                raise BulkFormatError("bad user frame")
+            # Only cut batches at user boundaries, so every C frame's user is
+            # in the same batch.
+            if len(batch) >= batch_size:
+                flush()
+            batch.users.append((fields[0].decode("utf-8"), fields[1], _int(fields[2])))
+            seen_users += 1
+        elif tag == b"C":
+            if len(fields) != 8 or not batch.users or _int(fields[0]) != batch.users[-1][2]:
+                raise BulkFormatError("credential frame out of place")
+            batch.creds.append(fields)
+            seen_creds += 1
+        elif tag == b"E":
+            if len(fields) != 2 or (_int(fields[0]), _int(fields[1])) != (seen_users, seen_creds):
+                raise BulkFormatError("record counts do not match end frame")
+        else:
+            raise BulkFormatError(f"unknown frame {tag!r}")
+    flush()
+    return BulkStats(**totals)
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help='bulk file, or "-" for stdout/stdin')
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument("--reencrypt", action="store_true", help="rewrite every blob under the current key")
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    t0 = time.perf_counter()
+    try:
+        if args.command == "export":
+            if args.path == "-":
+                stats = export_credentials(sys.stdout.buffer, args.batch_size, args.reencrypt)
+            else:
+                with open(args.path, "wb") as f:
+                    stats = export_credentials(f, args.batch_size, args.reencrypt)
+        else:
+            if args.path == "-":
+                stats = import_credentials(sys.stdin.buffer, args.batch_size, args.reencrypt)
+            else:
+                with open(args.path, "rb") as f:
+                    stats = import_credentials(f, args.batch_size, args.reencrypt)
+    finally:
+        db.close_pool()
+    elapsed = time.perf_counter() - t0
+    fields = " ".join(f"{k}={v}" for k, v in stats._asdict().items())
+    print(f"{args.command}: {fields} elapsed={elapsed:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import io
+import secrets
+
+import pytest
+
+import bulk
+import crypto_store
+import db
+
+
+@pytest.fixture
+def use_db(tmp_path, monkeypatch):
+    pools = []
+
+    def switch(name):
+        pool = db.ConnectionPool(path=str(tmp_path / name))
+        pools.append(pool)
+        monkeypatch.setattr(db, "_pool", pool)
+        db.init_db()
+
+    yield switch
+    for p in pools:
+        p.close()
+
+
+def _seed(ring, users, per_user):
+    out = {}
+    for u in range(users):
+        user = db.get_or_create_user(f"bulk-{u}", user_handle=secrets.token_bytes(16))
+        aad = crypto_store._aad(user["id"])
+        for i in range(per_user):
+            cid = b"cid-%d-%d" % (u, i)
+            cid_enc, pk_enc = ring.encrypt_many([(cid, aad), (b"pk-" + cid, aad)])
+            db.insert_or_replace_credential(
+                user["id"], crypto_store.sha256(cid), cid_enc, pk_enc, i, 8, "single_device", False
+            )
+            out[cid] = user["username"]
+    return out
+
+
+def _contents(ring):
+    out = {}
+    for u in db.list_users_after(0, 1000):
+        aad = crypto_store._aad(u["id"])
+        for c in db.list_credentials_for_users([u["id"]]):
+            cid = ring.decrypt(bytes(c["credential_id_enc"]), aad)
+            assert ring.decrypt(bytes(c["public_key_enc"]), aad) == b"pk-" + cid
+            out[cid] = u["username"]
+    return out
+
+
+def test_round_trip_remaps_user_ids_and_reencrypts(use_db):
+    keys = {1: secrets.token_bytes(32), 2: secrets.token_bytes(32)}
+    src_ring = crypto_store.Keyring(1, {1: keys[1]})
+    dst_ring = crypto_store.Keyring(2, keys)
+
+    use_db("src.sqlite3")
+    seeded = _seed(src_ring, users=5, per_user=3)
+    buf = io.BytesIO()
+    stats = bulk.export_credentials(buf, batch_size=2, keyring=src_ring)
+    assert (stats.users, stats.credentials) == (5, 15)
+
+    use_db("dst.sqlite3")
+    # Shift ids so every imported user lands on a different user_id.
+    db.get_or_create_user("already-here", user_handle=secrets.token_bytes(16))
+    buf.seek(0)
+    stats = bulk.import_credentials(buf, batch_size=4, keyring=dst_ring)
+    assert (stats.users, stats.credentials, stats.reencrypted) == (5, 15, 15)
+    assert _contents(dst_ring) == seeded
+    assert {r["transports_mask"] for r in db.list_credentials_for_users(list(range(1, 10)))} == {8}
+
+    # Importing again is a no-op.
+    buf.seek(0)
+    stats = bulk.import_credentials(buf, keyring=dst_ring)
+    assert stats.credentials == 0 and stats.skipped_credentials == 15
+
+
+def test_export_batch_reads_one_snapshot(use_db, monkeypatch):
+    ring = crypto_store.Keyring(1, {1: secrets.token_bytes(32)})
+    use_db("src.sqlite3")
+    _seed(ring, users=2, per_user=1)
+    read_credentials = db._credentials_for_users
+
+    def racing(conn, user_ids):
+        # Another connection commits a credential between the two reads.
+        cid_enc, pk_enc = ring.encrypt_many([(b"late", crypto_store._aad(1))] * 2)
+        db.insert_or_replace_credential(1, crypto_store.sha256(b"late"), cid_enc, pk_enc, 0, 0, None, False)
+        monkeypatch.setattr(db, "_credentials_for_users", read_credentials)
+        return read_credentials(conn, user_ids)
+
+    monkeypatch.setattr(db, "_credentials_for_users", racing)
+    stats = bulk.export_credentials(io.BytesIO(), batch_size=10, keyring=ring)
+    assert (stats.users, stats.credentials) == (2, 2)
+    assert bulk.export_credentials(io.BytesIO(), batch_size=10, keyring=ring).credentials == 3
+
+
+def test_conflicting_user_is_skipped(use_db):
+    ring = crypto_store.Keyring(1, {1: secrets.token_bytes(32)})
+    use_db("src.sqlite3")
+    _seed(ring, users=1, per_user=2)
+    buf = io.BytesIO()
+    bulk.export_credentials(buf, keyring=ring)
+
+    use_db("dst.sqlite3")
+    db.get_or_create_user("bulk-0", user_handle=secrets.token_bytes(16))
+    buf.seek(0)
+    stats = bulk.import_credentials(buf, keyring=ring)
+    assert (stats.skipped_users, stats.skipped_credentials, stats.credentials) == (1, 2, 0)
+
+
+def test_truncated_or_foreign_input_is_rejected(use_db):
+    ring = crypto_store.Keyring(1, {1: secrets.token_bytes(32)})
+    use_db("src.sqlite3")
+    _seed(ring, users=2, per_user=1)
+    buf = io.BytesIO()
+    bulk.export_credentials(buf, keyring=ring)
+    data = buf.getvalue()
+
+    use_db("dst.sqlite3")
+    for bad in (b"not a dump", data[:-5], data[: len(bulk.MAGIC) + 3]):
+        with pytest.raises(bulk.BulkFormatError):
+            bulk.import_credentials(io.BytesIO(bad), keyring=ring)
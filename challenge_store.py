@@ -0,0 +1,180 @@
+import secrets
+import threading
+import time
+from typing import Callable, NamedTuple, Optional, Protocol
+
+import db
+from config import (
+    CHALLENGE_STORE,
+    CHALLENGE_TTL_SECONDS,
+    CHALLENGE_STORE_MAX_ENTRIES,
+    CHALLENGE_SWEEP_INTERVAL_SECONDS,
+)
+
+class Challenge(NamedTuple):
+    kind: str
+    challenge: bytes
+    username: Optional[str]
+    issued_at: float
+    # Account `username` resolved to at issue time; None if it has none.
+    user_id: Optional[int] = None
+
+class ChallengeStore(Protocol):
+    # True when calls do I/O and should go through executors.run_db.
+    blocking: bool
+
+    def issue(
+        self, kind: str, challenge: bytes, username: Optional[str] = None, user_id: Optional[int] = None
+    ) -> str: ...
+
+    def consume(self, handle: str, kind: str) -> Optional[Challenge]: ...
+
+    def sweep(self) -> int: ...
+
+    def start(self) -> None: ...
+
+    def stop(self) -> None: ...
+
+def new_handle() -> str:
+    return secrets.token_urlsafe(16)
+
+class _Sweeper:
+    def __init__(self, sweep: Callable[[], int], interval_seconds: float) -> None:
+        self._sweep = sweep
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self._sweep()
+            except Exception:
+                pass
+
+    def start(self) -> None:
+        if self._thread is not None or self.interval_seconds <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="challenge-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+class MemoryChallengeStore:
+    """Process-local store; use SqliteChallengeStore when running several workers."""
+
+    blocking = False
+
+    def __init__(
+        self,
+        ttl_seconds: float = CHALLENGE_TTL_SECONDS,
+        max_entries: int = CHALLENGE_STORE_MAX_ENTRIES,
+        sweep_interval_seconds: float = CHALLENGE_SWEEP_INTERVAL_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Insertion-ordered, so the first key is always the oldest challenge.
+        self._items: dict[str, Challenge] = {}
+        self._sweeper = _Sweeper(self.sweep, sweep_interval_seconds)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def issue(
+        self, kind: str, challenge: bytes, username: Optional[str] = None, user_id: Optional[int] = None
+    ) -> str:
+        handle = new_handle()
+        item = Challenge(kind, challenge, username, self.clock(), user_id)
+        with self._lock:
+            if len(self._items) >= self.max_entries:
+                self._sweep_locked()
+                while len(self._items) >= self.max_entries:
+                    del self._items[next(iter(self._items))]
+            self._items[handle] = item
+        return handle
+
+    def consume(self, handle: str, kind: str) -> Optional[Challenge]:
+        with self._lock:
+            item = self._items.pop(handle, None)
+        if item is None or item.kind != kind:
+            return None
+        if self.clock() - item.issued_at > self.ttl_seconds:
+            return None
+        return item
+
+    def _sweep_locked(self) -> int:
+        cutoff = self.clock() - self.ttl_seconds
+        expired = [h for h, item in self._items.items() if item.issued_at < cutoff]
+        for h in expired:
+            del self._items[h]
+        return len(expired)
+
+    def sweep(self) -> int:
+        with self._lock:
+            return self._sweep_locked()
+
+    def start(self) -> None:
+        self._sweeper.start()
+
+    def stop(self) -> None:
+        self._sweeper.stop()
+
+class SqliteChallengeStore:
+    """Challenges in the `challenges` table, shared by every worker on the host.
+
+    `consume` is a single `DELETE ... RETURNING`, so two workers racing on the
+    same handle cannot both get the challenge.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        ttl_seconds: float = CHALLENGE_TTL_SECONDS,
+        sweep_interval_seconds: float = CHALLENGE_SWEEP_INTERVAL_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._sweeper = _Sweeper(self.sweep, sweep_interval_seconds)
+
+    def issue(
+        self, kind: str, challenge: bytes, username: Optional[str] = None, user_id: Optional[int] = None
+    ) -> str:
+        handle = new_handle()
+        db.insert_challenge(handle, kind, challenge, username, self.clock(), user_id)
+        return handle
+
+    def consume(self, handle: str, kind: str) -> Optional[Challenge]:
+        row = db.consume_challenge(handle)
+        if row is None or row["kind"] != kind:
+            return None
+        if self.clock() - row["issued_at"] > self.ttl_seconds:
+            return None
+        return Challenge(row["kind"], bytes(row["challenge"]), row["username"], row["issued_at"], row["user_id"])
+
+    def sweep(self) -> int:
+        return db.delete_challenges_before(self.clock() - self.ttl_seconds)
+
+    def start(self) -> None:
+        self._sweeper.start()
+
+    def stop(self) -> None:
+        self._sweeper.stop()
+
+def make_store(kind: str = CHALLENGE_STORE) -> ChallengeStore:
+    if kind == "memory":
+        return MemoryChallengeStore()
+    if kind == "sqlite":
+        return SqliteChallengeStore()
+    raise RuntimeError(f"unknown CHALLENGE_STORE {kind!r} (expected 'memory' or 'sqlite')")
+
+store = make_store()
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+import db
+from challenge_store import MemoryChallengeStore, SqliteChallengeStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request):
+    clock = FakeClock()
+    if request.param == "memory":
+        s = MemoryChallengeStore(ttl_seconds=60, max_entries=100, sweep_interval_seconds=0, clock=clock)
+    else:
+        db.init_db()
+        s = SqliteChallengeStore(ttl_seconds=60, sweep_interval_seconds=0, clock=clock)
+    s.clock_ref = clock
+    return s
+
+
+def test_consume_is_single_use(store):
+    handle = store.issue("login", b"c" * 32, "alice")
+    item = store.consume(handle, "login")
+    assert item.challenge == b"c" * 32 and item.username == "alice"
+    assert store.consume(handle, "login") is None
+
+
+def test_user_id_round_trips(store):
+    assert store.consume(store.issue("login", b"c" * 32, "alice", 42), "login").user_id == 42
+    assert store.consume(store.issue("login", b"c" * 32, "bob"), "login").user_id is None
+
+
+def test_wrong_kind_burns_handle(store):
+    handle = store.issue("register", b"c" * 32, "alice")
+    assert store.consume(handle, "login") is None
+    assert store.consume(handle, "register") is None
+
+
+def test_ttl_expiry_and_sweep(store):
+    handle = store.issue("login", b"c" * 32)
+    store.clock_ref.now += 61
+    assert store.consume(handle, "login") is None
+
+    store.issue("login", b"d" * 32)
+    store.clock_ref.now += 61
+    assert store.sweep() >= 1
+
+
+def test_concurrent_consume_has_one_winner(store):
+    handle = store.issue("login", b"c" * 32)
+    results = []
+    barrier = threading.Barrier(8)
+
+    def worker():
+        barrier.wait()
+        results.append(store.consume(handle, "login"))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(r is not None for r in results) == 1
+
+
+def test_memory_store_is_bounded():
+    s = MemoryChallengeStore(ttl_seconds=60, max_entries=3, sweep_interval_seconds=0)
+    handles = [s.issue("login", bytes([i]) * 32) for i in range(5)]
+    assert len(s) == 3
+    assert s.consume(handles[0], "login") is None
+    assert s.consume(handles[-1], "login") is not None
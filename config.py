@@ -1,5 +1,5 @@
+import base64
 import os
-from webauthn import base64url_to_bytes
 import secrets
 
 # Local dev defaults
@@ -10,15 +10,127 @@ RP_NAME = os.getenv("RP_NAME", "localhost")
 SESSION_SECRET = os.getenv("SESSION_SECRET", "dev-only-change-me")
 DB_PATH = os.getenv("DB_PATH", "webauthn.sqlite3")
 
+# Connection pool: one long-lived connection per slot, WAL journaling.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_POOL_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT_SECONDS", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "128"))
+
+# User/credential storage: "sqlite" (DB_PATH, one host) or "postgres"
+# (POSTGRES_DSN, shared by every node behind the load balancer).
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").strip().lower()
+POSTGRES_DSN = os.getenv("POSTGRES_DSN", "")
+POSTGRES_POOL_MIN_SIZE = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2"))
+POSTGRES_POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX_SIZE", str(DB_POOL_SIZE)))
+
+# Blocking DB and AES work runs on these thread pools, off the event loop.
+# DB workers default to the pool size so a worker never waits for a connection.
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_SIZE)))
+CRYPTO_EXECUTOR_WORKERS = int(os.getenv("CRYPTO_EXECUTOR_WORKERS", "2"))
+
 CHALLENGE_TTL_SECONDS = int(os.getenv("CHALLENGE_TTL_SECONDS", "120"))
 
+# Server-side challenge store: "memory" (single process) or "sqlite" (shared).
+CHALLENGE_STORE = os.getenv("CHALLENGE_STORE", "memory").strip().lower()
+CHALLENGE_STORE_MAX_ENTRIES = int(os.getenv("CHALLENGE_STORE_MAX_ENTRIES", "100000"))
+CHALLENGE_SWEEP_INTERVAL_SECONDS = float(os.getenv("CHALLENGE_SWEEP_INTERVAL_SECONDS", "30"))
+
+# login/options always returns a multiple of this many allowCredentials,
+# padding with stable decoys, and does the same AES work for every username.
+LOGIN_OPTIONS_SLOTS = int(os.getenv("LOGIN_OPTIONS_SLOTS", "4"))
+# Keys the decoys. It must outlive key rotations and restarts: decoys that
+# change while real IDs stay put give unknown usernames away.
+LOGIN_DECOY_SECRET = os.getenv("LOGIN_DECOY_SECRET", SESSION_SECRET)
+# How often the stored credential ID lengths (unknown users' decoy lengths)
+# are re-read; a full scan of credentials, grouped by blob length.
+LOGIN_DECOY_LENGTHS_REFRESH_SECONDS = float(os.getenv("LOGIN_DECOY_LENGTHS_REFRESH_SECONDS", "3600"))
+
+# Admission control in front of the auth endpoints (admission.py).
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", "32768"))
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+# Token buckets: sustained requests per second and burst size.
+RATE_LIMIT_IP_PER_SECOND = float(os.getenv("RATE_LIMIT_IP_PER_SECOND", "10"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "40"))
+RATE_LIMIT_USER_PER_SECOND = float(os.getenv("RATE_LIMIT_USER_PER_SECOND", "0.5"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "10"))
+# "memory" (per process) or "sqlite" (shared by every worker on the host).
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory").strip().lower()
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Use the first X-Forwarded-For hop as the client IP (only behind a trusted proxy).
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0").strip().lower() in ("1", "true", "yes")
+
+# Multi-worker mode (serve.py turns this on): per-process caches follow a
+# generation counter in a shared memory-mapped file next to the database.
+SHARED_STATE = os.getenv("SHARED_STATE", "0").strip().lower() in ("1", "true", "yes")
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", DB_PATH + ".state")
+# Held while migrations run, so only one process applies them.
+INIT_LOCK_PATH = os.getenv("INIT_LOCK_PATH", DB_PATH + ".init.lock")
+
+# Decrypted credential cache (0 entries or 0 TTL disables it).
+CRED_CACHE_MAX_ENTRIES = int(os.getenv("CRED_CACHE_MAX_ENTRIES", "10000"))
+CRED_CACHE_TTL_SECONDS = float(os.getenv("CRED_CACHE_TTL_SECONDS", "300"))
+# Sign-count write-behind interval; 0 writes every update through immediately.
+SIGN_COUNT_FLUSH_INTERVAL_MS = int(os.getenv("SIGN_COUNT_FLUSH_INTERVAL_MS", "0"))
+# Parsed public-key objects kept by verifier.VerificationEngine.
+VERIFIER_KEY_CACHE_SIZE = int(os.getenv("VERIFIER_KEY_CACHE_SIZE", "10000"))
+
+# Auth event log (audit.py): "sqlite" (auth_events table in DB_PATH), "file"
+# (rotating length-prefixed segments in AUDIT_DIR) or "off".
+AUDIT_SINK = os.getenv("AUDIT_SINK", "sqlite").strip().lower()
+AUDIT_DIR = os.getenv("AUDIT_DIR", DB_PATH + ".audit")
+# Events held in memory; past this, new events are dropped and counted.
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+# Background flush interval, and events per transaction / file write.
+AUDIT_FLUSH_INTERVAL_MS = int(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "500"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "1000"))
+# File sink: start a new segment once the current one reaches this size.
+AUDIT_SEGMENT_BYTES = int(os.getenv("AUDIT_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+
+# Encoder for the dynamic parts of options responses: "auto" (orjson when
+# installed), "orjson" or "json".
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").strip().lower()
+
+# Served from memory by assets.py; read once at startup.
+STATIC_DIR = os.getenv("STATIC_DIR", "static")
+
+# Expose Prometheus text metrics at /metrics.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+
+def _b64url_decode(value: str) -> bytes:
+    # Not py_webauthn's: importing it here would load the whole package at startup.
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
 # AES-256-GCM key in base64url (no padding) for credential encryption at rest.
 ENC_KEY_B64URL = os.getenv("CRED_ENC_KEY_B64URL", "").strip()
 if ENC_KEY_B64URL:
-    ENC_KEY = base64url_to_bytes(ENC_KEY_B64URL)
+    ENC_KEY = _b64url_decode(ENC_KEY_B64URL)
 else:
     # Dev fallback: volatile key; DB becomes unreadable after restart. Not for prod.
     ENC_KEY = secrets.token_bytes(32)
 
 if len(ENC_KEY) != 32:
-    raise RuntimeError("CRED_ENC_KEY_B64URL must decode to exactly 32 bytes.")
\ No newline at end of file
+    raise RuntimeError("CRED_ENC_KEY_B64URL must decode to exactly 32 bytes.")
+
+# Key ID (1-255) stamped on every newly written blob; ENC_KEY belongs to it.
+ENC_KEY_ID = int(os.getenv("CRED_ENC_KEY_ID", "1"))
+if not 1 <= ENC_KEY_ID <= 255:
+    raise RuntimeError("CRED_ENC_KEY_ID must be between 1 and 255.")
+
+# Retired keys, still accepted for decryption while rows are re-encrypted:
+# "kid:base64url,kid:base64url".
+ENC_OLD_KEYS: dict[int, bytes] = {}
+for _item in filter(None, (x.strip() for x in os.getenv("CRED_ENC_OLD_KEYS", "").split(","))):
+    _kid, _, _b64 = _item.partition(":")
+    _key = _b64url_decode(_b64.strip())
+    if not _kid.strip().isdigit() or not 1 <= int(_kid) <= 255 or len(_key) != 32:
+        raise RuntimeError("CRED_ENC_OLD_KEYS entries must be kid:key with kid 1-255 and a 32-byte key.")
+    ENC_OLD_KEYS[int(_kid)] = _key
+if ENC_KEY_ID in ENC_OLD_KEYS:
+    raise RuntimeError("CRED_ENC_OLD_KEYS must not reuse CRED_ENC_KEY_ID.")
+
+# bulk.py export/import: users per read batch / records per write transaction.
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+
+# Online re-encryption (rotate_keys.py): rows per transaction and pause between batches.
+KEY_ROTATION_BATCH_SIZE = int(os.getenv("KEY_ROTATION_BATCH_SIZE", "500"))
+KEY_ROTATION_PAUSE_MS = int(os.getenv("KEY_ROTATION_PAUSE_MS", "50"))
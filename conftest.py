@@ -0,0 +1,34 @@
+import os
+import tempfile
+import time
+
+import pytest
+
+# Keep test runs away from the checked-in webauthn.sqlite3.
+os.environ.setdefault(
+    "DB_PATH", os.path.join(tempfile.mkdtemp(prefix="passkeys-test-"), "webauthn.sqlite3")
+)
+# Tests drive many flows from one client; admission_test covers the limits.
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+# Scripts that need a live `uvicorn main:app` server; run them by hand.
+collect_ignore = ["timing_test.py"]
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _schema():
+    # main.py migrates in its lifespan, which a bare TestClient(app) never runs.
+    import db
+
+    db.init_db()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Challenge-store time, moved by hand: `clock.advance(seconds)`."""
+    import challenge_store
+    from soft_authenticator import ManualClock
+
+    manual = ManualClock(time.time())
+    monkeypatch.setattr(challenge_store.store, "clock", manual)
+    return manual
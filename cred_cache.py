@@ -0,0 +1,265 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from config import CRED_CACHE_MAX_ENTRIES, CRED_CACHE_TTL_SECONDS
+
+class CredentialRecord(NamedTuple):
+    cred_hash: bytes
+    user_id: int
+    credential_id: bytes
+    public_key: bytes
+    sign_count: int
+
+class _Entry:
+    __slots__ = ("user_id", "credential_id", "public_key", "sign_count", "expires_at")
+
+    def __init__(self, user_id: int, credential_id: bytes, public_key: bytes, sign_count: int, expires_at: float):
+        self.user_id = user_id
+        # bytearrays so the plaintext can be overwritten in place on eviction.
+        self.credential_id = bytearray(credential_id)
+        self.public_key = bytearray(public_key)
+        self.sign_count = sign_count
+        self.expires_at = expires_at
+
+    def wipe(self) -> None:
+        for buf in (self.credential_id, self.public_key):
+            for i in range(len(buf)):
+                buf[i] = 0
+
+class CredentialCache:
+    """Bounded LRU/TTL cache of decrypted credentials.
+
+    Entries are keyed by `credential_id_hash`; a secondary index remembers
+    the full set of hashes for a user so `register_options` can be served
+    without touching SQLite. Evicted or invalidated entries are zeroed.
+    Callers only ever get `bytes` copies, never the cached buffers.
+
+    Every invalidation bumps a generation. A caller takes `generation()`
+    before reading rows and passes it to `put`, which drops the rows if an
+    invalidation happened in between: a credential revoked while a lookup
+    was in flight does not come back from the stale read.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CRED_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = CRED_CACHE_TTL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, _Entry]" = OrderedDict()
+        self._users: "OrderedDict[int, tuple[bytes, ...]]" = OrderedDict()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, cred_hash: bytes) -> None:
+        entry = self._entries.pop(cred_hash, None)
+        if entry is not None:
+            entry.wipe()
+            self._users.pop(entry.user_id, None)
+
+    def _live(self, cred_hash: bytes, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(cred_hash)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._drop(cred_hash)
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(cred_hash)
+        return entry
+
+    def generation(self) -> int:
+        """Token for `put`; take it before reading the rows to be cached."""
+        return self._generation
+
+    def get(self, cred_hash: bytes) -> Optional[CredentialRecord]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._live(cred_hash, self._clock())
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return CredentialRecord(
+                cred_hash, entry.user_id, bytes(entry.credential_id), bytes(entry.public_key), entry.sign_count
+            )
+
+    def get_user_credential_ids(self, user_id: int) -> Optional[list[bytes]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            hashes = self._users.get(user_id)
+            if hashes is None:
+                self.misses += 1
+                return None
+            now = self._clock()
+            out = []
+            for h in hashes:
+                entry = self._live(h, now)
+                if entry is None:
+                    self._users.pop(user_id, None)
+                    self.misses += 1
+                    return None
+                out.append(bytes(entry.credential_id))
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return out
+
+    def put(
+        self,
+        records: Iterable[CredentialRecord],
+        user_id: Optional[int] = None,
+        generation: Optional[int] = None,
+    ) -> None:
+        """Cache `records`; pass `user_id` when they are the user's complete set.
+
+        With `generation`, nothing is cached if anything was invalidated since
+        that token was taken.
+        """
+        if not self.enabled:
+            return
+        records = list(records)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            expires_at = self._clock() + self.ttl_seconds
+            for r in records:
+                self._drop(r.cred_hash)
+                self._entries[r.cred_hash] = _Entry(r.user_id, r.credential_id, r.public_key, r.sign_count, expires_at)
+            if user_id is not None:
+                self._users[user_id] = tuple(r.cred_hash for r in records)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+            while len(self._users) > self.max_entries:
+                self._users.popitem(last=False)
+
+    def set_sign_count(self, cred_hash: bytes, sign_count: int) -> None:
+        with self._lock:
+            entry = self._entries.get(cred_hash)
+            if entry is not None:
+                entry.sign_count = sign_count
+
+    def invalidate(self, cred_hash: Optional[bytes] = None, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            self._generation += 1
+            if cred_hash is not None:
+                self._drop(cred_hash)
+            if user_id is not None:
+                for h in self._users.pop(user_id, ()):
+                    self._drop(h)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            for entry in self._entries.values():
+                entry.wipe()
+            self._entries.clear()
+            self._users.clear()
+
+class SignCountWriter:
+    """Write-behind buffer for sign-count updates.
+
+    With `interval_seconds <= 0` every update is written through immediately.
+    Otherwise updates are coalesced per credential and flushed in a single
+    transaction by a background thread (and on `stop()`).
+    """
+
+    def __init__(self, write_many: Callable[[list[tuple]], None], interval_seconds: float) -> None:
+        self._write_many = write_many
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._pending: dict[bytes, tuple] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def write_through(self) -> bool:
+        return self.interval_seconds <= 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def pending_sign_count(self, cred_hash: bytes) -> Optional[int]:
+        with self._lock:
+            item = self._pending.get(cred_hash)
+        return item[1] if item else None
+
+    def submit(
+        self,
+        cred_hash: bytes,
+        sign_count: int,
+        device_type: Optional[str],
+        backed_up: bool,
+        used_at: Optional[float] = None,
+    ) -> bool:
+        """Queue (or write) an update; False if it would not move the count forward.
+
+        `write_many` is expected to compare-and-swap and return how many rows
+        it changed. Buffered updates are checked against the pending count
+        here and against the stored count again at flush.
+        """
+        item = (cred_hash, sign_count, device_type, backed_up, used_at)
+        if self.write_through:
+            return self._write_many([item]) == 1
+        with self._lock:
+            pending = self._pending.get(cred_hash)
+            if pending is not None and sign_count <= pending[1] and not (sign_count == 0 == pending[1]):
+                return False
+            self._pending[cred_hash] = item
+        return True
+
+    def flush(self) -> int:
+        with self._lock:
+            batch = list(self._pending.values())
+            self._pending.clear()
+        if not batch:
+            return 0
+        try:
+            self._write_many(batch)
+        except Exception:
+            # Put the batch back unless a newer update arrived meanwhile.
+            with self._lock:
+                for item in batch:
+                    self._pending.setdefault(item[0], item)
+            raise
+        return len(batch)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def start(self) -> None:
+        if self.write_through or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sign-count-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
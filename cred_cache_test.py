@@ -0,0 +1,188 @@
+import secrets
+
+from fastapi.testclient import TestClient
+
+import crypto_store
+import db
+import webauthn_routes
+from harness import enroll, login
+from main import app
+from cred_cache import CredentialCache, CredentialRecord, SignCountWriter
+
+
+def rec(n: int, user_id: int = 1) -> CredentialRecord:
+    return CredentialRecord(bytes([n]) * 32, user_id, bytes([n]) * 16, bytes([n]) * 77, 0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction_is_bounded_and_wipes():
+    cache = CredentialCache(max_entries=2, ttl_seconds=60)
+    cache.put([rec(1), rec(2)])
+    victim = cache._entries[rec(2).cred_hash]
+    cache.get(rec(1).cred_hash)  # 1 becomes most recently used
+    cache.put([rec(3)])
+
+    assert len(cache) == 2
+    assert cache.get(rec(2).cred_hash) is None
+    assert cache.get(rec(1).cred_hash) is not None
+    assert victim.credential_id == bytearray(16) and victim.public_key == bytearray(77)
+
+
+def test_invalidate_wipes():
+    cache = CredentialCache(max_entries=2, ttl_seconds=60)
+    cache.put([rec(1)])
+    entry = cache._entries[rec(1).cred_hash]
+    cache.invalidate(cred_hash=rec(1).cred_hash)
+    assert cache.get(rec(1).cred_hash) is None
+    assert entry.credential_id == bytearray(16)
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = CredentialCache(max_entries=10, ttl_seconds=5, clock=clock)
+    cache.put([rec(1), rec(2)], user_id=1)
+    assert cache.get_user_credential_ids(1) == [rec(1).credential_id, rec(2).credential_id]
+    clock.now = 6
+    assert cache.get(rec(1).cred_hash) is None
+    assert cache.get_user_credential_ids(1) is None
+
+
+def test_user_index_invalidated_with_member():
+    cache = CredentialCache(max_entries=10, ttl_seconds=60)
+    cache.put([rec(1), rec(2)], user_id=1)
+    cache.invalidate(cred_hash=rec(2).cred_hash)
+    assert cache.get_user_credential_ids(1) is None
+    assert cache.get(rec(1).cred_hash) is not None
+
+
+def test_write_behind_coalesces_updates():
+    batches = []
+    writer = SignCountWriter(batches.append, interval_seconds=60)
+    writer.submit(b"a", 1, None, False)
+    writer.submit(b"a", 2, None, False)
+    writer.submit(b"b", 7, "single_device", False)
+    assert writer.pending_sign_count(b"a") == 2
+    assert writer.flush() == 2
+    assert sorted(batches[0]) == [(b"a", 2, None, False, None), (b"b", 7, "single_device", False, None)]
+    assert writer.pending_sign_count(b"a") is None
+
+
+def test_write_through_when_interval_is_zero():
+    batches = []
+    writer = SignCountWriter(batches.append, interval_seconds=0)
+    writer.submit(b"a", 1, None, False)
+    assert batches == [[(b"a", 1, None, False, None)]]
+
+
+def test_save_credential_invalidates_cache():
+    db.init_db()
+    user = db.get_or_create_user("cache-user", user_handle=secrets.token_bytes(16))
+    crypto_store.save_credential(user["id"], b"cred-1", b"pk-1", 0, ["internal"], None, False)
+
+    assert crypto_store.load_user_credential_ids(user["id"]) == [b"cred-1"]
+    assert crypto_store.cache.get_user_credential_ids(user["id"]) == [b"cred-1"]
+
+    crypto_store.save_credential(user["id"], b"cred-2", b"pk-2", 0, None, None, False)
+    assert crypto_store.cache.get_user_credential_ids(user["id"]) is None
+    assert sorted(crypto_store.load_user_credential_ids(user["id"])) == [b"cred-1", b"cred-2"]
+
+    cred = crypto_store.load_credential(crypto_store.sha256(b"cred-2"))
+    assert cred.public_key == b"pk-2" and cred.user_id == user["id"]
+    crypto_store.update_sign_count(cred.cred_hash, 5, None, False)
+    assert crypto_store.load_credential(cred.cred_hash).sign_count == 5
+    assert db.find_credential_by_hash(cred.cred_hash)["sign_count"] == 5
+
+
+def test_write_behind_rejects_counts_that_do_not_advance():
+    writer = SignCountWriter(lambda items: len(items), interval_seconds=60)
+    assert writer.submit(b"a", 5, None, False)
+    assert not writer.submit(b"a", 5, None, False)
+    assert not writer.submit(b"a", 4, None, False)
+    assert writer.submit(b"z", 0, None, False) and writer.submit(b"z", 0, None, False)
+
+
+def test_sign_count_compare_and_swap():
+    db.init_db()
+    user = db.get_or_create_user("cas-user", user_handle=secrets.token_bytes(16))
+    crypto_store.save_credential(user["id"], b"cas-cred", b"pk", 3, None, None, False)
+    h = crypto_store.sha256(b"cas-cred")
+    assert crypto_store.update_sign_count(h, 4, None, False)
+    assert not crypto_store.update_sign_count(h, 4, None, False)
+    assert not crypto_store.update_sign_count(h, 2, None, False)
+    assert db.find_credential_by_hash(h)["sign_count"] == 4
+
+
+def test_each_lookup_counts_one_hit_or_miss():
+    client = TestClient(app)
+    username = f"ratio-{secrets.token_hex(4)}"
+    authenticator = enroll(client, username)
+    cache = crypto_store.cache
+
+    def verify(cold: bool) -> tuple:
+        options = client.post("/api/login/options", json={"username": username}).json()
+        if cold:
+            cache.clear()
+        before = cache.hits, cache.misses
+        r = client.post("/api/login/verify", json={"credential": authenticator.get(options)})
+        assert r.status_code == 200
+        return cache.hits - before[0], cache.misses - before[1]
+
+    assert verify(cold=True) == (0, 1)
+    assert verify(cold=False) == (1, 0)
+
+    (credential_id,) = authenticator.credentials
+    cache.clear()
+    before = cache.hits, cache.misses
+    assert crypto_store.load_credential(crypto_store.sha256(credential_id)) is not None
+    assert (cache.hits, cache.misses) == (before[0], before[1] + 1)
+
+
+def test_put_that_raced_an_invalidation_is_dropped():
+    cache = CredentialCache(max_entries=10, ttl_seconds=60)
+    token = cache.generation()
+    cache.invalidate(cred_hash=rec(1).cred_hash)
+    cache.put([rec(1)], user_id=1, generation=token)
+    assert cache.get(rec(1).cred_hash) is None and cache.get_user_credential_ids(1) is None
+
+    cache.put([rec(1)], user_id=1, generation=cache.generation())
+    assert cache.get_user_credential_ids(1) == [rec(1).credential_id]
+
+
+def test_credential_revoked_during_a_lookup_stays_revoked(monkeypatch):
+    # Write-behind: a cached copy would be all it takes to keep logging in.
+    monkeypatch.setattr(crypto_store.sign_count_writer, "interval_seconds", 60)
+    client = TestClient(app)
+    username = f"revoke-race-{secrets.token_hex(4)}"
+    authenticator = enroll(client, username)
+    user = db.get_user(username)
+    [listed] = db.list_credentials_page(user["id"], 0, 10)
+    crypto_store.cache.clear()
+
+    backend = webauthn_routes.storage
+    find = backend.find_credential_by_hash
+
+    async def revoked_after_read(cred_hash):
+        row = await find(cred_hash)
+        # The owner revokes the passkey between this login's DB read and its cache put.
+        assert db.delete_credential(user["id"], listed["id"]) == cred_hash
+        crypto_store.forget_credential(cred_hash, user["id"])
+        return row
+
+    monkeypatch.setattr(backend, "find_credential_by_hash", revoked_after_read)
+    login(client, authenticator, username)  # in flight when the revoke landed
+    monkeypatch.undo()
+
+    (credential_id,) = authenticator.credentials
+    assert crypto_store.cache.get(crypto_store.sha256(credential_id)) is None
+    # login/options no longer lists it, but a client can present it anyway.
+    options = client.post("/api/login/options", json={"username": username}).json()
+    assertion = authenticator.get(options, credential_id=credential_id)
+    assert client.post("/api/login/verify", json={"credential": assertion}).status_code == 400
+    crypto_store.sign_count_writer.flush()
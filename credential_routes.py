@@ -0,0 +1,105 @@
+"""Self-service passkey management for the signed-in user.
+
+    GET    /api/credentials?limit=20&cursor=...   list, newest registrations last
+    PATCH  /api/credentials/{id}  {"nickname": "..."}
+    DELETE /api/credentials/{id}
+
+Listing reads metadata columns only; nothing is decrypted. Pages are keyset
+based (`id > cursor`), so every page costs the same however deep it is.
+Revocation drops the credential from every cache, in every worker, before
+the response is sent.
+"""
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request
+
+import admission
+import crypto_store
+import metrics
+import migrations
+from executors import run_db
+from storage import backend as storage
+
+router = APIRouter()
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_NICKNAME_LENGTH = 64
+
+async def _current_user_id(request: Request) -> int:
+    session_user = request.session.get("user")
+    if not session_user:
+        raise HTTPException(status_code=401, detail="not signed in")
+    with metrics.stage("db_lookup"):
+        user = await storage.get_user(session_user["username"])
+    if user is None:
+        raise HTTPException(status_code=401, detail="not signed in")
+    return int(user["id"])
+
+def _int_param(value: Optional[str], default: int, minimum: int) -> int:
+    if value is None:
+        return default
+    if not value.isdigit() or int(value) < minimum:
+        raise HTTPException(status_code=400, detail="invalid request")
+    return int(value)
+
+def _epoch(value) -> Optional[int]:
+    return int(value) if value is not None else None
+
+def _credential_json(row) -> dict:
+    return {
+        "id": int(row["id"]),
+        "nickname": row["nickname"],
+        "created_at": _epoch(row["created_at"]),
+        "last_used_at": _epoch(row["last_used_at"]),
+        "sign_count": int(row["sign_count"]),
+        "transports": migrations.decode_transports(int(row["transports_mask"])),
+        "device_type": row["device_type"],
+        "backed_up": bool(row["backed_up"]),
+    }
+
+@router.get("/api/credentials")
+async def list_credentials(request: Request, limit: Optional[str] = None, cursor: Optional[str] = None):
+    user_id = await _current_user_id(request)
+    limit = min(_int_param(limit, DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    after_id = _int_param(cursor, 0, 0)
+
+    # One extra row tells us whether there is a next page.
+    with metrics.stage("db_lookup"):
+        rows = await storage.list_credentials_page(user_id, after_id, limit + 1)
+    page = rows[:limit]
+    return {
+        "credentials": [_credential_json(r) for r in page],
+        "next_cursor": str(page[-1]["id"]) if len(rows) > limit else None,
+    }
+
+@router.patch("/api/credentials/{cred_id}")
+async def rename_credential(cred_id: int, request: Request):
+    user_id = await _current_user_id(request)
+    try:
+        body = await request.json()
+    except admission.BodyTooLarge:
+        raise HTTPException(status_code=413, detail="request too large")
+    except Exception:
+        body = None
+    nickname = body.get("nickname") if isinstance(body, dict) else None
+    if nickname is not None and (not isinstance(nickname, str) or len(nickname) > MAX_NICKNAME_LENGTH):
+        raise HTTPException(status_code=400, detail="invalid request")
+    nickname = (nickname or "").strip() or None
+
+    with metrics.stage("db_write"):
+        renamed = await storage.rename_credential(user_id, cred_id, nickname)
+    if not renamed:
+        raise HTTPException(status_code=404, detail="not found")
+    return {"ok": True}
+
+@router.delete("/api/credentials/{cred_id}")
+async def revoke_credential(cred_id: int, request: Request):
+    user_id = await _current_user_id(request)
+    with metrics.stage("db_write"):
+        cred_hash = await storage.delete_credential(user_id, cred_id)
+    if cred_hash is None:
+        raise HTTPException(status_code=404, detail="not found")
+    # A revoked passkey must not keep working from a cached copy.
+    await run_db(crypto_store.forget_credential, cred_hash, user_id)
+    return {"ok": True}
@@ -0,0 +1,84 @@
+import secrets
+
+from fastapi.testclient import TestClient
+
+import crypto_store
+from harness import enroll
+from main import app
+from soft_authenticator import b64url
+
+
+def login(client: TestClient, username: str, authenticator) -> int:
+    options = client.post("/api/login/options", json={"username": username}).json()
+    return client.post("/api/login/verify", json={"credential": authenticator.get(options)}).status_code
+
+
+def test_list_requires_session():
+    client = TestClient(app)
+    assert client.get("/api/credentials").status_code == 401
+    assert client.delete("/api/credentials/1").status_code == 401
+
+
+def test_list_paginates_with_cursor():
+    client = TestClient(app)
+    username = f"creds-{secrets.token_hex(4)}"
+    for _ in range(3):
+        enroll(client, username)
+
+    first = client.get("/api/credentials", params={"limit": 2}).json()
+    assert len(first["credentials"]) == 2 and first["next_cursor"] is not None
+    rest = client.get("/api/credentials", params={"limit": 2, "cursor": first["next_cursor"]}).json()
+    assert len(rest["credentials"]) == 1 and rest["next_cursor"] is None
+
+    ids = [c["id"] for c in first["credentials"] + rest["credentials"]]
+    assert ids == sorted(set(ids))
+    listed = rest["credentials"][0]
+    assert listed["created_at"] is not None and listed["last_used_at"] is None
+    assert listed["transports"] == ["internal"] and listed["nickname"] is None
+    assert client.get("/api/credentials", params={"limit": "0"}).status_code == 400
+    assert client.get("/api/credentials", params={"cursor": "-1"}).status_code == 400
+
+
+def test_login_records_last_used_at():
+    client = TestClient(app)
+    username = f"creds-{secrets.token_hex(4)}"
+    authenticator = enroll(client, username)
+    assert login(client, username, authenticator) == 200
+    crypto_store.sign_count_writer.flush()
+
+    [cred] = client.get("/api/credentials").json()["credentials"]
+    assert cred["last_used_at"] >= cred["created_at"]
+
+
+def test_rename_only_own_credentials():
+    client = TestClient(app)
+    enroll(client, f"creds-{secrets.token_hex(4)}")
+    [mine] = client.get("/api/credentials").json()["credentials"]
+
+    other = TestClient(app)
+    enroll(other, f"creds-{secrets.token_hex(4)}")
+    assert other.patch(f"/api/credentials/{mine['id']}", json={"nickname": "x"}).status_code == 404
+
+    assert client.patch(f"/api/credentials/{mine['id']}", json={"nickname": " Laptop "}).status_code == 200
+    assert client.get("/api/credentials").json()["credentials"][0]["nickname"] == "Laptop"
+    assert client.patch(f"/api/credentials/{mine['id']}", json={"nickname": "x" * 65}).status_code == 400
+    assert client.patch(f"/api/credentials/{mine['id']}", json={"nickname": None}).status_code == 200
+    assert client.get("/api/credentials").json()["credentials"][0]["nickname"] is None
+
+
+def test_revoked_credential_stops_working():
+    client = TestClient(app)
+    username = f"creds-{secrets.token_hex(4)}"
+    kept, revoked = enroll(client, username), enroll(client, username)
+    assert login(client, username, revoked) == 200  # now cached
+
+    ids = [c["id"] for c in client.get("/api/credentials").json()["credentials"]]
+    assert client.delete(f"/api/credentials/{ids[1]}").status_code == 200
+    assert client.delete(f"/api/credentials/{ids[1]}").status_code == 404
+
+    options = client.post("/api/login/options", json={"username": username}).json()
+    revoked_id = next(iter(revoked.credentials))
+    assert b64url(revoked_id) not in [c["id"] for c in options["allowCredentials"]]
+    assertion = revoked.get(options, credential_id=revoked_id)
+    assert client.post("/api/login/verify", json={"credential": assertion}).status_code == 400
+    assert login(client, username, kept) == 200
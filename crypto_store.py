@@ -1,12 +1,35 @@
 import secrets
-import json
 import hashlib
-from typing import Optional
+import time
+import hmac
+from typing import Callable, Iterable, Optional, Tuple
 
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
-from config import ENC_KEY, RP_ID
+from config import (
+    ENC_KEY,
+    ENC_KEY_ID,
+    ENC_OLD_KEYS,
+    LOGIN_DECOY_LENGTHS_REFRESH_SECONDS,
+    LOGIN_DECOY_SECRET,
+    LOGIN_OPTIONS_SLOTS,
+    RP_ID,
+    SIGN_COUNT_FLUSH_INTERVAL_MS,
+)
 import db
+import metrics
+import migrations
+import shared_state
+import storage
+from cred_cache import CredentialCache, CredentialRecord, SignCountWriter
+import verifier
+
+def _write_sign_counts(items: list[tuple]) -> int:
+    return storage.backend.write_sign_counts_blocking(items)
+
+cache = CredentialCache()
+sign_count_writer = SignCountWriter(_write_sign_counts, interval_seconds=SIGN_COUNT_FLUSH_INTERVAL_MS / 1000.0)
 
 def sha256(data: bytes) -> bytes:
     return hashlib.sha256(data).digest()
@@ -14,28 +37,95 @@ def sha256(data: bytes) -> bytes:
 def _aad(user_id: int) -> bytes:
     return f"{RP_ID}|{user_id}".encode("utf-8")
 
+# Blobs written since key rotation support: version byte, key ID, nonce, ct.
+# Older blobs are bare nonce || ct and are tried against every known key.
+BLOB_VERSION = 1
+_HEADER_LEN = 2
+
+class Keyring:
+    """AES-256-GCM keys by key ID: encrypts with the current key, decrypts
+    versioned and legacy blobs with whichever key wrote them.
+
+    AESGCM holds only the expanded key and is safe to share across threads,
+    so each key gets one long-lived instance.
+    """
+
+    def __init__(self, current_kid: int, keys: dict[int, bytes]) -> None:
+        if current_kid not in keys:
+            raise ValueError("current key ID is not in the keyring")
+        self.current_kid = current_kid
+        self._aes = {kid: AESGCM(key) for kid, key in keys.items()}
+        self._current = self._aes[current_kid]
+        self._prefix = bytes([BLOB_VERSION, current_kid])
+        # Legacy blobs are most likely under the current key; try it first.
+        self._legacy_order = [self._current] + [a for kid, a in self._aes.items() if kid != current_kid]
+
+    @property
+    def key_ids(self) -> list[int]:
+        return sorted(self._aes)
+
+    def encrypt(self, plaintext: bytes, aad: bytes) -> bytes:
+        nonce = secrets.token_bytes(12)
+        return self._prefix + nonce + self._current.encrypt(nonce, plaintext, aad)
+
+    def encrypt_many(self, items: Iterable[Tuple[bytes, bytes]]) -> list[bytes]:
+        items = list(items)
+        nonces = secrets.token_bytes(12 * len(items))
+        encrypt = self._current.encrypt
+        prefix = self._prefix
+        out = []
+        for i, (plaintext, aad) in enumerate(items):
+            nonce = nonces[12 * i : 12 * i + 12]
+            out.append(prefix + nonce + encrypt(nonce, plaintext, aad))
+        return out
+
+    def decrypt_with_kid(self, blob: bytes, aad: bytes) -> Tuple[bytes, Optional[int]]:
+        """Return `(plaintext, kid)`; `kid` is None for a legacy unversioned blob."""
+        if len(blob) > _HEADER_LEN + 12 and blob[0] == BLOB_VERSION:
+            aes = self._aes.get(blob[1])
+            if aes is not None:
+                try:
+                    return aes.decrypt(blob[2:14], blob[14:], aad), blob[1]
+                except InvalidTag:
+                    # A legacy nonce can start with the same two bytes.
+                    pass
+        for aes in self._legacy_order:
+            try:
+                return aes.decrypt(blob[:12], blob[12:], aad), None
+            except InvalidTag:
+                continue
+        raise InvalidTag()
+
+    def decrypt(self, blob: bytes, aad: bytes) -> bytes:
+        return self.decrypt_with_kid(blob, aad)[0]
+
+    def burn_decrypt(self) -> None:
+        # Same AES-GCM work as a failed decrypt of a credential-sized blob.
+        try:
+            self._current.decrypt(secrets.token_bytes(12), secrets.token_bytes(48), b"pad")
+        except InvalidTag:
+            pass
+
+keyring = Keyring(ENC_KEY_ID, {**ENC_OLD_KEYS, ENC_KEY_ID: ENC_KEY})
+
 def encrypt_blob(plaintext: bytes, aad: bytes) -> bytes:
-    nonce = secrets.token_bytes(12)
-    aes = AESGCM(ENC_KEY)
-    ct = aes.encrypt(nonce, plaintext, aad)
-    return nonce + ct
+    return keyring.encrypt(plaintext, aad)
+
+def encrypt_many(items: Iterable[Tuple[bytes, bytes]]) -> list[bytes]:
+    """Encrypt `(plaintext, aad)` pairs; one nonce draw covers the batch."""
+    return keyring.encrypt_many(items)
 
 def constant_work_padding():
     # Spend similar CPU as decrypting a credential; avoids early-return timing gap
-    aad = b"pad"
-    aes = AESGCM(ENC_KEY)
-    fake_nonce = secrets.token_bytes(12)
-    fake_ct = secrets.token_bytes(48)  # random bytes
-    try:
-        aes.decrypt(fake_nonce, fake_ct, aad)  # will fail, but burns comparable work
-    except Exception:
-        pass
+    keyring.burn_decrypt()
 
 def decrypt_blob(blob: bytes, aad: bytes) -> bytes:
-    nonce = blob[:12]
-    ct = blob[12:]
-    aes = AESGCM(ENC_KEY)
-    return aes.decrypt(nonce, ct, aad)
+    return keyring.decrypt(blob, aad)
+
+def decrypt_many(items: Iterable[Tuple[bytes, bytes]]) -> list[bytes]:
+    """Decrypt `(blob, aad)` pairs; raises on the first blob that fails."""
+    decrypt = keyring.decrypt
+    return [decrypt(blob, aad) for blob, aad in items]
 
 def decrypt_credential_id(row: "db.sqlite3.Row") -> bytes:
     user_id = int(row["user_id"])
@@ -45,7 +135,173 @@ def decrypt_public_key(row: "db.sqlite3.Row") -> bytes:
     user_id = int(row["user_id"])
     return decrypt_blob(bytes(row["public_key_enc"]), aad=_aad(user_id))
 
-def save_credential(
+def _records(rows: list["db.sqlite3.Row"]) -> list[CredentialRecord]:
+    aads = {}
+    items = []
+    for row in rows:
+        user_id = int(row["user_id"])
+        aad = aads.get(user_id)
+        if aad is None:
+            aad = aads[user_id] = _aad(user_id)
+        items.append((bytes(row["credential_id_enc"]), aad))
+        items.append((bytes(row["public_key_enc"]), aad))
+    with metrics.stage("aes_decrypt"):
+        plain = decrypt_many(items)
+
+    out = []
+    for i, row in enumerate(rows):
+        cred_hash = bytes(row["credential_id_hash"])
+        sign_count = sign_count_writer.pending_sign_count(cred_hash)
+        out.append(
+            CredentialRecord(
+                cred_hash=cred_hash,
+                user_id=int(row["user_id"]),
+                credential_id=plain[2 * i],
+                public_key=plain[2 * i + 1],
+                sign_count=int(row["sign_count"]) if sign_count is None else sign_count,
+            )
+        )
+    return out
+
+# The *_from_row(s) helpers decrypt and cache rows fetched from any storage
+# backend; the load_* wrappers fetch from SQLite themselves. `generation` is
+# `cache.generation()` from before the rows were read (see CredentialCache).
+
+def credential_from_row(row, generation: Optional[int] = None) -> Optional[CredentialRecord]:
+    if row is None:
+        return None
+    record = _records([row])[0]
+    cache.put([record], generation=generation)
+    return record
+
+def _load_from_db(cred_hash: bytes) -> Optional[CredentialRecord]:
+    # Cache misses only; checking the cache again here would count one miss twice.
+    generation = cache.generation()
+    return credential_from_row(db.find_credential_by_hash(cred_hash), generation)
+
+def load_credential(cred_hash: bytes) -> Optional[CredentialRecord]:
+    record = cache.get(cred_hash)
+    if record is not None:
+        return record
+    return _load_from_db(cred_hash)
+
+def user_credential_ids_from_rows(user_id: int, rows, generation: Optional[int] = None) -> list[bytes]:
+    records = _records(rows)
+    cache.put(records, user_id=user_id, generation=generation)
+    return [r.credential_id for r in records]
+
+def load_user_credential_ids(user_id: int) -> list[bytes]:
+    ids = cache.get_user_credential_ids(user_id)
+    if ids is not None:
+        return ids
+    generation = cache.generation()
+    return user_credential_ids_from_rows(user_id, db.list_user_credentials(user_id), generation)
+
+def padded_slots(n: int, slots: int = LOGIN_OPTIONS_SLOTS) -> int:
+    """Smallest multiple of `slots` that fits `n` credentials (at least one block)."""
+    slots = max(1, slots)
+    return max(slots, -(-n // slots) * slots)
+
+def login_credential_ids_from_rows(rows) -> list[bytes]:
+    """Credential IDs for a login attempt, with work independent of the answer.
+
+    Known and unknown usernames run the same single query (`find_login_rows`),
+    and every call performs `padded_slots(n)` credential ID decrypts (real or
+    burned), so neither user existence nor passkey count shows up in the
+    response time. Public keys stay encrypted; login/verify decrypts the one
+    it needs. The cache is deliberately not consulted: a warm entry would
+    reveal a recent login.
+    """
+    cred_rows = [r for r in rows if r["credential_id_hash"] is not None]
+    with metrics.stage("aes_decrypt"):
+        ids = decrypt_many((bytes(r["credential_id_enc"]), _aad(int(r["user_id"]))) for r in cred_rows)
+        for _ in range(padded_slots(len(ids)) - len(ids)):
+            keyring.burn_decrypt()
+    return ids
+
+def load_login_credential_ids(username: str) -> list[bytes]:
+    return login_credential_ids_from_rows(db.find_login_rows(username))
+
+# Decoy IDs come from a dedicated secret so they stay stable across calls,
+# restarts and ENC_KEY rotations; decoys that change while real IDs do not
+# would be told apart by simply asking twice.
+_DECOY_KEY = hmac.new(LOGIN_DECOY_SECRET.encode("utf-8"), b"login-options-decoy", hashlib.sha256).digest()
+# Until a credential exists there is no real user to look like.
+_DEFAULT_DECOY_LENGTH = 16
+# Nonce and tag around every credential ID blob (plus the header on versioned ones).
+_BLOB_OVERHEAD = 12 + 16
+
+class DecoyLengths:
+    """Length distribution of the stored credential IDs.
+
+    A real user's decoys copy the length of their real IDs; an unknown user's
+    are drawn from this distribution so the two cannot be told apart by
+    length. Lengths come from blob sizes, so nothing is decrypted. (A legacy
+    blob whose nonce starts with the version byte is counted 2 bytes short.)
+    """
+
+    def __init__(
+        self,
+        refresh_seconds: float = LOGIN_DECOY_LENGTHS_REFRESH_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.refresh_seconds = refresh_seconds
+        self._clock = clock
+        # (cumulative fraction, length), by length.
+        self._cdf: list[tuple[float, int]] = []
+        self._loaded_at: Optional[float] = None
+
+    def stale(self) -> bool:
+        return self._loaded_at is None or self._clock() - self._loaded_at >= self.refresh_seconds
+
+    def update(self, rows) -> None:
+        """Load `credential_id_enc_lengths` rows from any storage backend."""
+        counts: dict[int, int] = {}
+        for row in rows:
+            n = int(row["n"]) - _BLOB_OVERHEAD
+            if bytes(row["head"]) == bytes([BLOB_VERSION]):
+                n -= _HEADER_LEN
+            if n > 0:
+                counts[n] = counts.get(n, 0) + int(row["total"])
+        total = sum(counts.values())
+        cdf, running = [], 0
+        for length in sorted(counts):
+            running += counts[length]
+            cdf.append((running / total, length))
+        self._cdf = cdf
+        self._loaded_at = self._clock()
+
+    def pick(self, seed: bytes) -> int:
+        """The length at `seed`'s quantile: stable per seed unless the
+        distribution shifts across it."""
+        u = int.from_bytes(seed[:8], "big") / 2**64
+        for fraction, length in self._cdf:
+            if u < fraction:
+                return length
+        return _DEFAULT_DECOY_LENGTH
+
+decoy_lengths = DecoyLengths()
+
+def login_descriptor_ids(username: str, real_ids: list[bytes]) -> list[bytes]:
+    """Pad `real_ids` with decoys to `padded_slots(len(real_ids))` and mix them
+    in a per-username stable order."""
+    seed = hmac.new(_DECOY_KEY, username.encode("utf-8"), hashlib.sha256).digest()
+    if real_ids:
+        length = len(real_ids[0])
+    else:
+        length = decoy_lengths.pick(seed)
+
+    ids = list(real_ids)
+    for i in range(padded_slots(len(real_ids)) - len(real_ids)):
+        blocks = b"".join(
+            hmac.new(seed, i.to_bytes(2, "big") + j.to_bytes(1, "big"), hashlib.sha256).digest()
+            for j in range(-(-length // 32))
+        )
+        ids.append(blocks[:length])
+    ids.sort(key=lambda cid: hmac.new(seed, cid, hashlib.sha256).digest())
+    return ids
+
+def seal_credential(
     user_id: int,
     credential_id: bytes,
     public_key: bytes,
@@ -53,32 +309,61 @@ def save_credential(
     transports: Optional[list[str]],
     device_type: Optional[str],
     backed_up: bool,
-) -> None:
-    cred_hash = sha256(credential_id)
+) -> dict:
+    """Keyword arguments for `insert_or_replace_credential` on any backend."""
     aad = _aad(user_id)
-    credential_id_enc = encrypt_blob(credential_id, aad=aad)
-    public_key_enc = encrypt_blob(public_key, aad=aad)
-
-    db.insert_or_replace_credential(
-        user_id=user_id,
-        credential_id_hash=cred_hash,
-        credential_id_enc=credential_id_enc,
-        public_key_enc=public_key_enc,
-        sign_count=sign_count,
-        transports_json=json.dumps(transports or []),
-        device_type=device_type,
-        backed_up=backed_up,
-    )
+    credential_id_enc, public_key_enc = encrypt_many([(credential_id, aad), (public_key, aad)])
+    return {
+        "user_id": user_id,
+        "credential_id_hash": sha256(credential_id),
+        "credential_id_enc": credential_id_enc,
+        "public_key_enc": public_key_enc,
+        "sign_count": sign_count,
+        "transports_mask": migrations.encode_transports(transports),
+        "device_type": device_type,
+        "backed_up": backed_up,
+        "created_at": time.time(),
+    }
+
+def _drop_cached(cred_hash: Optional[bytes], user_id: Optional[int]) -> None:
+    cache.invalidate(cred_hash=cred_hash, user_id=user_id)
+    if cred_hash is not None:
+        verifier.engine.invalidate(cred_hash)
+
+# Set in multi-worker mode: replays other workers' invalidations here.
+coherence = shared_state.make_coherence(_drop_cached)
+
+def forget_credential(cred_hash: Optional[bytes], user_id: Optional[int]) -> None:
+    """Drop cached state after a credential row was written, in this process
+    and (with SHARED_STATE) in every other worker on the host."""
+    _drop_cached(cred_hash, user_id)
+    if coherence is not None:
+        coherence.publish(cred_hash, user_id)
+
+def save_credential(
+    user_id: int,
+    credential_id: bytes,
+    public_key: bytes,
+    sign_count: int,
+    transports: Optional[list[str]],
+    device_type: Optional[str],
+    backed_up: bool,
+) -> bool:
+    row = seal_credential(user_id, credential_id, public_key, sign_count, transports, device_type, backed_up)
+    saved = db.insert_or_replace_credential(**row)
+    forget_credential(row["credential_id_hash"], user_id)
+    return saved
 
 def update_sign_count(
     cred_hash: bytes,
     new_sign_count: int,
     device_type: Optional[str],
     backed_up: bool,
-) -> None:
-    db.update_credential_sign_count(
-        cred_hash=cred_hash,
-        new_sign_count=new_sign_count,
-        device_type=device_type,
-        backed_up=backed_up,
-    )
\ No newline at end of file
+    used_at: Optional[float] = None,
+) -> bool:
+    """False when another login already moved the count to `new_sign_count` or
+    beyond: the assertion lost a race (or came from a cloned authenticator)."""
+    if not sign_count_writer.submit(cred_hash, new_sign_count, device_type, backed_up, used_at):
+        return False
+    cache.set_sign_count(cred_hash, new_sign_count)
+    return True
\ No newline at end of file
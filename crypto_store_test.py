@@ -0,0 +1,126 @@
+import base64
+import os
+import secrets
+import subprocess
+import sys
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+import crypto_store
+import db
+
+
+def test_batch_round_trip_matches_single_calls():
+    items = [(b"id-%d" % i, crypto_store._aad(i % 3)) for i in range(10)]
+    blobs = crypto_store.encrypt_many(items)
+
+    assert len({b[2:14] for b in blobs}) == len(blobs)  # distinct nonces
+    assert crypto_store.decrypt_many(zip(blobs, (aad for _, aad in items))) == [p for p, _ in items]
+    assert [crypto_store.decrypt_blob(b, aad) for b, (_, aad) in zip(blobs, items)] == [p for p, _ in items]
+
+
+def test_decrypt_many_enforces_aad():
+    blob = crypto_store.encrypt_blob(b"secret", crypto_store._aad(1))
+    with pytest.raises(InvalidTag):
+        crypto_store.decrypt_many([(blob, crypto_store._aad(2))])
+
+
+def test_keyring_reads_legacy_and_retired_keys():
+    old_key, new_key = b"o" * 32, b"n" * 32
+    aad = crypto_store._aad(7)
+    old_ring = crypto_store.Keyring(1, {1: old_key})
+    versioned_old = old_ring.encrypt(b"pk", aad)
+    legacy = b"\x00" * 12 + crypto_store.AESGCM(old_key).encrypt(b"\x00" * 12, b"pk", aad)
+
+    ring = crypto_store.Keyring(2, {1: old_key, 2: new_key})
+    assert ring.decrypt_with_kid(versioned_old, aad) == (b"pk", 1)
+    assert ring.decrypt_with_kid(legacy, aad) == (b"pk", None)
+    fresh = ring.encrypt(b"pk", aad)
+    assert fresh[:2] == bytes([crypto_store.BLOB_VERSION, 2])
+    assert ring.decrypt_with_kid(fresh, aad) == (b"pk", 2)
+
+    with pytest.raises(InvalidTag):
+        crypto_store.Keyring(2, {2: new_key}).decrypt(versioned_old, aad)
+
+
+def test_login_descriptor_ids_pad_with_stable_decoys():
+    real = [b"r" * 16]
+    padded = crypto_store.login_descriptor_ids("alice", real)
+    assert len(padded) == crypto_store.padded_slots(1)
+    assert b"r" * 16 in padded and all(len(c) == 16 for c in padded)
+    assert crypto_store.login_descriptor_ids("alice", real) == padded
+
+    unknown = crypto_store.login_descriptor_ids("nobody", [])
+    assert len(unknown) == len(padded)
+    assert crypto_store.login_descriptor_ids("nobody", []) == unknown
+    assert crypto_store.padded_slots(5, 4) == 8
+
+
+def test_unknown_users_draw_decoy_lengths_from_stored_credentials(monkeypatch):
+    lengths = crypto_store.DecoyLengths(refresh_seconds=60)
+    assert lengths.stale()
+    blob = crypto_store.encrypt_blob(b"x" * 32, crypto_store._aad(1))
+    legacy = b"\x00" * 12 + b"x" * (20 + 16)
+    lengths.update([
+        {"n": len(blob), "head": blob[:1], "total": 3},
+        {"n": len(legacy), "head": legacy[:1], "total": 1},
+    ])
+    assert not lengths.stale()
+    monkeypatch.setattr(crypto_store, "decoy_lengths", lengths)
+
+    seen = {len(crypto_store.login_descriptor_ids(f"nobody-{i}", [])[0]) for i in range(64)}
+    assert seen == {20, 32}
+    assert crypto_store.login_descriptor_ids("nobody", []) == crypto_store.login_descriptor_ids("nobody", [])
+
+
+def test_login_ids_decrypt_one_blob_per_slot(monkeypatch):
+    work = []
+    ring = crypto_store.keyring
+    decrypt = ring.decrypt
+
+    def counting_decrypt(blob, aad):
+        work.append("decrypt")
+        return decrypt(blob, aad)
+
+    monkeypatch.setattr(ring, "decrypt", counting_decrypt)
+    monkeypatch.setattr(ring, "burn_decrypt", lambda: work.append("burn"))
+
+    db.init_db()
+    name = f"slots-{secrets.token_hex(4)}"
+    user = db.get_or_create_user(name, user_handle=secrets.token_bytes(16))
+    for rows in (db.find_login_rows(name + "-missing"), db.find_login_rows(name)):
+        work.clear()
+        assert crypto_store.login_credential_ids_from_rows(rows) == []
+        assert work == ["burn"] * crypto_store.padded_slots(0)
+
+    cid = secrets.token_bytes(16)
+    crypto_store.save_credential(user["id"], cid, b"pk", 0, None, None, False)
+    work.clear()
+    assert crypto_store.login_credential_ids_from_rows(db.find_login_rows(name)) == [cid]
+    # The credential ID only; its public key stays encrypted.
+    assert work == ["decrypt"] + ["burn"] * (crypto_store.padded_slots(1) - 1)
+
+
+def _decoys_with_enc_key(tmp_path, enc_key: bytes) -> str:
+    env = dict(os.environ, CRED_ENC_KEY_B64URL=base64.urlsafe_b64encode(enc_key).rstrip(b"=").decode())
+    env.update(DB_PATH=str(tmp_path / "decoys.sqlite3"))
+    code = "import crypto_store; print(crypto_store.login_descriptor_ids('nobody', []))"
+    return subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+
+
+def test_decoys_survive_key_rotation_and_restart(tmp_path):
+    # A fresh process with another at-rest key, as after rotate_keys.py or a
+    # restart on the volatile dev key.
+    first = _decoys_with_enc_key(tmp_path, secrets.token_bytes(32))
+    assert first and _decoys_with_enc_key(tmp_path, secrets.token_bytes(32)) == first
+
+
+def test_load_login_credential_ids_known_empty_and_unknown():
+    db.init_db()
+    user = db.get_or_create_user("login-ids", user_handle=secrets.token_bytes(16))
+    assert crypto_store.load_login_credential_ids("login-ids") == []
+    assert crypto_store.load_login_credential_ids("login-ids-missing") == []
+
+    crypto_store.save_credential(user["id"], b"cred-a", b"pk-a", 0, None, None, False)
+    assert crypto_store.load_login_credential_ids("login-ids") == [b"cred-a"]
@@ -1,97 +1,253 @@
+import queue
 import sqlite3
-from typing import Optional, Tuple
-from config import DB_PATH
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
 
-def get_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+from config import (
+    DB_PATH,
+    DB_POOL_SIZE,
+    DB_BUSY_TIMEOUT_MS,
+    DB_POOL_ACQUIRE_TIMEOUT_SECONDS,
+    DB_STATEMENT_CACHE_SIZE,
+)
+import migrations
+
+def get_db(path: str = DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        path,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000.0,
+        check_same_thread=False,
+        cached_statements=DB_STATEMENT_CACHE_SIZE,
+    )
     conn.row_factory = sqlite3.Row
+    # WAL lets readers run alongside the single writer; NORMAL only fsyncs at
+    # checkpoints, which is still durable against application crashes.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}")
     return conn
 
-def init_db() -> None:
-    conn = get_db()
-    cur = conn.cursor()
+# Primary result codes after which a connection is not worth keeping:
+# SQLITE_IOERR, SQLITE_CORRUPT, SQLITE_CANTOPEN, SQLITE_NOTADB.
+_BROKEN_SQLITE_CODES = frozenset({10, 11, 14, 26})
 
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            user_handle BLOB NOT NULL
-        )
-        """
-    )
+def _connection_broken(e: sqlite3.DatabaseError) -> bool:
+    """True for corruption, I/O failure or a closed connection; False for
+    constraint violations and transient errors such as SQLITE_BUSY."""
+    if isinstance(e, sqlite3.ProgrammingError):
+        return "closed" in str(e)
+    code = getattr(e, "sqlite_errorcode", None)
+    return code is not None and code & 0xFF in _BROKEN_SQLITE_CODES
 
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS credentials (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
+class ConnectionPool:
+    """Bounded pool of long-lived connections to one SQLite file.
 
-            credential_id_hash BLOB UNIQUE NOT NULL,
-            credential_id_enc  BLOB NOT NULL,
+    Connections are opened lazily up to `size`; callers block for at most
+    `acquire_timeout` seconds when every connection is checked out.
+    """
 
-            public_key_enc     BLOB NOT NULL,
-            sign_count         INTEGER NOT NULL DEFAULT 0,
-            transports         TEXT,
-            device_type        TEXT,
-            backed_up          INTEGER NOT NULL DEFAULT 0,
+    def __init__(
+        self,
+        path: str = DB_PATH,
+        size: int = DB_POOL_SIZE,
+        acquire_timeout: float = DB_POOL_ACQUIRE_TIMEOUT_SECONDS,
+    ) -> None:
+        if size < 1:
+            raise ValueError("pool size must be >= 1")
+        self.path = path
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
 
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-        """
-    )
+    @property
+    def opened(self) -> int:
+        return self._opened
+
+    @property
+    def idle(self) -> int:
+        return self._idle.qsize()
+
+    def acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return get_db(self.path)
+                except Exception:
+                    self._opened -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError("timed out waiting for a database connection") from None
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            self.discard(conn)
+            return
+        self._idle.put_nowait(conn)
+
+    def discard(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._opened -= 1
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            # Constraint violations and busy/locked timeouts leave the
+            # connection (and its statement cache) usable; corruption, I/O
+            # errors and closed connections get a fresh one next time.
+            if _connection_broken(e):
+                self.discard(conn)
+            else:
+                self.release(conn)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self.connection() as conn:
+            try:
+                yield conn
+            except BaseException:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
 
-    conn.commit()
-    conn.close()
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def connection():
+    return get_pool().connection()
+
+def transaction():
+    return get_pool().transaction()
+
+def init_db() -> list[int]:
+    """Apply pending schema migrations; safe to call on every startup."""
+    with connection() as conn:
+        return migrations.migrate(conn)
 
 def get_user(username: str) -> Optional[sqlite3.Row]:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE username = ?", (username,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    with connection() as conn:
+        return conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
 
 def get_username_by_user_id(user_id: int) -> Optional[str]:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT username FROM users WHERE id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute("SELECT username FROM users WHERE id = ?", (user_id,)).fetchone()
     return row["username"] if row else None
 
+def get_user_by_handle(user_handle: bytes) -> Optional[sqlite3.Row]:
+    with connection() as conn:
+        return conn.execute("SELECT * FROM users WHERE user_handle = ?", (user_handle,)).fetchone()
 
 def get_or_create_user(username: str, user_handle: bytes) -> sqlite3.Row:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE username = ?", (username,))
-    row = cur.fetchone()
-    if row:
-        conn.close()
-        return row
+    """Existing users are a plain read; concurrent creators all get the same row.
 
-    cur.execute("INSERT INTO users(username, user_handle) VALUES (?, ?)", (username, user_handle))
-    conn.commit()
-    cur.execute("SELECT * FROM users WHERE username = ?", (username,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    `user_handle` is only used when the user is created. Only a miss takes
+    the write lock, and ON CONFLICT DO NOTHING lets a racing creator win.
+    """
+    row = get_user(username)
+    if row is not None:
+        return row
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO users(username, user_handle) VALUES (?, ?) ON CONFLICT(username) DO NOTHING",
+            (username, user_handle),
+        )
+        return conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
 
 def list_user_credentials(user_id: int) -> list[sqlite3.Row]:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM credentials WHERE user_id = ?", (user_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return list(rows)
+    with connection() as conn:
+        return conn.execute("SELECT * FROM credentials WHERE user_id = ?", (user_id,)).fetchall()
+
+def find_login_rows(username: str) -> list[sqlite3.Row]:
+    """One query with the same shape whether or not the user exists.
+
+    Always returns at least one row: `uid` is NULL for an unknown user and
+    the credential columns are NULL for a user with no passkeys.
+    """
+    with connection() as conn:
+        return conn.execute(
+            """
+            SELECT u.id AS uid, c.*
+            FROM (SELECT ? AS username) AS q
+            LEFT JOIN users u ON u.username = q.username
+            LEFT JOIN credentials c ON c.user_id = u.id
+            """,
+            (username,),
+        ).fetchall()
+
+def credential_id_enc_lengths() -> list[sqlite3.Row]:
+    """`(n, head, total)`: how many credential_id_enc blobs are `n` bytes long
+    and start with the byte `head`."""
+    with connection() as conn:
+        return conn.execute(
+            """
+            SELECT length(credential_id_enc) AS n, substr(credential_id_enc, 1, 1) AS head, COUNT(*) AS total
+            FROM credentials
+            GROUP BY 1, 2
+            """
+        ).fetchall()
 
 def find_credential_by_hash(cred_hash: bytes) -> Optional[sqlite3.Row]:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM credentials WHERE credential_id_hash = ?", (cred_hash,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    with connection() as conn:
+        return conn.execute(
+            "SELECT * FROM credentials WHERE credential_id_hash = ?", (cred_hash,)
+        ).fetchone()
 
 def insert_or_replace_credential(
     user_id: int,
@@ -99,49 +255,334 @@ def insert_or_replace_credential(
     credential_id_enc: bytes,
     public_key_enc: bytes,
     sign_count: int,
-    transports_json: str,
+    transports_mask: int,
     device_type: Optional[str],
     backed_up: bool,
-) -> None:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT OR REPLACE INTO credentials(
-            user_id, credential_id_hash, credential_id_enc, public_key_enc,
-            sign_count, transports, device_type, backed_up
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            user_id,
-            credential_id_hash,
-            credential_id_enc,
-            public_key_enc,
-            sign_count,
-            transports_json,
-            device_type,
-            1 if backed_up else 0,
-        ),
-    )
-    conn.commit()
-    conn.close()
+    created_at: Optional[float] = None,
+) -> bool:
+    """Insert, or overwrite the same user's row for this credential ID.
+
+    Returns False, writing nothing, when the credential ID already belongs to
+    another user; the check and the write are one statement. Re-registering
+    keeps the row's created_at, last_used_at and nickname.
+    """
+    with transaction() as conn:
+        row = conn.execute(
+            """
+            INSERT INTO credentials(
+                user_id, credential_id_hash, credential_id_enc, public_key_enc,
+                sign_count, transports_mask, device_type, backed_up, created_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(credential_id_hash) DO UPDATE SET
+                credential_id_enc = excluded.credential_id_enc,
+                public_key_enc = excluded.public_key_enc,
+                sign_count = excluded.sign_count,
+                transports_mask = excluded.transports_mask,
+                device_type = excluded.device_type,
+                backed_up = excluded.backed_up
+            WHERE credentials.user_id = excluded.user_id
+            RETURNING id
+            """,
+            (
+                user_id,
+                credential_id_hash,
+                credential_id_enc,
+                public_key_enc,
+                sign_count,
+                transports_mask,
+                device_type,
+                1 if backed_up else 0,
+                time.time() if created_at is None else created_at,
+            ),
+        ).fetchone()
+    return row is not None
+
+def _users_after(conn: sqlite3.Connection, last_id: int, limit: int) -> list[sqlite3.Row]:
+    return conn.execute(
+        "SELECT id, username, user_handle FROM users WHERE id > ? ORDER BY id LIMIT ?",
+        (last_id, limit),
+    ).fetchall()
+
+def _credentials_for_users(conn: sqlite3.Connection, user_ids: list[int]) -> list[sqlite3.Row]:
+    if not user_ids:
+        return []
+    marks = ",".join("?" * len(user_ids))
+    return conn.execute(
+        f"SELECT * FROM credentials WHERE user_id IN ({marks}) ORDER BY user_id, id",
+        user_ids,
+    ).fetchall()
+
+def list_users_after(last_id: int, limit: int) -> list[sqlite3.Row]:
+    with connection() as conn:
+        return _users_after(conn, last_id, limit)
+
+def list_credentials_for_users(user_ids: list[int]) -> list[sqlite3.Row]:
+    with connection() as conn:
+        return _credentials_for_users(conn, user_ids)
+
+def export_batch(last_id: int, limit: int) -> Tuple[list[sqlite3.Row], list[sqlite3.Row]]:
+    """Up to `limit` users after `last_id` and all of their credentials.
+
+    Both reads share one read transaction (one WAL snapshot), so a credential
+    written meanwhile is either in the batch with its user or not at all.
+    """
+    with transaction() as conn:
+        conn.execute("BEGIN")
+        users = _users_after(conn, last_id, limit)
+        return users, _credentials_for_users(conn, [int(u["id"]) for u in users])
+
+def upsert_users(users: list[Tuple[str, bytes]]) -> list[Optional[int]]:
+    """Create missing (username, user_handle) pairs in one transaction.
+
+    Returns each user's id, or None where the username or handle is already
+    taken by a different account.
+    """
+    out: list[Optional[int]] = []
+    with transaction() as conn:
+        for username, user_handle in users:
+            conn.execute(
+                "INSERT OR IGNORE INTO users(username, user_handle) VALUES (?, ?)",
+                (username, user_handle),
+            )
+            row = conn.execute(
+                "SELECT id, user_handle FROM users WHERE username = ?", (username,)
+            ).fetchone()
+            out.append(row["id"] if row is not None and bytes(row["user_handle"]) == user_handle else None)
+    return out
+
+def insert_credentials(rows: list[tuple]) -> int:
+    """Insert (user_id, hash, cid_enc, pk_enc, sign_count, transports_mask,
+    device_type, backed_up) rows in one transaction; existing hashes are kept.
+    """
+    with transaction() as conn:
+        return conn.executemany(
+            """
+            INSERT OR IGNORE INTO credentials(
+                user_id, credential_id_hash, credential_id_enc, public_key_enc,
+                sign_count, transports_mask, device_type, backed_up
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        ).rowcount
+
+# Compare-and-swap: a count only moves forward, so of two concurrent logins
+# that verified against the same stored count only one is applied.
+# Authenticators without a counter always send 0; those rows stay writable.
+# last_used_at rides along, so recording it costs no extra write.
+_SIGN_COUNT_CAS = """
+    UPDATE credentials
+    SET sign_count = ?1, device_type = ?2, backed_up = ?3, last_used_at = COALESCE(?5, last_used_at)
+    WHERE credential_id_hash = ?4 AND (sign_count < ?1 OR (?1 = 0 AND sign_count = 0))
+"""
 
 def update_credential_sign_count(
     cred_hash: bytes,
     new_sign_count: int,
     device_type: Optional[str],
     backed_up: bool,
+    used_at: Optional[float] = None,
+) -> bool:
+    """Returns False if the stored count was already >= `new_sign_count`."""
+    with transaction() as conn:
+        cur = conn.execute(
+            _SIGN_COUNT_CAS, (new_sign_count, device_type, 1 if backed_up else 0, cred_hash, used_at)
+        )
+    return cur.rowcount == 1
+
+def update_credential_sign_counts(items: list[Tuple[bytes, int, Optional[str], bool, Optional[float]]]) -> int:
+    """Apply many (cred_hash, sign_count, device_type, backed_up, used_at)
+    updates in one commit; returns how many moved a count forward."""
+    with transaction() as conn:
+        return conn.executemany(
+            _SIGN_COUNT_CAS,
+            [(n, dt, 1 if bu else 0, h, used) for (h, n, dt, bu, used) in items],
+        ).rowcount
+
+def list_credentials_page(user_id: int, after_id: int, limit: int) -> list[sqlite3.Row]:
+    """One keyset page of a user's credentials, without the encrypted blobs."""
+    with connection() as conn:
+        return conn.execute(
+            """
+            SELECT id, nickname, created_at, last_used_at, sign_count, transports_mask, device_type, backed_up
+            FROM credentials
+            WHERE user_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (user_id, after_id, limit),
+        ).fetchall()
+
+def rename_credential(user_id: int, cred_id: int, nickname: Optional[str]) -> bool:
+    with transaction() as conn:
+        cur = conn.execute(
+            "UPDATE credentials SET nickname = ? WHERE id = ? AND user_id = ?", (nickname, cred_id, user_id)
+        )
+    return cur.rowcount == 1
+
+def delete_credential(user_id: int, cred_id: int) -> Optional[bytes]:
+    """Delete one of the user's credentials; returns its hash, or None."""
+    with transaction() as conn:
+        row = conn.execute(
+            "DELETE FROM credentials WHERE id = ? AND user_id = ? RETURNING credential_id_hash",
+            (cred_id, user_id),
+        ).fetchone()
+    return bytes(row[0]) if row is not None else None
+
+def insert_challenge(
+    handle: str,
+    kind: str,
+    challenge: bytes,
+    username: Optional[str],
+    issued_at: float,
+    user_id: Optional[int] = None,
 ) -> None:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE credentials
-        SET sign_count = ?, device_type = ?, backed_up = ?
-        WHERE credential_id_hash = ?
-        """,
-        (new_sign_count, device_type, 1 if backed_up else 0, cred_hash),
-    )
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO challenges(id, kind, challenge, username, issued_at, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (handle, kind, challenge, username, issued_at, user_id),
+        )
+
+def consume_challenge(handle: str) -> Optional[sqlite3.Row]:
+    with transaction() as conn:
+        rows = conn.execute(
+            "DELETE FROM challenges WHERE id = ? RETURNING kind, challenge, username, issued_at, user_id",
+            (handle,),
+        ).fetchall()
+    return rows[0] if rows else None
+
+def delete_challenges_before(cutoff: float) -> int:
+    with transaction() as conn:
+        return conn.execute("DELETE FROM challenges WHERE issued_at < ?", (cutoff,)).rowcount
+
+def take_rate_limit_token(key: str, rate: float, burst: float, now: float, cost: float = 1.0) -> bool:
+    """Refill-and-take on one token bucket in a single statement."""
+    with transaction() as conn:
+        row = conn.execute(
+            """
+            INSERT INTO rate_limits(key, tokens, updated) VALUES (:key, :burst - :cost, :now)
+            ON CONFLICT(key) DO UPDATE SET
+                tokens = MIN(:burst, tokens + (:now - updated) * :rate) - :cost,
+                updated = :now
+            WHERE MIN(:burst, tokens + (:now - updated) * :rate) >= :cost
+            RETURNING tokens
+            """,
+            {"key": key, "rate": rate, "burst": burst, "now": now, "cost": cost},
+        ).fetchone()
+    return row is not None
+
+def delete_rate_limits_before(cutoff: float) -> int:
+    with transaction() as conn:
+        return conn.execute("DELETE FROM rate_limits WHERE updated < ?", (cutoff,)).rowcount
+
+def insert_cache_invalidation(
+    cred_hash: Optional[bytes], user_id: Optional[int], origin: int, created_at: float
+) -> int:
+    with transaction() as conn:
+        return conn.execute(
+            "INSERT INTO cache_invalidations(cred_hash, user_id, origin, created_at) VALUES (?, ?, ?, ?)",
+            (cred_hash, user_id, origin, created_at),
+        ).lastrowid
+
+def list_cache_invalidations_after(seq: int) -> list[sqlite3.Row]:
+    with connection() as conn:
+        return conn.execute(
+            "SELECT seq, cred_hash, user_id, origin FROM cache_invalidations WHERE seq > ? ORDER BY seq",
+            (seq,),
+        ).fetchall()
+
+def delete_cache_invalidations_before(cutoff: float) -> int:
+    with transaction() as conn:
+        return conn.execute("DELETE FROM cache_invalidations WHERE created_at < ?", (cutoff,)).rowcount
+
+def insert_auth_events(rows: list[tuple]) -> None:
+    """Append (ts, event, outcome, reason, username, cred_hash, ip) rows in one commit."""
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT INTO auth_events(ts, event, outcome, reason, username, cred_hash, ip) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+def find_auth_events(
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    username: Optional[str] = None,
+    event: Optional[str] = None,
+    outcome: Optional[str] = None,
+    limit: int = 1000,
+) -> list[sqlite3.Row]:
+    """Events in time order; each filter is skipped when None."""
+    where, args = [], []
+    for column, op, value in (
+        ("ts", ">=", since),
+        ("ts", "<", until),
+        ("username", "=", username),
+        ("event", "=", event),
+        ("outcome", "=", outcome),
+    ):
+        if value is not None:
+            where.append(f"{column} {op} ?")
+            args.append(value)
+    sql = "SELECT ts, event, outcome, reason, username, cred_hash, ip FROM auth_events"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    with connection() as conn:
+        return conn.execute(sql + " ORDER BY ts, id LIMIT ?", (*args, limit)).fetchall()
+
+def get_rotation_state(job: str) -> Optional[sqlite3.Row]:
+    with connection() as conn:
+        return conn.execute("SELECT * FROM key_rotation_state WHERE job = ?", (job,)).fetchone()
+
+def reset_rotation_state(job: str, target_kid: int, now: float) -> None:
+    with transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO key_rotation_state(job, target_kid, last_id, rewritten, updated_at)
+            VALUES (?, ?, 0, 0, ?)
+            ON CONFLICT(job) DO UPDATE SET
+                target_kid = excluded.target_kid, last_id = 0, rewritten = 0,
+                updated_at = excluded.updated_at
+            """,
+            (job, target_kid, now),
+        )
+
+def list_credential_blobs_after(last_id: int, limit: int) -> list[sqlite3.Row]:
+    with connection() as conn:
+        return conn.execute(
+            """
+            SELECT id, user_id, credential_id_enc, public_key_enc
+            FROM credentials WHERE id > ? ORDER BY id LIMIT ?
+            """,
+            (last_id, limit),
+        ).fetchall()
+
+def apply_reencrypted_blobs(
+    job: str,
+    last_id: int,
+    updates: list[Tuple[int, bytes, bytes, bytes, bytes]],
+    now: float,
+) -> int:
+    """Write (id, old_cid, old_pk, new_cid, new_pk) rows and advance the job
+    cursor in one transaction. A row is only rewritten if its blobs are still
+    the ones that were read, so concurrent re-registrations are never clobbered.
+    """
+    with transaction() as conn:
+        rewritten = 0
+        for cred_id, old_cid, old_pk, new_cid, new_pk in updates:
+            rewritten += conn.execute(
+                """
+                UPDATE credentials SET credential_id_enc = ?, public_key_enc = ?
+                WHERE id = ? AND credential_id_enc = ? AND public_key_enc = ?
+                """,
+                (new_cid, new_pk, cred_id, old_cid, old_pk),
+            ).rowcount
+        conn.execute(
+            """
+            UPDATE key_rotation_state
+            SET last_id = ?, rewritten = rewritten + ?, updated_at = ?
+            WHERE job = ?
+            """,
+            (last_id, rewritten, now, job),
+        )
+    return rewritten
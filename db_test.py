@@ -0,0 +1,154 @@
+import sqlite3
+import threading
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def pool(tmp_path):
+    p = db.ConnectionPool(path=str(tmp_path / "pool.sqlite3"), size=2, acquire_timeout=0.5)
+    yield p
+    p.close()
+
+
+def test_connections_are_reused(pool):
+    with pool.connection() as c1:
+        pass
+    with pool.connection() as c2:
+        pass
+    assert c1 is c2
+    assert pool.opened == 1
+
+
+def test_wal_and_synchronous_normal(pool):
+    with pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        # 1 == NORMAL
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+
+def test_pool_is_bounded(pool):
+    with pool.connection(), pool.connection():
+        with pytest.raises(TimeoutError):
+            pool.acquire()
+    assert pool.opened == 2
+
+
+def test_transaction_rolls_back_on_error(pool):
+    with pool.transaction() as conn:
+        conn.execute("CREATE TABLE t (v INTEGER)")
+
+    with pytest.raises(RuntimeError):
+        with pool.transaction() as conn:
+            conn.execute("INSERT INTO t VALUES (1)")
+            raise RuntimeError("boom")
+
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+
+
+def test_busy_errors_keep_the_connection(pool):
+    with pool.connection() as c1:
+        pass
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.connection() as conn:
+            # What a lock timeout looks like to the caller.
+            err = sqlite3.OperationalError("database is locked")
+            err.sqlite_errorcode = 5  # SQLITE_BUSY
+            raise err
+    with pool.connection() as c2:
+        pass
+    assert c1 is c2 and pool.opened == 1
+
+
+def test_broken_connections_are_discarded(pool):
+    with pytest.raises(sqlite3.ProgrammingError):
+        with pool.connection() as conn:
+            conn.close()
+            conn.execute("SELECT 1")
+    assert pool.opened == 0
+
+    with pytest.raises(sqlite3.DatabaseError):
+        with pool.connection() as conn:
+            err = sqlite3.DatabaseError("database disk image is malformed")
+            err.sqlite_errorcode = 11  # SQLITE_CORRUPT
+            raise err
+    assert pool.opened == 0
+
+
+def test_release_after_close_updates_opened(pool):
+    conn = pool.acquire()
+    pool.close()
+    assert pool.opened == 1
+    pool.release(conn)
+    assert pool.opened == 0
+
+
+def test_concurrent_writers_share_pool(pool):
+    with pool.transaction() as conn:
+        conn.execute("CREATE TABLE t (v INTEGER)")
+
+    def work(n):
+        for i in range(50):
+            with pool.transaction() as conn:
+                conn.execute("INSERT INTO t VALUES (?)", (n * 100 + i,))
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 200
+    assert pool.opened <= 2
+
+
+def test_helpers_round_trip():
+    db.init_db()
+    user = db.get_or_create_user("pool-user", user_handle=b"h" * 16)
+    assert db.get_or_create_user("pool-user", user_handle=b"x" * 16)["id"] == user["id"]
+    assert db.get_username_by_user_id(user["id"]) == "pool-user"
+    assert db.list_user_credentials(user["id"]) == []
+
+
+def test_get_or_create_user_is_race_free():
+    db.init_db()
+    results, errors = [], []
+
+    def work(n):
+        try:
+            results.append(db.get_or_create_user("race-user", user_handle=bytes([n]) * 16)["id"])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors and len(set(results)) == 1
+
+
+def test_get_or_create_user_reads_without_writing(monkeypatch):
+    db.init_db()
+    user = db.get_or_create_user("read-only-user", user_handle=b"r" * 16)
+
+    def no_write():
+        raise AssertionError("write transaction for an existing user")
+
+    monkeypatch.setattr(db, "transaction", no_write)
+    assert db.get_or_create_user("read-only-user", user_handle=b"s" * 16)["id"] == user["id"]
+
+
+def test_credential_upsert_keeps_owner():
+    db.init_db()
+    a = db.get_or_create_user("owner-a", user_handle=b"a" * 16)
+    b = db.get_or_create_user("owner-b", user_handle=b"b" * 16)
+    args = (b"owned-hash", b"cid", b"pk", 0, 0, None, False)
+    assert db.insert_or_replace_credential(a["id"], *args)
+    assert db.insert_or_replace_credential(a["id"], *args)
+    assert not db.insert_or_replace_credential(b["id"], *args)
+    assert db.find_credential_by_hash(b"owned-hash")["user_id"] == a["id"]
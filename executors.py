@@ -0,0 +1,53 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from config import DB_EXECUTOR_WORKERS, CRYPTO_EXECUTOR_WORKERS
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_db_executor: Optional[ThreadPoolExecutor] = None
+_crypto_executor: Optional[ThreadPoolExecutor] = None
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    with _lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(
+                max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db"
+            )
+        return _db_executor
+
+def _get_crypto_executor() -> ThreadPoolExecutor:
+    global _crypto_executor
+    with _lock:
+        if _crypto_executor is None:
+            _crypto_executor = ThreadPoolExecutor(
+                max_workers=CRYPTO_EXECUTOR_WORKERS, thread_name_prefix="crypto"
+            )
+        return _crypto_executor
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking `db`/`crypto_store` call that touches SQLite."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_db_executor(), functools.partial(fn, *args, **kwargs))
+
+async def run_crypto(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run CPU-bound crypto work that does not need a DB connection."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_crypto_executor(), functools.partial(fn, *args, **kwargs)
+    )
+
+def shutdown(wait: bool = True) -> None:
+    global _db_executor, _crypto_executor
+    with _lock:
+        executors = (_db_executor, _crypto_executor)
+        _db_executor = None
+        _crypto_executor = None
+    for ex in executors:
+        if ex is not None:
+            ex.shutdown(wait=wait)
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import executors
+
+
+def test_blocking_calls_run_off_the_event_loop():
+    async def main():
+        loop_thread = threading.get_ident()
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        t = asyncio.create_task(ticker())
+        db_thread = await executors.run_db(lambda: (time.sleep(0.1), threading.get_ident())[1])
+        crypto_thread = await executors.run_crypto(threading.get_ident)
+        t.cancel()
+        return loop_thread, db_thread, crypto_thread, ticks
+
+    try:
+        loop_thread, db_thread, crypto_thread, ticks = asyncio.run(main())
+    finally:
+        executors.shutdown()
+
+    assert db_thread != loop_thread
+    assert crypto_thread != loop_thread
+    # The loop kept serving other tasks while the DB call slept.
+    assert ticks >= 5
+
+
+def test_exceptions_propagate():
+    async def main():
+        await executors.run_db(int, "not a number")
+
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(main())
+    finally:
+        executors.shutdown()
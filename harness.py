@@ -0,0 +1,131 @@
+"""Helpers shared by the *_test.py modules.
+
+Ceremonies driven through a test client with a SoftAuthenticator, and spies
+that record which storage, run_db and run_crypto calls a verify request made
+(and catch AES-GCM work done outside run_crypto). Test modules import from
+here rather than from each other.
+"""
+import asyncio
+import contextlib
+import contextvars
+import threading
+
+import httpx
+
+import crypto_store
+import webauthn_routes
+from soft_authenticator import ES256, SoftAuthenticator
+
+def register(client, authenticator: SoftAuthenticator, username: str, corrupt=None) -> httpx.Response:
+    """register/options then register/verify; the verify response."""
+    options = client.post("/api/register/options", json={"username": username}).json()
+    credential = authenticator.create(options, corrupt=corrupt)
+    return client.post("/api/register/verify", json={"username": username, "credential": credential})
+
+def login(client, authenticator: SoftAuthenticator, username: str = "", corrupt=None) -> httpx.Response:
+    """login/options then login/verify (usernameless when `username` is empty)."""
+    options = client.post("/api/login/options", json={"username": username}).json()
+    assertion = authenticator.get(options, corrupt=corrupt)
+    return client.post("/api/login/verify", json={"credential": assertion})
+
+def enroll(client, username: str, alg: int = ES256) -> SoftAuthenticator:
+    """A new authenticator with a passkey registered for `username`."""
+    authenticator = SoftAuthenticator(alg=alg)
+    r = register(client, authenticator, username)
+    assert r.status_code == 200, r.text
+    return authenticator
+
+# --- call spies --------------------------------------------------------------
+
+# Calls made while handling the current request.
+_calls: contextvars.ContextVar[list] = contextvars.ContextVar("harness_calls")
+
+def collect_calls(calls: list) -> None:
+    """Append spied calls made from the current context (task) to `calls`."""
+    _calls.set(calls)
+
+def _record(name: str) -> None:
+    calls = _calls.get(None)
+    if calls is not None:
+        calls.append(name)
+
+class _StorageSpy:
+    def __init__(self, backend) -> None:
+        self._backend = backend
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if not callable(attr):
+            return attr
+
+        def spy(*args, **kwargs):
+            _record(f"storage.{name}")
+            return attr(*args, **kwargs)
+
+        return spy
+
+def _spy_executor(name: str, run):
+    async def spy(fn, *args, **kwargs):
+        _record(f"{name}:{getattr(fn, '__qualname__', fn)}")
+        return await run(fn, *args, **kwargs)
+
+    return spy
+
+# Every Keyring entry point that runs AES-GCM.
+_AES_METHODS = ("encrypt", "encrypt_many", "decrypt_with_kid", "burn_decrypt")
+
+def _spy_aes(name: str, method, stray: list):
+    def spy(*args, **kwargs):
+        # run_crypto's pool names its threads crypto_0, crypto_1, ...
+        thread = threading.current_thread().name
+        if not thread.startswith("crypto"):
+            stray.append(f"{name} on {thread}")
+        return method(*args, **kwargs)
+
+    return spy
+
+@contextlib.contextmanager
+def spying():
+    """Route webauthn_routes' storage and executor calls through recording spies.
+
+    Fails on exit if any AES-GCM work ran outside run_crypto: on the event
+    loop, or on the DB executor.
+    """
+    saved = webauthn_routes.storage, webauthn_routes.run_db, webauthn_routes.run_crypto
+    webauthn_routes.storage = _StorageSpy(saved[0])
+    webauthn_routes.run_db = _spy_executor("run_db", saved[1])
+    webauthn_routes.run_crypto = _spy_executor("run_crypto", saved[2])
+    ring, stray = crypto_store.keyring, []
+    for name in _AES_METHODS:
+        setattr(ring, name, _spy_aes(name, getattr(ring, name), stray))
+    try:
+        yield
+    finally:
+        webauthn_routes.storage, webauthn_routes.run_db, webauthn_routes.run_crypto = saved
+        for name in _AES_METHODS:
+            delattr(ring, name)
+    assert not stray, f"AES-GCM outside run_crypto: {stray[:5]}"
+
+def async_client() -> httpx.AsyncClient:
+    """In-process client; requests run in the caller's task, so spies see them.
+
+    (TestClient runs the app on a portal thread, out of reach of the contextvar.)
+    """
+    from main import app
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    return httpx.AsyncClient(transport=transport, base_url="http://testserver")
+
+def attempt(options_path: str, options_body: dict, verify_path: str, verify_body: dict) -> tuple:
+    """(status, calls) for one options + verify round trip under spying()."""
+
+    async def main():
+        async with async_client() as client:
+            await client.post(options_path, json=options_body)
+            calls = []
+            collect_calls(calls)
+            r = await client.post(verify_path, json=verify_body)
+            return r.status_code, calls
+
+    with spying():
+        return asyncio.run(main())
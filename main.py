@@ -1,29 +1,89 @@
+import time
+
+_import_started = time.perf_counter()
+
+import threading
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from starlette.middleware.sessions import SessionMiddleware
+from fastapi.responses import PlainTextResponse
 
+import admission
+import assets
+import audit
+import crypto_store
 import db
-from config import ORIGIN, SESSION_SECRET
+import metrics
+import session
+import shared_state
+from metrics import MetricsMiddleware
+import verifier
+from challenge_store import store as challenge_store
+import executors
+from storage import backend as storage
+from config import INIT_LOCK_PATH, ORIGIN, SESSION_SECRET, METRICS_ENABLED
+from credential_routes import router as credential_router
 from webauthn_routes import router as webauthn_router
 
-app = FastAPI()
+# Seconds spent importing this module and running the lifespan startup.
+STARTUP_SECONDS: dict[str, float] = {}
+
+def init_local_db() -> list[int]:
+    # Workers starting together wait here while the first one migrates.
+    with shared_state.file_lock(INIT_LOCK_PATH):
+        return db.init_db()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # Challenges, rate limits, the invalidation log and auth events live in
+    # SQLite even when users and credentials are in PostgreSQL.
+    await executors.run_db(init_local_db)
+    await storage.open()
+    crypto_store.sign_count_writer.start()
+    audit.log.start()
+    challenge_store.start()
+    # Serving starts now; the first verify finds py_webauthn already loaded.
+    threading.Thread(target=verifier.preload, name="preload", daemon=True).start()
+    STARTUP_SECONDS["lifespan"] = time.perf_counter() - started
+    yield
+    challenge_store.stop()
+    # The final flush may need the event loop (postgres), so not on it.
+    await executors.run_db(crypto_store.sign_count_writer.stop)
+    await executors.run_db(audit.log.stop)
+    await storage.close()
+    executors.shutdown()
+    db.close_pool()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
-    SessionMiddleware,
+    session.SessionMiddleware,
     secret_key=SESSION_SECRET,
     same_site="lax",
     https_only=ORIGIN.startswith("https://"),
 )
 
-db.init_db()
-
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# The login page and its script come from memory, precompressed.
+static_assets = assets.StaticAssets(assets.bundle)
+app.add_route("/", static_assets, methods=["GET", "HEAD"], include_in_schema=False)
+app.mount("/static", static_assets, name="static")
 app.include_router(webauthn_router)
+app.include_router(credential_router)
 
-@app.get("/", response_class=HTMLResponse)
-def index():
-    with open("static/index.html", "r", encoding="utf-8") as f:
-        return f.read()
+# Inside metrics (so rejections are counted) but outside the session layer,
+# so over-limit requests never decode the cookie.
+app.add_middleware(
+    admission.AdmissionMiddleware,
+    routes={
+        "/api/register/options": "register_options",
+        "/api/register/verify": "register_verify",
+        "/api/login/options": "login_options",
+        "/api/login/verify": "login_verify",
+    },
+)
+
+# Added last so it is outermost and its timing includes the session layer.
+app.add_middleware(MetricsMiddleware, routes=[r.path for r in app.routes if hasattr(r, "methods")])
 
 @app.get("/api/me")
 def me(request: Request):
@@ -33,4 +93,42 @@ def me(request: Request):
 @app.post("/api/logout")
 def logout(request: Request):
     request.session.clear()
-    return {"ok": True}
\ No newline at end of file
+    return {"ok": True}
+
+def _pool_gauge() -> dict:
+    pool = db.get_pool()
+    return {("opened",): pool.opened, ("idle",): pool.idle, ("size",): pool.size}
+
+def _cache_gauge() -> dict:
+    c = crypto_store.cache
+    v = verifier.engine.stats()
+    return {
+        ("credentials", "entries"): len(c),
+        ("credentials", "hits"): c.hits,
+        ("credentials", "misses"): c.misses,
+        ("credentials", "evictions"): c.evictions,
+        ("verifier_keys", "entries"): v["cached_keys"],
+        ("verifier_keys", "hits"): v["key_hits"],
+        ("verifier_keys", "misses"): v["key_misses"],
+    }
+
+def _backlog_gauge() -> dict:
+    out = {("sign_count_writes",): crypto_store.sign_count_writer.pending, ("audit_events",): audit.log.pending}
+    if not challenge_store.blocking:
+        out[("challenges",)] = len(challenge_store)
+    return out
+
+def _startup_gauge() -> dict:
+    return {(phase,): seconds for phase, seconds in STARTUP_SECONDS.items()}
+
+metrics.gauge("passkeys_db_connections", "SQLite connection pool state.", ["state"], _pool_gauge)
+metrics.gauge("passkeys_cache", "In-process cache sizes and hit/miss totals.", ["cache", "stat"], _cache_gauge)
+metrics.gauge("passkeys_pending", "Items waiting in in-process queues.", ["queue"], _backlog_gauge)
+metrics.gauge("passkeys_startup_seconds", "Cold start time by phase.", ["phase"], _startup_gauge)
+
+if METRICS_ENABLED:
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    def prometheus_metrics():
+        return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+STARTUP_SECONDS["import"] = time.perf_counter() - _import_started
@@ -0,0 +1,263 @@
+"""In-process metrics with Prometheus text exposition.
+
+Recording is a bisect plus a few integer adds under a per-series lock;
+label lookups are resolved once and cached, so hot-path cost stays in the
+sub-microsecond range. Gauges are callbacks evaluated only at scrape time.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional, Sequence
+
+# Seconds; tuned for a pipeline whose stages run from ~10us to ~100ms.
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_float(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v))
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1) -> None:
+        with self._lock:
+            self.value += n
+
+class _HistogramChild:
+    __slots__ = ("bounds_ns", "counts", "sum_ns", "count", "_lock")
+
+    def __init__(self, bounds_ns: list[int]) -> None:
+        self.bounds_ns = bounds_ns
+        self.counts = [0] * (len(bounds_ns) + 1)
+        self.sum_ns = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe_ns(self, ns: int) -> None:
+        i = bisect_left(self.bounds_ns, ns)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum_ns += ns
+            self.count += 1
+
+    def time(self) -> "Timer":
+        return Timer(self)
+
+class Timer:
+    """`with hist.labels("x").time():` records the block's wall time."""
+
+    __slots__ = ("child", "t0")
+
+    def __init__(self, child: _HistogramChild) -> None:
+        self.child = child
+
+    def __enter__(self) -> "Timer":
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.child.observe_ns(time.perf_counter_ns() - self.t0)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, n: int = 1) -> None:
+        self.labels().inc(n)
+
+    def value(self, *labels: str) -> int:
+        child = self._children.get(labels)
+        return child.value if child else 0
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for values, child in sorted(self._children.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, values)} {child.value}")
+        return lines
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._bounds_ns = [int(b * 1e9) for b in self.buckets]
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self._bounds_ns)
+
+    def observe_ns(self, ns: int) -> None:
+        self.labels().observe_ns(ns)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for values, child in sorted(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total, sum_ns = child.count, child.sum_ns
+            cumulative = 0
+            for bound, n in zip(list(self.buckets) + [float("inf")], counts):
+                cumulative += n
+                le = f'le="{_fmt_float(bound)}"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _fmt_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_fmt_float(sum_ns / 1e9)}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+class Gauge(_Metric):
+    """Callback gauge: `fn` returns {label values tuple: value}, read at scrape."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], fn: Callable[[], dict]) -> None:
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        try:
+            samples = self.fn()
+        except Exception:
+            return lines
+        for values, v in sorted(samples.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, values)} {_fmt_float(v)}")
+        return lines
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def metrics(self) -> Iterable[_Metric]:
+        return list(self._metrics.values())
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+def gauge(name: str, help: str, labelnames: Sequence[str], fn: Callable[[], dict]) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames, fn))
+
+STAGE_SECONDS = histogram(
+    "passkeys_stage_seconds",
+    "Time spent per auth pipeline stage.",
+    ["stage"],
+)
+REQUEST_SECONDS = histogram(
+    "passkeys_request_seconds",
+    "End-to-end handler latency by route.",
+    ["route", "status"],
+)
+AUTH_FAILURES = counter(
+    "passkeys_auth_failures_total",
+    "Rejected requests by endpoint and reason.",
+    ["endpoint", "reason"],
+)
+AUTH_SUCCESSES = counter(
+    "passkeys_auth_successes_total",
+    "Completed registrations and logins.",
+    ["endpoint"],
+)
+
+def stage(name: str) -> Timer:
+    """Time a pipeline stage: json_parse, db_lookup, aes_decrypt, ..."""
+    return Timer(STAGE_SECONDS.labels(name))
+
+def observe_stage_ns(name: str, ns: int) -> None:
+    STAGE_SECONDS.labels(name).observe_ns(ns)
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route latency and status.
+
+    Only paths in `routes` get their own label; everything else is "other",
+    which keeps series cardinality fixed.
+    """
+
+    def __init__(self, app, routes: Iterable[str]) -> None:
+        self.app = app
+        self.routes = frozenset(routes)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = scope.get("path", "")
+        route = path if path in self.routes else "other"
+        status = {"code": 500}
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter_ns()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_SECONDS.labels(route, str(status["code"])).observe_ns(time.perf_counter_ns() - t0)
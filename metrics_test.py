@@ -0,0 +1,36 @@
+from fastapi.testclient import TestClient
+
+import metrics
+from main import app
+
+
+def test_histogram_and_counter_render():
+    reg = metrics.Registry()
+    h = reg.register(metrics.Histogram("t_seconds", "help", ["stage"], buckets=(0.001, 0.01)))
+    c = reg.register(metrics.Counter("t_total", "help", ["reason"]))
+    h.labels("a").observe_ns(500_000)
+    h.labels("a").observe_ns(5_000_000)
+    h.labels("a").observe_ns(50_000_000)
+    c.labels("bad").inc()
+    c.labels("bad").inc()
+
+    text = reg.render()
+    assert 't_seconds_bucket{stage="a",le="0.001"} 1' in text
+    assert 't_seconds_bucket{stage="a",le="0.01"} 2' in text
+    assert 't_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 't_seconds_count{stage="a"} 3' in text
+    assert 't_total{reason="bad"} 2' in text
+
+
+def test_metrics_endpoint_reports_failures_and_stages():
+    with TestClient(app) as client:
+        before = metrics.AUTH_FAILURES.value("login_verify", "bad_type")
+        r = client.post("/api/login/verify", json={"credential": {"id": "AA"}})
+        assert r.status_code == 400
+        assert metrics.AUTH_FAILURES.value("login_verify", "bad_type") == before + 1
+
+        text = client.get("/metrics").text
+        assert 'passkeys_stage_seconds_count{stage="json_parse"}' in text
+        assert 'passkeys_request_seconds_count{route="/api/login/verify",status="400"}' in text
+        assert 'passkeys_db_connections{state="size"}' in text
+        assert 'passkeys_cache{cache="credentials",stat="entries"}' in text
@@ -0,0 +1,233 @@
+"""Versioned schema migrations, tracked in `PRAGMA user_version`.
+
+Each migration is a step function run inside `BEGIN IMMEDIATE`, so several
+processes starting at once serialize on the write lock and only one applies
+it. A step returns how many rows it touched; a step that still has work to do
+is called again in a fresh transaction and the version is only bumped once a
+call reports 0. Long backfills therefore commit in batches, and WAL readers
+(and, between batches, writers) keep running while the app starts.
+"""
+import json
+import sqlite3
+from typing import Callable, NamedTuple
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Bits for the `credentials.transports_mask` column; order is append-only.
+TRANSPORT_BITS = {
+    "usb": 1 << 0,
+    "nfc": 1 << 1,
+    "ble": 1 << 2,
+    "internal": 1 << 3,
+    "hybrid": 1 << 4,
+    "smart-card": 1 << 5,
+    "cable": 1 << 6,
+}
+
+def encode_transports(transports) -> int:
+    mask = 0
+    for t in transports or ():
+        mask |= TRANSPORT_BITS.get(t, 0)
+    return mask
+
+def decode_transports(mask: int) -> list[str]:
+    return [name for name, bit in TRANSPORT_BITS.items() if mask & bit]
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    step: Callable[[sqlite3.Connection], int]
+
+def _initial_schema(conn: sqlite3.Connection) -> int:
+    # Matches what init_db used to create, so pre-migration DBs are a no-op.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            user_handle BLOB NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS credentials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+
+            credential_id_hash BLOB UNIQUE NOT NULL,
+            credential_id_enc  BLOB NOT NULL,
+
+            public_key_enc     BLOB NOT NULL,
+            sign_count         INTEGER NOT NULL DEFAULT 0,
+            transports         TEXT,
+            device_type        TEXT,
+            backed_up          INTEGER NOT NULL DEFAULT 0,
+
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """
+    )
+    # Short-lived, looked up by primary key only: no rowid indirection.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS challenges (
+            id         TEXT PRIMARY KEY,
+            kind       TEXT NOT NULL,
+            challenge  BLOB NOT NULL,
+            username   TEXT,
+            issued_at  REAL NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS challenges_issued_at ON challenges(issued_at)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS key_rotation_state (
+            job         TEXT PRIMARY KEY,
+            target_kid  INTEGER NOT NULL,
+            last_id     INTEGER NOT NULL DEFAULT 0,
+            rewritten   INTEGER NOT NULL DEFAULT 0,
+            updated_at  REAL NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    return 0
+
+def _lookup_indexes(conn: sqlite3.Connection) -> int:
+    # login/options and excludeCredentials fetch by user; without this every
+    # lookup scans the whole credentials table.
+    conn.execute("CREATE INDEX IF NOT EXISTS credentials_user_id ON credentials(user_id)")
+    # Usernameless login resolves the account from the assertion's userHandle.
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_user_handle ON users(user_handle)")
+    return 0
+
+def _add_transports_mask(conn: sqlite3.Connection) -> int:
+    # Constant default: SQLite only rewrites the schema, not the rows.
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(credentials)")}
+    if "transports_mask" not in columns:
+        conn.execute("ALTER TABLE credentials ADD COLUMN transports_mask INTEGER NOT NULL DEFAULT 0")
+    return 0
+
+def _backfill_transports_mask(conn: sqlite3.Connection) -> int:
+    rows = conn.execute(
+        "SELECT id, transports FROM credentials WHERE transports IS NOT NULL LIMIT ?",
+        (BACKFILL_BATCH_SIZE,),
+    ).fetchall()
+    updates = []
+    for cred_id, transports_json in rows:
+        try:
+            transports = json.loads(transports_json)
+        except ValueError:
+            transports = []
+        updates.append((encode_transports(transports), cred_id))
+    # Clearing the JSON text is what marks a row as done.
+    conn.executemany("UPDATE credentials SET transports_mask = ?, transports = NULL WHERE id = ?", updates)
+    return len(updates)
+
+def _rate_limits(conn: sqlite3.Connection) -> int:
+    # Token buckets shared by every worker on the host (admission.py).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            key      TEXT PRIMARY KEY,
+            tokens   REAL NOT NULL,
+            updated  REAL NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    return 0
+
+def _cache_invalidations(conn: sqlite3.Connection) -> int:
+    # Log of cache invalidations replayed by the other workers (shared_state.py).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cache_invalidations (
+            seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+            cred_hash   BLOB,
+            user_id     INTEGER,
+            origin      INTEGER NOT NULL,
+            created_at  REAL NOT NULL
+        )
+        """
+    )
+    return 0
+
+def _credential_metadata(conn: sqlite3.Connection) -> int:
+    # NULL defaults: schema-only change. Rows from before this are "unknown".
+    # Keyset pages (user_id = ? AND id > ? ORDER BY id) are served by
+    # credentials_user_id, whose entries already carry the rowid.
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(credentials)")}
+    for name, decl in (("created_at", "REAL"), ("last_used_at", "REAL"), ("nickname", "TEXT")):
+        if name not in columns:
+            conn.execute(f"ALTER TABLE credentials ADD COLUMN {name} {decl}")
+    return 0
+
+def _auth_events(conn: sqlite3.Connection) -> int:
+    # Append-only; written in batches by audit.py's background writer.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS auth_events (
+            id          INTEGER PRIMARY KEY,
+            ts          REAL NOT NULL,
+            event       TEXT NOT NULL,
+            outcome     TEXT NOT NULL,
+            reason      TEXT,
+            username    TEXT,
+            cred_hash   BLOB,
+            ip          TEXT
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS auth_events_ts ON auth_events(ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS auth_events_username ON auth_events(username, ts)")
+    return 0
+
+def _challenge_user_id(conn: sqlite3.Connection) -> int:
+    # login/verify compares the credential's owner against this instead of
+    # looking the username up again.
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(challenges)")}
+    if "user_id" not in columns:
+        conn.execute("ALTER TABLE challenges ADD COLUMN user_id INTEGER")
+    return 0
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "initial schema", _initial_schema),
+    Migration(2, "credentials(user_id) and users(user_handle) indexes", _lookup_indexes),
+    Migration(3, "credentials.transports_mask column", _add_transports_mask),
+    Migration(4, "backfill transports_mask from JSON", _backfill_transports_mask),
+    Migration(5, "rate_limits table", _rate_limits),
+    Migration(6, "cache_invalidations log", _cache_invalidations),
+    Migration(7, "credentials created_at, last_used_at and nickname", _credential_metadata),
+    Migration(8, "auth_events log", _auth_events),
+    Migration(9, "challenges.user_id column", _challenge_user_id),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection, migrations: list[Migration] = MIGRATIONS) -> list[int]:
+    """Bring the schema up to date and return the versions applied here."""
+    applied = []
+    for m in migrations:
+        if current_version(conn) >= m.version:
+            continue
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have finished it while we waited.
+                if current_version(conn) >= m.version:
+                    conn.rollback()
+                    break
+                if m.step(conn) == 0:
+                    conn.execute(f"PRAGMA user_version = {int(m.version)}")
+                    conn.commit()
+                    applied.append(m.version)
+                    break
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+    return applied
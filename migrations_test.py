@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import db
+import migrations
+
+
+@pytest.fixture
+def conn(tmp_path):
+    c = db.get_db(str(tmp_path / "m.sqlite3"))
+    yield c
+    c.close()
+
+
+def test_fresh_db_reaches_latest_version(conn):
+    assert migrations.migrate(conn) == [m.version for m in migrations.MIGRATIONS]
+    assert migrations.current_version(conn) == migrations.LATEST_VERSION
+    assert migrations.migrate(conn) == []
+
+    indexes = {r[1] for r in conn.execute("SELECT type, name FROM sqlite_master WHERE type = 'index'")}
+    assert {"credentials_user_id", "users_user_handle"} <= indexes
+
+
+def test_login_lookup_uses_indexes(conn):
+    migrations.migrate(conn)
+    plan = " ".join(
+        r[3]
+        for r in conn.execute(
+            """
+            EXPLAIN QUERY PLAN
+            SELECT u.id AS uid, c.* FROM (SELECT ? AS username) AS q
+            LEFT JOIN users u ON u.username = q.username
+            LEFT JOIN credentials c ON c.user_id = u.id
+            """,
+            ("x",),
+        )
+    )
+    assert "credentials_user_id" in plan
+    assert "SCAN c" not in plan and "SCAN credentials" not in plan
+
+
+def test_legacy_transports_are_backfilled_in_batches(conn, monkeypatch):
+    monkeypatch.setattr(migrations, "BACKFILL_BATCH_SIZE", 2)
+    migrations.migrate(conn, migrations.MIGRATIONS[:1])
+    conn.execute("INSERT INTO users(id, username, user_handle) VALUES (1, 'u', x'00')")
+    legacy = [["internal"], ["usb", "nfc"], [], ["hybrid", "bogus"], None]
+    for i, t in enumerate(legacy):
+        conn.execute(
+            """
+            INSERT INTO credentials(user_id, credential_id_hash, credential_id_enc, public_key_enc, transports)
+            VALUES (1, ?, x'00', x'00', ?)
+            """,
+            (bytes([i]), json.dumps(t)),
+        )
+    conn.commit()
+
+    assert migrations.migrate(conn) == [2, 3, 4, 5, 6, 7, 8, 9]
+    rows = conn.execute("SELECT transports, transports_mask FROM credentials ORDER BY id").fetchall()
+    assert all(r[0] is None for r in rows)
+    assert [migrations.decode_transports(r[1]) for r in rows] == [
+        ["internal"], ["usb", "nfc"], [], ["hybrid"], []
+    ]
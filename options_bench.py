@@ -0,0 +1,116 @@
+"""Encode-path benchmark for the options responses.
+
+Compares building a register/options and login/options body the old way
+(py_webauthn structs -> options_to_json -> json.loads -> JSONResponse) with
+the pre-serialized templates in webauthn_options, for each JSON backend
+available here. Reports time per response and the response bytes per
+second one core can produce.
+
+    python options_bench.py --iterations 20000 --credentials 4
+"""
+import argparse
+import json
+import time
+from typing import Callable
+
+import webauthn_options
+from config import RP_ID, RP_NAME
+
+def legacy_encoders() -> dict[str, Callable[[bytes, list[bytes]], bytes]]:
+    from fastapi.responses import JSONResponse
+    from webauthn import generate_authentication_options, generate_registration_options, options_to_json
+    from webauthn.helpers.structs import (
+        AttestationConveyancePreference,
+        AuthenticatorAttachment,
+        AuthenticatorSelectionCriteria,
+        PublicKeyCredentialDescriptor,
+        ResidentKeyRequirement,
+        UserVerificationRequirement,
+    )
+
+    def register(challenge: bytes, ids: list[bytes]) -> bytes:
+        options = generate_registration_options(
+            rp_id=RP_ID,
+            rp_name=RP_NAME,
+            challenge=challenge,
+            user_id=b"u" * 16,
+            user_name="bench-user",
+            user_display_name="bench-user",
+            attestation=AttestationConveyancePreference.NONE,
+            authenticator_selection=AuthenticatorSelectionCriteria(
+                authenticator_attachment=AuthenticatorAttachment.PLATFORM,
+                resident_key=ResidentKeyRequirement.PREFERRED,
+                user_verification=UserVerificationRequirement.REQUIRED,
+            ),
+            exclude_credentials=[PublicKeyCredentialDescriptor(id=c) for c in ids],
+        )
+        return JSONResponse(content=json.loads(options_to_json(options))).body
+
+    def login(challenge: bytes, ids: list[bytes]) -> bytes:
+        options = generate_authentication_options(
+            rp_id=RP_ID,
+            challenge=challenge,
+            allow_credentials=[PublicKeyCredentialDescriptor(id=c) for c in ids],
+            user_verification=UserVerificationRequirement.REQUIRED,
+        )
+        return JSONResponse(content=json.loads(options_to_json(options))).body
+
+    return {"register": register, "login": login}
+
+def template_encoders() -> dict[str, Callable[[bytes, list[bytes]], bytes]]:
+    return {
+        "register": lambda c, ids: webauthn_options.registration_options(c, b"u" * 16, "bench-user", ids),
+        "login": webauthn_options.authentication_options,
+    }
+
+def backends() -> list[str]:
+    out = ["json"]
+    try:
+        webauthn_options.make_dumps("orjson")
+        out.append("orjson")
+    except RuntimeError:
+        pass
+    return out
+
+def measure(encode: Callable[[bytes, list[bytes]], bytes], ids: list[bytes], iterations: int) -> dict:
+    challenge = webauthn_options.generate_challenge()
+    size = len(encode(challenge, ids))
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        encode(challenge, ids)
+    elapsed = time.perf_counter() - t0
+    return {
+        "us_per_response": round(elapsed / iterations * 1e6, 2),
+        "bytes": size,
+        "mb_per_s": round(size * iterations / elapsed / 1e6, 1),
+    }
+
+def run(iterations: int, credentials: int) -> dict:
+    ids = [bytes([i]) * 32 for i in range(credentials)]
+    results = {}
+    for endpoint, encode in legacy_encoders().items():
+        results[f"{endpoint}/legacy"] = measure(encode, ids, iterations)
+    for backend in backends():
+        webauthn_options._dumps = webauthn_options.make_dumps(backend)
+        for endpoint, encode in template_encoders().items():
+            results[f"{endpoint}/template-{backend}"] = measure(encode, ids, iterations)
+    webauthn_options._dumps = webauthn_options.make_dumps()
+    return results
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--credentials", type=int, default=4, help="descriptors per allow/exclude list")
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations, args.credentials)
+    print(f"{'path':<28}{'us/resp':>10}{'bytes':>8}{'MB/s':>9}{'speedup':>9}")
+    for name, r in results.items():
+        base = results[name.split("/")[0] + "/legacy"]["us_per_response"]
+        print(
+            f"{name:<28}{r['us_per_response']:>10.2f}{r['bytes']:>8}{r['mb_per_s']:>9.1f}"
+            f"{base / r['us_per_response']:>8.1f}x"
+        )
+
+if __name__ == "__main__":
+    main()
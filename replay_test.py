@@ -1,28 +1,33 @@
-import json
-import requests
+import secrets
 
-BASE = "http://localhost:8000"
+from fastapi.testclient import TestClient
 
-#protection is enforced at the server boundary via:
+from harness import register
+from main import app
+from soft_authenticator import SoftAuthenticator
 
-#Single-use challenge (popped from session on first verify), and
+# Protection is enforced at the server boundary via:
+#   single-use challenges (consumed on the first verify attempt), and
+#   a challenge TTL (so even unused challenges expire).
 
-#Challenge TTL (so even unused challenges expire).
 
-#Copied it from the browser cookie
-SESSION_COOKIE_VALUE = "eyJhdXRoX3VzZXJuYW1lIjogIm11amlidXIiLCAidXNlciI6IHsidXNlcm5hbWUiOiAibXVqaWJ1ciJ9fQ==.aV0B3A.AEbOdIIiG6Dxvv869NTarLukZ6s"
+def test_captured_assertion_cannot_be_replayed():
+    client = TestClient(app)
+    username = f"replay-{secrets.token_hex(4)}"
+    authenticator = SoftAuthenticator()
+    assert register(client, authenticator, username).status_code == 200
 
-with open("assertion.json", "r", encoding="utf-8") as f:
-    assertion = json.load(f)
+    options = client.post("/api/login/options", json={"username": username}).json()
+    assertion = authenticator.get(options)
+    assert client.post("/api/login/verify", json={"credential": assertion}).status_code == 200
 
-s = requests.Session()
-s.cookies.set("session", SESSION_COOKIE_VALUE, domain="localhost", path="/")
+    # Same session: the challenge is gone.
+    r = client.post("/api/login/verify", json={"credential": assertion})
+    assert r.status_code == 400 and "login expired" in r.text
 
-r = s.post(f"{BASE}/api/login/verify", json={"credential": assertion})
-print("Status:", r.status_code)
-print("Body:", r.text)
-
-#The result of the test would be failed
-#python replay_test.py
-#Status: 400
-#Body: {"detail":"login expired (start over)"}
+    # Fresh session with its own challenge: the captured one no longer matches.
+    attacker = TestClient(app)
+    attacker.post("/api/login/options", json={"username": username})
+    r = attacker.post("/api/login/verify", json={"credential": assertion})
+    assert r.status_code == 400
+    assert attacker.get("/api/me").json()["user"] is None
@@ -0,0 +1,120 @@
+"""Online re-encryption of stored credentials under the current key.
+
+Walks `credentials` in primary-key order, one short transaction per batch,
+and records its cursor in `key_rotation_state` so it can be stopped and
+resumed at any point. Rows already under the current key are skipped.
+
+    CRED_ENC_KEY_ID=2 CRED_ENC_KEY_B64URL=<new> CRED_ENC_OLD_KEYS=1:<old> \\
+        python rotate_keys.py [--batch-size 500] [--pause-ms 50] [--restart]
+"""
+import argparse
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+import crypto_store
+import db
+from config import KEY_ROTATION_BATCH_SIZE, KEY_ROTATION_PAUSE_MS
+
+JOB = "credentials"
+
+class BatchResult(NamedTuple):
+    scanned: int
+    rewritten: int
+    done: bool
+
+class RotationJob:
+    def __init__(
+        self,
+        keyring: crypto_store.Keyring = crypto_store.keyring,
+        batch_size: int = KEY_ROTATION_BATCH_SIZE,
+        pause_seconds: float = KEY_ROTATION_PAUSE_MS / 1000.0,
+        job: str = JOB,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.keyring = keyring
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.job = job
+        self.clock = clock
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _cursor(self, restart: bool = False) -> int:
+        state = db.get_rotation_state(self.job)
+        if restart or state is None or state["target_kid"] != self.keyring.current_kid:
+            db.reset_rotation_state(self.job, self.keyring.current_kid, self.clock())
+            return 0
+        return int(state["last_id"])
+
+    def run_batch(self, last_id: int) -> tuple[BatchResult, int]:
+        rows = db.list_credential_blobs_after(last_id, self.batch_size)
+        if not rows:
+            return BatchResult(0, 0, True), last_id
+
+        updates = []
+        for row in rows:
+            aad = crypto_store._aad(int(row["user_id"]))
+            old_cid = bytes(row["credential_id_enc"])
+            old_pk = bytes(row["public_key_enc"])
+            cid, cid_kid = self.keyring.decrypt_with_kid(old_cid, aad)
+            pk, pk_kid = self.keyring.decrypt_with_kid(old_pk, aad)
+            if cid_kid == pk_kid == self.keyring.current_kid:
+                continue
+            new_cid, new_pk = self.keyring.encrypt_many([(cid, aad), (pk, aad)])
+            updates.append((int(row["id"]), old_cid, old_pk, new_cid, new_pk))
+
+        new_last_id = int(rows[-1]["id"])
+        rewritten = db.apply_reencrypted_blobs(self.job, new_last_id, updates, self.clock())
+        return BatchResult(len(rows), rewritten, len(rows) < self.batch_size), new_last_id
+
+    def run(self, restart: bool = False, progress: Optional[Callable[[int, int, int], None]] = None) -> tuple[int, int]:
+        """Run to completion (or until `stop()`); returns (scanned, rewritten)."""
+        last_id = self._cursor(restart)
+        scanned = rewritten = 0
+        while not self._stop.is_set():
+            result, last_id = self.run_batch(last_id)
+            scanned += result.scanned
+            rewritten += result.rewritten
+            if progress is not None:
+                progress(last_id, scanned, rewritten)
+            if result.done:
+                break
+            if self.pause_seconds > 0:
+                self._stop.wait(self.pause_seconds)
+        return scanned, rewritten
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="key-rotation", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=KEY_ROTATION_BATCH_SIZE)
+    parser.add_argument("--pause-ms", type=int, default=KEY_ROTATION_PAUSE_MS)
+    parser.add_argument("--restart", action="store_true", help="ignore the saved cursor")
+    args = parser.parse_args()
+
+    db.init_db()
+    job = RotationJob(batch_size=args.batch_size, pause_seconds=args.pause_ms / 1000.0)
+
+    def progress(last_id: int, scanned: int, rewritten: int) -> None:
+        print(f"last_id={last_id} scanned={scanned} rewritten={rewritten}", flush=True)
+
+    try:
+        scanned, rewritten = job.run(restart=args.restart, progress=progress)
+    finally:
+        db.close_pool()
+    print(f"done: scanned={scanned} rewritten={rewritten} key_id={job.keyring.current_kid}")
+
+if __name__ == "__main__":
+    main()
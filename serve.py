@@ -0,0 +1,78 @@
+"""Multi-worker entry point: one process per core, all serving one database.
+
+    python serve.py [--workers N] [--host 0.0.0.0] [--port 8000]
+    gunicorn -c serve.py main:app        # needs `pip install gunicorn`
+
+Before any worker starts, the supervisor process:
+
+- turns on the state the workers share (SHARED_STATE=1, CHALLENGE_STORE=sqlite,
+  RATE_LIMIT_STORE=sqlite) unless those are set explicitly,
+- generates one volatile CRED_ENC_KEY_B64URL for all workers if none is set,
+  as the single-process dev fallback would (not for production), and
+- runs the schema migrations once, under INIT_LOCK_PATH.
+
+Sessions are signed cookies, so any worker can serve any request.
+"""
+import argparse
+import base64
+import os
+import secrets
+import sys
+
+SHARED_DEFAULTS = {
+    "SHARED_STATE": "1",
+    "CHALLENGE_STORE": "sqlite",
+    "RATE_LIMIT_STORE": "sqlite",
+}
+
+def prepare_environment(workers: int, environ=os.environ) -> None:
+    """Set up `environ` for `workers` processes; call before importing config."""
+    if workers <= 1:
+        return
+    for name, value in SHARED_DEFAULTS.items():
+        current = environ.setdefault(name, value)
+        if name != "SHARED_STATE" and current.strip().lower() != value:
+            raise SystemExit(f"{name}={current} cannot be shared between {workers} workers; use {value}")
+    if not environ.get("CRED_ENC_KEY_B64URL", "").strip():
+        print("serve: CRED_ENC_KEY_B64URL is not set; using a volatile key for this run", file=sys.stderr)
+        environ["CRED_ENC_KEY_B64URL"] = base64.urlsafe_b64encode(secrets.token_bytes(32)).rstrip(b"=").decode()
+
+def init_schema() -> list[int]:
+    # Imported late: config reads the environment prepared above.
+    import db
+    import shared_state
+    from config import INIT_LOCK_PATH
+
+    try:
+        with shared_state.file_lock(INIT_LOCK_PATH):
+            return db.init_db()
+    finally:
+        db.close_pool()
+
+# gunicorn settings, read when this file is passed as `gunicorn -c serve.py`.
+workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+def on_starting(server) -> None:
+    prepare_environment(server.cfg.workers)
+    init_schema()
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=workers, help="default: WEB_CONCURRENCY or one per core")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    prepare_environment(args.workers)
+    applied = init_schema()
+    if applied:
+        print(f"serve: applied migrations {applied}", file=sys.stderr)
+
+    import uvicorn
+
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""Signed cookie sessions: compact binary payload, decoded on first use.
+
+A drop-in for Starlette's SessionMiddleware (same cookie name, attributes
+and `request.session` dict) that does less per request:
+
+- The cookie is only looked at when a handler touches `request.session`.
+  Requests that never do (static files, /metrics, /) skip it entirely.
+- The payload is a small tag-length-value encoding rather than base64'd
+  JSON, and the signature is one HMAC-SHA256 over the raw bytes.
+- Set-Cookie is only sent when the contents changed, or when the cookie
+  is past half its max_age (so an active session still slides forward).
+  A polled /api/me costs one HMAC and no signing.
+
+Cookie value: base64url(version | issued_at u32 | payload | tag[16]).
+Cookies issued by Starlette's middleware are read once and re-issued in
+this format. Nested values must be replaced, not mutated in place, for the
+change to be noticed.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import struct
+import time
+from typing import Callable, Optional
+
+import metrics
+
+VERSION = 1
+TAG_BYTES = 16
+# Verified cookies remembered per process, so a client polling with the same
+# cookie is checked once; expiry is still checked on every request.
+VERIFIED_CACHE_SIZE = 4096
+_HEAD = struct.Struct(">BI")
+_U16 = struct.Struct(">H")
+_I64 = struct.Struct(">q")
+_CONSTANTS = {b"n": None, b"T": True, b"F": False}
+
+def _pack_str(value: str, out: bytearray) -> None:
+    data = value.encode("utf-8")
+    out += _U16.pack(len(data))
+    out += data
+
+def _pack_value(value, out: bytearray) -> None:
+    if value is None:
+        out += b"n"
+    elif value is True:
+        out += b"T"
+    elif value is False:
+        out += b"F"
+    elif isinstance(value, int):
+        out += b"i" + _I64.pack(value)
+    elif isinstance(value, str):
+        out += b"s"
+        _pack_str(value, out)
+    elif isinstance(value, dict):
+        out += b"d"
+        _pack_dict(value, out)
+    else:
+        raise TypeError(f"session values must be str, int, bool, None or dict, not {type(value).__name__}")
+
+def _pack_dict(d: dict, out: bytearray) -> None:
+    out += _U16.pack(len(d))
+    for key, value in d.items():
+        _pack_str(key, out)
+        _pack_value(value, out)
+
+def encode(session: dict) -> bytes:
+    out = bytearray()
+    _pack_dict(session, out)
+    return bytes(out)
+
+def _unpack_str(data: bytes, pos: int) -> tuple[str, int]:
+    (n,) = _U16.unpack_from(data, pos)
+    end = pos + 2 + n
+    if end > len(data):
+        raise ValueError("truncated")
+    return data[pos + 2 : end].decode("utf-8"), end
+
+def _unpack_dict(data: bytes, pos: int, depth: int = 0) -> tuple[dict, int]:
+    if depth > 8:
+        raise ValueError("too deep")
+    (count,) = _U16.unpack_from(data, pos)
+    pos += 2
+    out = {}
+    for _ in range(count):
+        key, pos = _unpack_str(data, pos)
+        tag = data[pos : pos + 1]
+        pos += 1
+        if tag == b"s":
+            out[key], pos = _unpack_str(data, pos)
+        elif tag == b"d":
+            out[key], pos = _unpack_dict(data, pos, depth + 1)
+        elif tag == b"i":
+            (out[key],) = _I64.unpack_from(data, pos)
+            pos += 8
+        elif tag in _CONSTANTS:
+            out[key] = _CONSTANTS[tag]
+        else:
+            raise ValueError("bad tag")
+    return out, pos
+
+def decode(data: bytes) -> dict:
+    out, pos = _unpack_dict(data, 0)
+    if pos != len(data):
+        raise ValueError("trailing bytes")
+    return out
+
+def _copy(d: dict) -> dict:
+    return {k: _copy(v) if isinstance(v, dict) else v for k, v in d.items()}
+
+class LazySession(dict):
+    """`request.session`: loads the cookie on first access and notes writes
+    that actually change something."""
+
+    __slots__ = ("_loader", "modified", "issued_at", "had_cookie")
+
+    def __init__(self, loader: Callable[["LazySession"], dict]) -> None:
+        super().__init__()
+        self._loader: Optional[Callable] = loader
+        self.modified = False
+        self.issued_at: Optional[int] = None
+        self.had_cookie = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loader is None
+
+    def _load(self) -> None:
+        if self._loader is not None:
+            loader, self._loader = self._loader, None
+            dict.update(self, loader(self))
+
+    def __getitem__(self, key):
+        self._load()
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key) -> bool:
+        self._load()
+        return dict.__contains__(self, key)
+
+    def __iter__(self):
+        self._load()
+        return dict.__iter__(self)
+
+    def __len__(self) -> int:
+        self._load()
+        return dict.__len__(self)
+
+    def __eq__(self, other) -> bool:
+        self._load()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other) -> bool:
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        self._load()
+        return dict.__repr__(self)
+
+    def get(self, key, default=None):
+        self._load()
+        return dict.get(self, key, default)
+
+    def keys(self):
+        self._load()
+        return dict.keys(self)
+
+    def values(self):
+        self._load()
+        return dict.values(self)
+
+    def items(self):
+        self._load()
+        return dict.items(self)
+
+    def copy(self) -> dict:
+        self._load()
+        return dict(dict.items(self))
+
+    def __setitem__(self, key, value) -> None:
+        self._load()
+        if not (dict.__contains__(self, key) and dict.__getitem__(self, key) == value):
+            self.modified = True
+            dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key) -> None:
+        self._load()
+        dict.__delitem__(self, key)
+        self.modified = True
+
+    _MISSING = object()
+
+    def pop(self, key, default=_MISSING):
+        self._load()
+        if dict.__contains__(self, key):
+            self.modified = True
+            return dict.pop(self, key)
+        if default is LazySession._MISSING:
+            raise KeyError(key)
+        return default
+
+    def popitem(self):
+        self._load()
+        item = dict.popitem(self)
+        self.modified = True
+        return item
+
+    def setdefault(self, key, default=None):
+        self._load()
+        if not dict.__contains__(self, key):
+            self.modified = True
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self) -> None:
+        self._load()
+        if dict.__len__(self):
+            self.modified = True
+        dict.clear(self)
+
+class SessionMiddleware:
+    def __init__(
+        self,
+        app,
+        secret_key: str,
+        session_cookie: str = "session",
+        max_age: Optional[int] = 14 * 24 * 60 * 60,
+        path: str = "/",
+        same_site: str = "lax",
+        https_only: bool = False,
+        domain: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.app = app
+        self.secret_key = str(secret_key)
+        self._key = hashlib.sha256(b"passkeys-session\x00" + self.secret_key.encode("utf-8")).digest()
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.path = path
+        self.clock = clock
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:
+            self.security_flags += "; secure"
+        if domain is not None:
+            self.security_flags += f"; domain={domain}"
+        self._cookie_prefix = (session_cookie + "=").encode("latin-1")
+        self._verified: dict[bytes, tuple[int, dict]] = {}
+
+    def _tag(self, body: bytes) -> bytes:
+        return hmac.digest(self._key, body, "sha256")[:TAG_BYTES]
+
+    def sign(self, session: dict, issued_at: int) -> str:
+        body = _HEAD.pack(VERSION, issued_at) + encode(session)
+        token = base64.urlsafe_b64encode(body + self._tag(body)).rstrip(b"=")
+        # The client sends it straight back; no need to verify it then.
+        self._remember(token, issued_at, _copy(session))
+        return token.decode("ascii")
+
+    def _cookie_value(self, scope) -> Optional[bytes]:
+        for name, value in scope.get("headers", ()):
+            if name == b"cookie" and self._cookie_prefix in value:
+                for part in value.split(b";"):
+                    part = part.strip()
+                    if part.startswith(self._cookie_prefix):
+                        return part[len(self._cookie_prefix) :]
+        return None
+
+    def _remember(self, token: bytes, issued_at: int, data: dict) -> None:
+        if len(self._verified) >= VERIFIED_CACHE_SIZE:
+            self._verified.clear()
+        self._verified[token] = (issued_at, data)
+
+    def _verify(self, token: bytes) -> Optional[tuple[int, dict]]:
+        try:
+            raw = base64.urlsafe_b64decode(token + b"=" * (-len(token) % 4))
+        except ValueError:
+            return None
+        if len(raw) < _HEAD.size + TAG_BYTES:
+            return None
+        body, tag = raw[:-TAG_BYTES], raw[-TAG_BYTES:]
+        if not hmac.compare_digest(tag, self._tag(body)):
+            return None
+        version, issued_at = _HEAD.unpack_from(body)
+        if version != VERSION:
+            return None
+        try:
+            return issued_at, decode(body[_HEAD.size :])
+        except (ValueError, UnicodeDecodeError, struct.error):
+            return None
+
+    def unsign(self, token: bytes, session: Optional[LazySession] = None) -> dict:
+        """Verified contents of a cookie value, or {} if it is invalid or expired."""
+        if b"." in token:
+            return self._unsign_legacy(token, session)
+        verified = self._verified.get(token)
+        if verified is None:
+            with metrics.stage("session_read"):
+                verified = self._verify(token)
+            if verified is None:
+                return {}
+            self._remember(token, *verified)
+        issued_at, data = verified
+        if self.max_age and self.clock() - issued_at > self.max_age:
+            return {}
+        if session is not None:
+            session.issued_at = issued_at
+        return _copy(data)
+
+    def _unsign_legacy(self, token: bytes, session: Optional[LazySession]) -> dict:
+        # Starlette's itsdangerous + JSON cookie; re-issued in our format.
+        import itsdangerous
+
+        try:
+            data = itsdangerous.TimestampSigner(self.secret_key).unsign(token, max_age=self.max_age)
+            value = json.loads(base64.b64decode(data))
+        except (itsdangerous.BadSignature, ValueError):
+            return {}
+        if not isinstance(value, dict):
+            return {}
+        if session is not None:
+            session.modified = True
+        return value
+
+    def _loader(self, scope) -> Callable[[LazySession], dict]:
+        def load(session: LazySession) -> dict:
+            token = self._cookie_value(scope)
+            if token is None:
+                return {}
+            session.had_cookie = True
+            return self.unsign(token, session)
+
+        return load
+
+    def _set_cookie_header(self, session: LazySession) -> Optional[bytes]:
+        if not session.loaded:
+            return None
+        now = int(self.clock())
+        if dict.__len__(session):
+            stale = (
+                self.max_age is not None
+                and session.issued_at is not None
+                and now - session.issued_at > self.max_age // 2
+            )
+            if not (session.modified or stale):
+                return None
+            with metrics.stage("session_write"):
+                value = self.sign(session, now)
+            max_age = f"Max-Age={self.max_age}; " if self.max_age else ""
+            return f"{self.session_cookie}={value}; path={self.path}; {max_age}{self.security_flags}".encode("latin-1")
+        if session.had_cookie and session.modified:
+            expires = "expires=Thu, 01 Jan 1970 00:00:00 GMT; "
+            return f"{self.session_cookie}=null; path={self.path}; {expires}{self.security_flags}".encode("latin-1")
+        return None
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        session = LazySession(self._loader(scope))
+        scope["session"] = session
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                header = self._set_cookie_header(session)
+                if header is not None:
+                    message["headers"] = [*message.get("headers", ()), (b"set-cookie", header)]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
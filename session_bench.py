@@ -0,0 +1,98 @@
+"""Per-request cost of the session layer.
+
+Runs Starlette's SessionMiddleware (what main.py used before) and
+session.SessionMiddleware around a trivial ASGI app, with a signed-in
+cookie, and reports the time each adds over no middleware at all:
+
+    untouched   handler never reads the session (static files, /metrics)
+    read        handler reads session["user"] (the polled /api/me)
+    write       handler stores a new challenge handle (*/options)
+
+    python session_bench.py --iterations 20000
+"""
+import argparse
+import asyncio
+import secrets
+import time
+from typing import Callable
+
+from starlette.middleware.sessions import SessionMiddleware as StarletteSessionMiddleware
+
+import session
+
+SECRET = "bench-secret"
+SESSION = {"user": {"username": "bench-user"}, "auth_ctx": secrets.token_urlsafe(16)}
+
+def _handler(kind: str):
+    async def app(scope, receive, send) -> None:
+        if kind == "read":
+            scope["session"].get("user")
+        elif kind == "write":
+            scope["session"]["auth_ctx"] = secrets.token_urlsafe(16)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    return app
+
+def _cookie(middleware_cls) -> bytes:
+    """A Set-Cookie value from the middleware for SESSION."""
+    captured = {}
+
+    async def login(scope, receive, send) -> None:
+        scope["session"].update(SESSION)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    async def send(message) -> None:
+        for name, value in message.get("headers", ()):
+            if name == b"set-cookie":
+                captured["cookie"] = value.split(b";", 1)[0]
+
+    scope = {"type": "http", "headers": []}
+    asyncio.run(middleware_cls(login, secret_key=SECRET)(scope, None, send))
+    return captured["cookie"]
+
+def measure(app: Callable, cookie: bytes, iterations: int) -> float:
+    """Microseconds per request."""
+    headers = [(b"cookie", b"theme=dark; " + cookie), (b"accept", b"application/json")]
+
+    async def send(message) -> None:
+        pass
+
+    async def loop() -> float:
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            await app({"type": "http", "path": "/api/me", "headers": headers}, None, send)
+        return time.perf_counter() - t0
+
+    return asyncio.run(loop()) / iterations * 1e6
+
+def run(iterations: int) -> dict:
+    layers = {"starlette": StarletteSessionMiddleware, "compact": session.SessionMiddleware}
+    cookies = {name: _cookie(cls) for name, cls in layers.items()}
+    results = {}
+    for kind in ("untouched", "read", "write"):
+        # The bare app does the same send()s without a session to touch.
+        bare = measure(_handler("untouched"), b"", iterations)
+        for name, cls in layers.items():
+            total = measure(cls(_handler(kind), secret_key=SECRET), cookies[name], iterations)
+            results[f"{kind}/{name}"] = {
+                "us_per_request": round(total, 2),
+                "overhead_us": round(max(total - bare, 0.0), 2),
+                "cookie_bytes": len(cookies[name]),
+            }
+    return results
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations)
+    print(f"{'case':<22}{'us/req':>9}{'overhead':>10}{'cookie':>8}{'speedup':>9}")
+    for name, r in results.items():
+        base = results[name.split("/")[0] + "/starlette"]["overhead_us"]
+        speedup = f"{base / r['overhead_us']:>8.1f}x" if r["overhead_us"] else f"{'-':>9}"
+        print(f"{name:<22}{r['us_per_request']:>9.2f}{r['overhead_us']:>10.2f}{r['cookie_bytes']:>8}{speedup}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import base64
+import json
+import secrets
+import struct
+
+import itsdangerous
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import session
+from harness import enroll
+from main import app as main_app
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_800_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_client(clock=None, max_age=3600):
+    seen = {}
+
+    async def login(request):
+        request.session["user"] = {"username": "alice"}
+        return JSONResponse({})
+
+    async def me(request):
+        return JSONResponse({"user": request.session.get("user")})
+
+    async def logout(request):
+        request.session.clear()
+        return JSONResponse({})
+
+    async def untouched(request):
+        seen["session"] = request.scope["session"]
+        return JSONResponse({})
+
+    app = Starlette(
+        routes=[Route(p, f, methods=["GET"]) for p, f in [("/login", login), ("/me", me), ("/logout", logout), ("/untouched", untouched)]]
+    )
+    app.add_middleware(session.SessionMiddleware, secret_key="s3cret", max_age=max_age, clock=clock or Clock())
+    return TestClient(app), seen
+
+
+def test_codec_round_trip():
+    data = {"user": {"username": "Zoë ✓", "id": -(2**40)}, "reg_ctx": "x" * 300, "ok": True, "no": False, "n": None}
+    assert session.decode(session.encode(data)) == data
+    assert session.decode(session.encode({})) == {}
+    with pytest.raises(TypeError):
+        session.encode({"f": 1.5})
+    blob = session.encode(data)
+    for bad in (blob[:-1], blob + b"\x00", b"\x00\x01\x00\x01kz"):
+        with pytest.raises((ValueError, UnicodeDecodeError, struct.error)):
+            session.decode(bad)
+
+
+def test_cookie_only_written_when_changed():
+    client, seen = make_client()
+    r = client.get("/login")
+    assert "set-cookie" in r.headers
+
+    r = client.get("/me")
+    assert r.json()["user"] == {"username": "alice"}
+    assert "set-cookie" not in r.headers
+
+    r = client.get("/untouched")
+    assert "set-cookie" not in r.headers and not seen["session"].loaded
+
+    r = client.get("/logout")
+    assert r.headers["set-cookie"].startswith("session=null;")
+    assert client.get("/me").json()["user"] is None
+
+
+def test_tampered_or_expired_cookie_is_ignored():
+    clock = Clock()
+    client, _ = make_client(clock)
+    client.get("/login")
+    token = client.cookies["session"]
+
+    raw = bytearray(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    raw[6] ^= 1
+    client.cookies.clear()
+    client.cookies.set("session", base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode())
+    assert client.get("/me").json()["user"] is None
+
+    client.cookies.clear()
+    client.cookies.set("session", token)
+    assert client.get("/me").json()["user"] == {"username": "alice"}
+    clock.now += 3601
+    assert client.get("/me").json()["user"] is None
+
+
+def test_active_session_is_refreshed_past_half_its_age():
+    clock = Clock()
+    client, _ = make_client(clock)
+    client.get("/login")
+    clock.now += 1000
+    assert "set-cookie" not in client.get("/me").headers
+    clock.now += 1000
+    assert "set-cookie" in client.get("/me").headers
+    clock.now += 3000
+    assert client.get("/me").json()["user"] == {"username": "alice"}
+
+
+def test_starlette_cookie_is_upgraded():
+    client, _ = make_client()
+    legacy = itsdangerous.TimestampSigner("s3cret").sign(base64.b64encode(json.dumps({"user": {"username": "bob"}}).encode()))
+    client.cookies.set("session", legacy.decode())
+    r = client.get("/me")
+    assert r.json()["user"] == {"username": "bob"}
+    upgraded = r.cookies["session"]
+    assert "." not in upgraded
+
+    client.cookies.clear()
+    client.cookies.set("session", upgraded)
+    assert client.get("/me").json()["user"] == {"username": "bob"}
+
+
+def test_polled_me_does_not_resign():
+    client = TestClient(main_app)
+    username = f"sess-{secrets.token_hex(4)}"
+    enroll(client, username)
+    r = client.get("/api/me")
+    assert r.json()["user"]["username"] == username
+    assert "set-cookie" not in r.headers
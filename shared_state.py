@@ -0,0 +1,138 @@
+"""State shared by the worker processes on one host (see serve.py).
+
+Each worker keeps its own credential and verifier-key caches. A write that
+makes cached entries stale (re-registration, bulk import) is appended to the
+`cache_invalidations` table and bumps a generation counter in a small
+memory-mapped file. Before reading its caches a worker compares that counter
+with the last one it saw. On the hot path this is one 8-byte read from shared
+memory, and the log is only queried after another process wrote to it.
+
+Challenges and rate limits are shared through their SQLite stores
+(CHALLENGE_STORE=sqlite, RATE_LIMIT_STORE=sqlite); serve.py turns those on.
+"""
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process only.
+    fcntl = None
+
+import db
+from config import CRED_CACHE_TTL_SECONDS, SHARED_STATE, SHARED_STATE_PATH
+
+_U64 = struct.Struct("<Q")
+
+Invalidate = Callable[[Optional[bytes], Optional[int]], None]
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Exclusive advisory lock on `path`, held across processes."""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+class GenerationCounter:
+    """A 64-bit counter in a memory-mapped file, bumped under `flock`."""
+
+    def __init__(self, path: str = SHARED_STATE_PATH) -> None:
+        if fcntl is None:
+            raise RuntimeError("SHARED_STATE needs fcntl (POSIX)")
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked():
+            if os.fstat(self._fd).st_size < _U64.size:
+                os.ftruncate(self._fd, _U64.size)
+        self._map = mmap.mmap(self._fd, _U64.size)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def value(self) -> int:
+        # Unlocked: a torn read only looks like a change and costs one log query.
+        return _U64.unpack_from(self._map)[0]
+
+    def bump(self) -> int:
+        with self._locked():
+            value = _U64.unpack_from(self._map)[0] + 1
+            _U64.pack_into(self._map, 0, value)
+        return value
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+class CacheCoherence:
+    """Publishes local invalidations and replays everyone else's.
+
+    `publish` and `sync` touch SQLite; `stale` does not and is safe to call
+    on the event loop. Log rows older than the cache TTL are pruned: any
+    entry they could have covered has expired by then.
+    """
+
+    def __init__(
+        self,
+        counter: GenerationCounter,
+        on_invalidate: Invalidate,
+        retention_seconds: float = CRED_CACHE_TTL_SECONDS,
+        origin: Optional[int] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.counter = counter
+        self.on_invalidate = on_invalidate
+        self.retention_seconds = retention_seconds
+        self._origin = origin
+        self.clock = clock
+        self._seen = counter.value()
+        # Replaying old rows on a fresh cache is a no-op, so no need to look
+        # up the current position (the table may not exist yet at import).
+        self._last_seq = 0
+
+    @property
+    def origin(self) -> int:
+        # Looked up late so a fork after import gets its own pid.
+        return os.getpid() if self._origin is None else self._origin
+
+    def publish(self, cred_hash: Optional[bytes] = None, user_id: Optional[int] = None) -> None:
+        now = self.clock()
+        db.insert_cache_invalidation(cred_hash, user_id, self.origin, now)
+        self.counter.bump()
+        db.delete_cache_invalidations_before(now - max(self.retention_seconds, 1.0))
+
+    def stale(self) -> bool:
+        return self.counter.value() != self._seen
+
+    def sync(self) -> int:
+        """Apply invalidations published by other processes; returns how many."""
+        # Read the counter first: a bump during the query is caught next time.
+        generation = self.counter.value()
+        applied = 0
+        origin = self.origin
+        for row in db.list_cache_invalidations_after(self._last_seq):
+            self._last_seq = row["seq"]
+            if row["origin"] != origin:
+                cred_hash = bytes(row["cred_hash"]) if row["cred_hash"] is not None else None
+                self.on_invalidate(cred_hash, row["user_id"])
+                applied += 1
+        self._seen = generation
+        return applied
+
+def make_coherence(on_invalidate: Invalidate, enabled: bool = SHARED_STATE) -> Optional[CacheCoherence]:
+    if not enabled:
+        return None
+    return CacheCoherence(GenerationCounter(), on_invalidate)
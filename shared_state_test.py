@@ -0,0 +1,69 @@
+import multiprocessing
+import os
+import tempfile
+
+import pytest
+
+import db
+import serve
+from shared_state import CacheCoherence, GenerationCounter
+
+
+def _bump(path, n):
+    counter = GenerationCounter(path)
+    for _ in range(n):
+        counter.bump()
+    counter.close()
+
+
+@pytest.fixture
+def counter_path():
+    return os.path.join(tempfile.mkdtemp(prefix="passkeys-state-"), "state")
+
+
+def test_generation_counter_is_shared_between_processes(counter_path):
+    counter = GenerationCounter(counter_path)
+    assert counter.value() == 0
+    procs = [multiprocessing.Process(target=_bump, args=(counter_path, 200)) for _ in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert counter.value() == 600
+    assert counter.bump() == 601
+
+
+def test_coherence_replays_other_workers_invalidations(counter_path):
+    db.init_db()
+    seen_a, seen_b = [], []
+    a = CacheCoherence(GenerationCounter(counter_path), lambda h, u: seen_a.append((h, u)), origin=1)
+    b = CacheCoherence(GenerationCounter(counter_path), lambda h, u: seen_b.append((h, u)), origin=2)
+    b.sync()
+    seen_b.clear()
+    assert not a.stale() and not b.stale()
+
+    a.publish(b"h" * 32, 7)
+    a.publish(None, 8)
+    assert b.stale()
+    assert b.sync() == 2
+    assert seen_b == [(b"h" * 32, 7), (None, 8)]
+    assert not b.stale()
+
+    # A worker never replays its own rows.
+    assert a.stale()
+    assert a.sync() == 0 and seen_a == []
+
+
+def test_prepare_environment_shares_state():
+    env = {}
+    serve.prepare_environment(1, env)
+    assert env == {}
+
+    serve.prepare_environment(4, env)
+    assert env["SHARED_STATE"] == "1"
+    assert env["CHALLENGE_STORE"] == "sqlite"
+    assert env["RATE_LIMIT_STORE"] == "sqlite"
+    assert len(env["CRED_ENC_KEY_B64URL"]) == 43
+
+    with pytest.raises(SystemExit):
+        serve.prepare_environment(4, {"CHALLENGE_STORE": "memory"})
@@ -0,0 +1,219 @@
+"""Software WebAuthn authenticator for benchmarks and tests.
+
+Consumes the JSON the options endpoints return and produces the JSON that
+static/webauthn.js would post back: "none" attestations for registration
+and signed assertions for login, with UP and UV set. Keys are ES256, EdDSA
+(Ed25519) or RS256.
+
+`create()` and `get()` also take `corrupt=`, one of ATTESTATION_CORRUPTIONS
+or ASSERTION_CORRUPTIONS, to produce a response that is wrong in exactly
+one way. `ManualClock` stands in for time.time where a store takes a clock.
+"""
+import base64
+import hashlib
+import json
+import secrets
+import struct
+from dataclasses import dataclass, field
+from typing import Optional
+
+import cbor2
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+
+from config import ORIGIN, RP_ID
+
+FLAG_UP = 0x01
+FLAG_UV = 0x04
+FLAG_AT = 0x40
+
+ES256, EDDSA, RS256 = -7, -8, -257
+
+# What each corruption breaks; the server must reject all of them.
+ATTESTATION_CORRUPTIONS = (
+    "challenge",  # signed over a different challenge
+    "origin",
+    "type",  # clientData type webauthn.get
+    "rp_id",  # authData for another RP ID
+    "no_user_presence",
+    "no_user_verification",
+    "truncated_auth_data",
+    "attestation_format",  # "packed" without a statement
+    "public_key",  # COSE key that does not parse
+)
+ASSERTION_CORRUPTIONS = (
+    "challenge",
+    "origin",
+    "type",
+    "rp_id",
+    "no_user_presence",
+    "no_user_verification",
+    "truncated_auth_data",
+    "signature",  # one bit flipped
+    "stale_sign_count",  # repeats the last counter value
+    "client_data_json",  # not JSON
+    "user_handle",  # a handle that is not the owner's
+)
+
+class ManualClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self, now: float = 1_800_000_000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def generate_key(alg: int):
+    if alg == ES256:
+        return ec.generate_private_key(ec.SECP256R1())
+    if alg == EDDSA:
+        return ed25519.Ed25519PrivateKey.generate()
+    if alg == RS256:
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    raise ValueError(f"unsupported COSE algorithm {alg}")
+
+@dataclass
+class SoftCredential:
+    credential_id: bytes
+    private_key: object
+    user_handle: bytes
+    rp_id: str
+    sign_count: int = 0
+    alg: int = ES256
+
+    def cose_public_key(self) -> bytes:
+        public_key = self.private_key.public_key()
+        if self.alg == ES256:
+            nums = public_key.public_numbers()
+            return cbor2.dumps(
+                {1: 2, 3: ES256, -1: 1, -2: nums.x.to_bytes(32, "big"), -3: nums.y.to_bytes(32, "big")}
+            )
+        if self.alg == EDDSA:
+            raw = public_key.public_bytes_raw()
+            return cbor2.dumps({1: 1, 3: EDDSA, -1: 6, -2: raw})
+        nums = public_key.public_numbers()
+        return cbor2.dumps(
+            {1: 3, 3: RS256, -1: nums.n.to_bytes((nums.n.bit_length() + 7) // 8, "big"), -2: nums.e.to_bytes(3, "big")}
+        )
+
+    def sign(self, data: bytes) -> bytes:
+        if self.alg == ES256:
+            return self.private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+        if self.alg == EDDSA:
+            return self.private_key.sign(data)
+        return self.private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+@dataclass
+class SoftAuthenticator:
+    rp_id: str = RP_ID
+    origin: str = ORIGIN
+    # Authenticators that keep no counter always report 0.
+    counter: bool = True
+    # COSE algorithm for new credentials: ES256, EDDSA or RS256.
+    alg: int = ES256
+    credentials: dict[bytes, SoftCredential] = field(default_factory=dict)
+
+    def _client_data(self, kind: str, challenge_b64: str, corrupt: Optional[str] = None) -> bytes:
+        if corrupt == "client_data_json":
+            return b"<not json, but long enough>"
+        if corrupt == "type":
+            kind = "webauthn.get" if kind == "webauthn.create" else "webauthn.create"
+        if corrupt == "challenge":
+            challenge_b64 = b64url(secrets.token_bytes(64))
+        origin = "https://evil.example" if corrupt == "origin" else self.origin
+        return json.dumps(
+            {"type": kind, "challenge": challenge_b64, "origin": origin, "crossOrigin": False},
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+    def _auth_data(self, flags: int, sign_count: int, attested: bytes = b"", corrupt: Optional[str] = None) -> bytes:
+        rp_id = "evil.example" if corrupt == "rp_id" else self.rp_id
+        if corrupt == "no_user_presence":
+            flags &= ~FLAG_UP
+        if corrupt == "no_user_verification":
+            flags &= ~FLAG_UV
+        rp_id_hash = hashlib.sha256(rp_id.encode("utf-8")).digest()
+        auth_data = rp_id_hash + bytes([flags]) + struct.pack(">I", sign_count) + attested
+        return auth_data[:36] if corrupt == "truncated_auth_data" else auth_data
+
+    def create(self, options: dict, corrupt: Optional[str] = None) -> dict:
+        """navigator.credentials.create() for the server's registration options."""
+        if corrupt is not None and corrupt not in ATTESTATION_CORRUPTIONS:
+            raise ValueError(f"unknown attestation corruption {corrupt!r}")
+        cred = SoftCredential(
+            credential_id=secrets.token_bytes(16),
+            private_key=generate_key(self.alg),
+            user_handle=b64url_decode(options["user"]["id"]),
+            rp_id=options.get("rp", {}).get("id", self.rp_id),
+            alg=self.alg,
+        )
+        public_key = b"\xa1\x01\x02" if corrupt == "public_key" else cred.cose_public_key()
+        attested = (
+            b"\x00" * 16  # AAGUID
+            + struct.pack(">H", len(cred.credential_id))
+            + cred.credential_id
+            + public_key
+        )
+        auth_data = self._auth_data(FLAG_UP | FLAG_UV | FLAG_AT, 0, attested, corrupt)
+        fmt = "packed" if corrupt == "attestation_format" else "none"
+        attestation_object = cbor2.dumps({"fmt": fmt, "attStmt": {}, "authData": auth_data})
+        if corrupt is None:
+            self.credentials[cred.credential_id] = cred
+
+        cid = b64url(cred.credential_id)
+        return {
+            "id": cid,
+            "rawId": cid,
+            "type": "public-key",
+            "response": {
+                "clientDataJSON": b64url(self._client_data("webauthn.create", options["challenge"], corrupt)),
+                "attestationObject": b64url(attestation_object),
+                "transports": ["internal"],
+            },
+            "clientExtensionResults": {},
+        }
+
+    def get(self, options: dict, credential_id: Optional[bytes] = None, corrupt: Optional[str] = None) -> dict:
+        """navigator.credentials.get(): signs with the first allowed credential we hold."""
+        if corrupt is not None and corrupt not in ASSERTION_CORRUPTIONS:
+            raise ValueError(f"unknown assertion corruption {corrupt!r}")
+        if credential_id is None:
+            allowed = [b64url_decode(c["id"]) for c in options.get("allowCredentials") or []]
+            candidates = [c for c in allowed if c in self.credentials] if allowed else list(self.credentials)
+            if not candidates:
+                raise LookupError("no matching credential")
+            credential_id = candidates[0]
+        cred = self.credentials[credential_id]
+
+        if self.counter and corrupt != "stale_sign_count":
+            cred.sign_count += 1
+        client_data = self._client_data("webauthn.get", options["challenge"], corrupt)
+        auth_data = self._auth_data(FLAG_UP | FLAG_UV, cred.sign_count, corrupt=corrupt)
+        signature = cred.sign(auth_data + hashlib.sha256(client_data).digest())
+        if corrupt == "signature":
+            signature = signature[:-1] + bytes([signature[-1] ^ 1])
+        user_handle = secrets.token_bytes(16) if corrupt == "user_handle" else cred.user_handle
+
+        cid = b64url(cred.credential_id)
+        return {
+            "id": cid,
+            "rawId": cid,
+            "type": "public-key",
+            "response": {
+                "clientDataJSON": b64url(client_data),
+                "authenticatorData": b64url(auth_data),
+                "signature": b64url(signature),
+                "userHandle": b64url(user_handle),
+            },
+            "clientExtensionResults": {},
+        }
@@ -0,0 +1,77 @@
+import secrets
+
+import pytest
+from fastapi.testclient import TestClient
+
+import db
+from harness import login, register
+from main import app
+from metrics import AUTH_FAILURES
+from soft_authenticator import (
+    ASSERTION_CORRUPTIONS,
+    ATTESTATION_CORRUPTIONS,
+    EDDSA,
+    ES256,
+    RS256,
+    SoftAuthenticator,
+)
+
+# Where each corruption is caught: admission checks first, then verification.
+ASSERTION_REASONS = {
+    "challenge": "verification_failed",
+    "origin": "verification_failed",
+    "type": "verification_failed",
+    "rp_id": "wrong_rp_or_no_presence",
+    "no_user_presence": "wrong_rp_or_no_presence",
+    "no_user_verification": "verification_failed",
+    "truncated_auth_data": "bad_authenticator_data",
+    "signature": "verification_failed",
+    "stale_sign_count": "sign_count_regression",
+    "client_data_json": "verification_failed",
+    "user_handle": "user_mismatch",
+}
+
+
+@pytest.mark.parametrize("alg", [ES256, EDDSA, RS256])
+def test_register_and_login_with_each_algorithm(alg):
+    client = TestClient(app)
+    username = f"alg-{secrets.token_hex(4)}"
+    authenticator = SoftAuthenticator(alg=alg)
+    assert register(client, authenticator, username).status_code == 200
+    for _ in range(2):
+        assert login(client, authenticator, username).status_code == 200
+    assert login(client, authenticator).status_code == 200  # usernameless
+
+
+@pytest.mark.parametrize("corrupt", ATTESTATION_CORRUPTIONS)
+def test_corrupted_attestation_is_rejected(corrupt):
+    client = TestClient(app)
+    username = f"att-{secrets.token_hex(4)}"
+    r = register(client, SoftAuthenticator(), username, corrupt=corrupt)
+    assert r.status_code == 400
+    user = db.get_user(username)
+    assert user is None or db.list_user_credentials(user["id"]) == []
+
+
+@pytest.mark.parametrize("corrupt", ASSERTION_CORRUPTIONS)
+def test_corrupted_assertion_is_rejected(corrupt):
+    client = TestClient(app)
+    username = f"asr-{secrets.token_hex(4)}"
+    authenticator = SoftAuthenticator()
+    assert register(client, authenticator, username).status_code == 200
+    assert login(client, authenticator, username).status_code == 200
+
+    reason = ASSERTION_REASONS[corrupt]
+    before = AUTH_FAILURES.value("login_verify", reason)
+    # The owner's handle is only checked on usernameless logins.
+    r = login(client, authenticator, "" if corrupt == "user_handle" else username, corrupt=corrupt)
+    assert r.status_code == 400
+    assert AUTH_FAILURES.value("login_verify", reason) == before + 1
+
+    # Nothing was advanced by the failed attempt.
+    assert login(client, authenticator, username).status_code == 200
+
+
+def test_unknown_corruption_is_an_error():
+    with pytest.raises(ValueError):
+        SoftAuthenticator().get({"challenge": "AA"}, corrupt="nope")
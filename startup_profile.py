@@ -0,0 +1,83 @@
+"""Cold start profile for the app.
+
+Imports main and runs its lifespan startup in fresh interpreters, against a
+throwaway DB, and reports median times per phase plus the packages that
+cost the most to import (from one extra `-X importtime` run).
+
+    python startup_profile.py --runs 5 --top 12
+    python startup_profile.py --max-ms 900      # exit 1 if slower (CI gate)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+_CHILD = """
+import asyncio, json, time
+t0 = time.perf_counter()
+import main
+async def start():
+    async with main.app.router.lifespan_context(main.app):
+        pass
+asyncio.run(start())
+out = dict(main.STARTUP_SECONDS, total=time.perf_counter() - t0)
+print(json.dumps(out))
+"""
+
+def _child_env() -> dict:
+    env = dict(os.environ)
+    env["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="passkeys-startup-"), "startup.sqlite3")
+    return env
+
+def measure(runs: int) -> dict[str, float]:
+    """Median seconds per phase over `runs` fresh processes."""
+    samples = defaultdict(list)
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-c", _CHILD], env=_child_env(), capture_output=True, text=True, check=True
+        )
+        for phase, seconds in json.loads(proc.stdout.strip().splitlines()[-1]).items():
+            samples[phase].append(seconds)
+    return {phase: statistics.median(values) for phase, values in samples.items()}
+
+def import_costs(top: int) -> list[tuple[str, int]]:
+    """Self import time in microseconds, summed per top-level package."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        env=_child_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    totals = defaultdict(int)
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        totals[name.strip().split(".")[0]] += int(self_us)
+    return sorted(totals.items(), key=lambda kv: -kv[1])[:top]
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12)
+    parser.add_argument("--max-ms", type=float, help="fail if the median total exceeds this")
+    args = parser.parse_args(argv)
+
+    phases = measure(args.runs)
+    for phase in ("import", "lifespan", "total"):
+        print(f"{phase:<10}{phases.get(phase, 0.0) * 1000:>9.1f} ms")
+    print(f"\n{'package':<28}{'self import (ms)':>18}")
+    for name, us in import_costs(args.top):
+        print(f"{name:<28}{us / 1000:>18.1f}")
+
+    if args.max_ms is not None and phases["total"] * 1000 > args.max_ms:
+        print(f"total {phases['total'] * 1000:.1f} ms exceeds --max-ms {args.max_ms}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
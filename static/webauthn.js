@@ -145,6 +145,20 @@ async function loginPasskey() {
   log('Logged in:', result);
 }
 
+async function loginUsernameless() {
+  log('1) Requesting login options (no username)...');
+  const opts = await postJSON('/api/login/options', {});
+
+  log('2) navigator.credentials.get() with an empty allow-list...');
+  const publicKey = preformatGetOptions(opts);
+  const assertion = await navigator.credentials.get({ publicKey });
+
+  log('3) Sending assertion to server...');
+  const result = await postJSON('/api/login/verify', { credential: serializeAssertion(assertion) });
+
+  log('Logged in:', result);
+}
+
 async function whoAmI() {
   const res = await fetch('/api/me', { credentials: 'include' });
   const data = await res.json();
@@ -158,5 +172,6 @@ async function logout() {
 
 document.getElementById('btnRegister').onclick = () => registerPasskey().catch(e => log('ERROR:', e.message));
 document.getElementById('btnLogin').onclick = () => loginPasskey().catch(e => log('ERROR:', e.message));
+document.getElementById('btnLoginAny').onclick = () => loginUsernameless().catch(e => log('ERROR:', e.message));
 document.getElementById('btnMe').onclick = () => whoAmI().catch(e => log('ERROR:', e.message));
 document.getElementById('btnLogout').onclick = () => logout().catch(e => log('ERROR:', e.message));
\ No newline at end of file
@@ -0,0 +1,404 @@
+"""User and credential storage behind one async interface.
+
+`SqliteStorage` runs the existing `db` functions on the DB executor.
+`PostgresStorage` talks to PostgreSQL through an asyncpg pool, so several
+app nodes can share one database. Rows from either backend support
+`row["column"]`, which is all `crypto_store` needs.
+
+Challenges, key rotation and bulk import/export still use SQLite directly.
+"""
+import asyncio
+import time
+from typing import Any, Mapping, Optional, Protocol, Sequence, Tuple
+
+import db
+from config import (
+    POSTGRES_DSN,
+    POSTGRES_POOL_MAX_SIZE,
+    POSTGRES_POOL_MIN_SIZE,
+    STORAGE_BACKEND,
+)
+from executors import run_db
+
+Row = Mapping[str, Any]
+# (cred_hash, sign_count, device_type, backed_up, used_at)
+SignCountUpdate = Tuple[bytes, int, Optional[str], bool, Optional[float]]
+
+class Storage(Protocol):
+    async def open(self) -> None: ...
+
+    async def close(self) -> None: ...
+
+    async def get_user(self, username: str) -> Optional[Row]: ...
+
+    async def get_user_by_handle(self, user_handle: bytes) -> Optional[Row]: ...
+
+    async def get_username_by_user_id(self, user_id: int) -> Optional[str]: ...
+
+    async def get_or_create_user(self, username: str, user_handle: bytes) -> Row: ...
+
+    async def list_user_credentials(self, user_id: int) -> Sequence[Row]: ...
+
+    async def find_login_rows(self, username: str) -> Sequence[Row]: ...
+
+    async def find_credential_by_hash(self, cred_hash: bytes) -> Optional[Row]: ...
+
+    async def credential_id_enc_lengths(self) -> Sequence[Row]:
+        """`(n, head, total)` rows: credential_id_enc blob lengths and first bytes."""
+        ...
+
+    async def insert_or_replace_credential(
+        self,
+        user_id: int,
+        credential_id_hash: bytes,
+        credential_id_enc: bytes,
+        public_key_enc: bytes,
+        sign_count: int,
+        transports_mask: int,
+        device_type: Optional[str],
+        backed_up: bool,
+        created_at: Optional[float] = None,
+    ) -> bool:
+        """False when the credential ID is already registered to another user."""
+        ...
+
+    async def update_credential_sign_count(
+        self,
+        cred_hash: bytes,
+        new_sign_count: int,
+        device_type: Optional[str],
+        backed_up: bool,
+        used_at: Optional[float] = None,
+    ) -> bool:
+        """Compare-and-swap; False when the stored count is already >= new."""
+        ...
+
+    async def update_credential_sign_counts(self, items: list[SignCountUpdate]) -> int: ...
+
+    def write_sign_counts_blocking(self, items: list[SignCountUpdate]) -> int:
+        """For worker threads (the sign-count writer); never call on the event loop."""
+        ...
+
+    async def list_credentials_page(self, user_id: int, after_id: int, limit: int) -> Sequence[Row]:
+        """Metadata only (no blobs), ordered by id, for ids above `after_id`."""
+        ...
+
+    async def rename_credential(self, user_id: int, cred_id: int, nickname: Optional[str]) -> bool: ...
+
+    async def delete_credential(self, user_id: int, cred_id: int) -> Optional[bytes]:
+        """Returns the deleted row's credential_id_hash, or None if not the user's."""
+        ...
+
+class SqliteStorage:
+    async def open(self) -> None:
+        # Nothing to do: main.init_local_db has migrated under INIT_LOCK_PATH.
+        pass
+
+    async def close(self) -> None:
+        # The db pool is shared with the SQLite challenge store; main closes it.
+        pass
+
+    async def get_user(self, username: str) -> Optional[Row]:
+        return await run_db(db.get_user, username)
+
+    async def get_user_by_handle(self, user_handle: bytes) -> Optional[Row]:
+        return await run_db(db.get_user_by_handle, user_handle)
+
+    async def get_username_by_user_id(self, user_id: int) -> Optional[str]:
+        return await run_db(db.get_username_by_user_id, user_id)
+
+    async def get_or_create_user(self, username: str, user_handle: bytes) -> Row:
+        return await run_db(db.get_or_create_user, username, user_handle)
+
+    async def list_user_credentials(self, user_id: int) -> Sequence[Row]:
+        return await run_db(db.list_user_credentials, user_id)
+
+    async def find_login_rows(self, username: str) -> Sequence[Row]:
+        return await run_db(db.find_login_rows, username)
+
+    async def find_credential_by_hash(self, cred_hash: bytes) -> Optional[Row]:
+        return await run_db(db.find_credential_by_hash, cred_hash)
+
+    async def credential_id_enc_lengths(self) -> Sequence[Row]:
+        return await run_db(db.credential_id_enc_lengths)
+
+    async def insert_or_replace_credential(self, *args, **kwargs) -> bool:
+        return await run_db(db.insert_or_replace_credential, *args, **kwargs)
+
+    async def update_credential_sign_count(
+        self,
+        cred_hash: bytes,
+        new_sign_count: int,
+        device_type: Optional[str],
+        backed_up: bool,
+        used_at: Optional[float] = None,
+    ) -> bool:
+        return await run_db(
+            db.update_credential_sign_count, cred_hash, new_sign_count, device_type, backed_up, used_at
+        )
+
+    async def update_credential_sign_counts(self, items: list[SignCountUpdate]) -> int:
+        return await run_db(db.update_credential_sign_counts, items)
+
+    def write_sign_counts_blocking(self, items: list[SignCountUpdate]) -> int:
+        return db.update_credential_sign_counts(items)
+
+    async def list_credentials_page(self, user_id: int, after_id: int, limit: int) -> Sequence[Row]:
+        return await run_db(db.list_credentials_page, user_id, after_id, limit)
+
+    async def rename_credential(self, user_id: int, cred_id: int, nickname: Optional[str]) -> bool:
+        return await run_db(db.rename_credential, user_id, cred_id, nickname)
+
+    async def delete_credential(self, user_id: int, cred_id: int) -> Optional[bytes]:
+        return await run_db(db.delete_credential, user_id, cred_id)
+
+POSTGRES_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id          BIGSERIAL PRIMARY KEY,
+        username    TEXT UNIQUE NOT NULL,
+        user_handle BYTEA UNIQUE NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS credentials (
+        id                 BIGSERIAL PRIMARY KEY,
+        user_id            BIGINT NOT NULL REFERENCES users(id),
+        credential_id_hash BYTEA UNIQUE NOT NULL,
+        credential_id_enc  BYTEA NOT NULL,
+        public_key_enc     BYTEA NOT NULL,
+        sign_count         BIGINT NOT NULL DEFAULT 0,
+        transports_mask    INTEGER NOT NULL DEFAULT 0,
+        device_type        TEXT,
+        backed_up          BOOLEAN NOT NULL DEFAULT FALSE
+    )
+    """,
+    # Added after the first release; no-ops on new databases.
+    "ALTER TABLE credentials ADD COLUMN IF NOT EXISTS created_at DOUBLE PRECISION",
+    "ALTER TABLE credentials ADD COLUMN IF NOT EXISTS last_used_at DOUBLE PRECISION",
+    "ALTER TABLE credentials ADD COLUMN IF NOT EXISTS nickname TEXT",
+    "CREATE INDEX IF NOT EXISTS credentials_user_id ON credentials(user_id)",
+    # Keyset pages of a user's credentials (ORDER BY id) without a sort.
+    "CREATE INDEX IF NOT EXISTS credentials_user_id_id ON credentials(user_id, id)",
+)
+
+# Same compare-and-swap as db.update_credential_sign_count.
+_SIGN_COUNT_SQL = """
+    UPDATE credentials
+    SET sign_count = $2, device_type = $3, backed_up = $4, last_used_at = COALESCE($5, last_used_at)
+    WHERE credential_id_hash = $1 AND (sign_count < $2 OR ($2 = 0 AND sign_count = 0))
+"""
+
+def _updated(status: str) -> int:
+    # asyncpg returns the command tag, e.g. "UPDATE 1".
+    return int(status.rsplit(" ", 1)[-1])
+
+class PostgresStorage:
+    """asyncpg-backed storage. The pool is created on first use (or `open()`)
+    and bound to that event loop."""
+
+    def __init__(
+        self,
+        dsn: str = POSTGRES_DSN,
+        min_size: int = POSTGRES_POOL_MIN_SIZE,
+        max_size: int = POSTGRES_POOL_MAX_SIZE,
+    ) -> None:
+        if not dsn:
+            raise RuntimeError("STORAGE_BACKEND=postgres needs POSTGRES_DSN")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _get_pool(self):
+        if self._pool is not None:
+            return self._pool
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._pool is None:
+                # Optional dependency: only needed with STORAGE_BACKEND=postgres.
+                import asyncpg
+
+                pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        # Serialize schema creation across nodes starting together.
+                        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('passkeys_schema'))")
+                        for stmt in POSTGRES_SCHEMA:
+                            await conn.execute(stmt)
+                self._loop = asyncio.get_running_loop()
+                self._pool = pool
+        return self._pool
+
+    async def open(self) -> None:
+        await self._get_pool()
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _fetchrow(self, sql: str, *args) -> Optional[Row]:
+        pool = await self._get_pool()
+        return await pool.fetchrow(sql, *args)
+
+    async def _fetch(self, sql: str, *args) -> Sequence[Row]:
+        pool = await self._get_pool()
+        return await pool.fetch(sql, *args)
+
+    async def get_user(self, username: str) -> Optional[Row]:
+        return await self._fetchrow("SELECT * FROM users WHERE username = $1", username)
+
+    async def get_user_by_handle(self, user_handle: bytes) -> Optional[Row]:
+        return await self._fetchrow("SELECT * FROM users WHERE user_handle = $1", user_handle)
+
+    async def get_username_by_user_id(self, user_id: int) -> Optional[str]:
+        row = await self._fetchrow("SELECT username FROM users WHERE id = $1", user_id)
+        return row["username"] if row else None
+
+    async def get_or_create_user(self, username: str, user_handle: bytes) -> Row:
+        # Read first: existing users (the common case) take no row lock.
+        row = await self.get_user(username)
+        if row is None:
+            row = await self._fetchrow(
+                "INSERT INTO users(username, user_handle) VALUES ($1, $2) ON CONFLICT (username) DO NOTHING RETURNING *",
+                username,
+                user_handle,
+            )
+        # None here means a concurrent creator won the insert.
+        return row if row is not None else await self.get_user(username)
+
+    async def list_user_credentials(self, user_id: int) -> Sequence[Row]:
+        return await self._fetch("SELECT * FROM credentials WHERE user_id = $1", user_id)
+
+    async def find_login_rows(self, username: str) -> Sequence[Row]:
+        return await self._fetch(
+            """
+            SELECT u.id AS uid, c.*
+            FROM (SELECT $1::text AS username) AS q
+            LEFT JOIN users u ON u.username = q.username
+            LEFT JOIN credentials c ON c.user_id = u.id
+            """,
+            username,
+        )
+
+    async def find_credential_by_hash(self, cred_hash: bytes) -> Optional[Row]:
+        return await self._fetchrow("SELECT * FROM credentials WHERE credential_id_hash = $1", cred_hash)
+
+    async def credential_id_enc_lengths(self) -> Sequence[Row]:
+        return await self._fetch(
+            """
+            SELECT length(credential_id_enc) AS n, substr(credential_id_enc, 1, 1) AS head, COUNT(*) AS total
+            FROM credentials
+            GROUP BY 1, 2
+            """
+        )
+
+    async def insert_or_replace_credential(
+        self,
+        user_id: int,
+        credential_id_hash: bytes,
+        credential_id_enc: bytes,
+        public_key_enc: bytes,
+        sign_count: int,
+        transports_mask: int,
+        device_type: Optional[str],
+        backed_up: bool,
+        created_at: Optional[float] = None,
+    ) -> bool:
+        row = await self._fetchrow(
+            """
+            INSERT INTO credentials(
+                user_id, credential_id_hash, credential_id_enc, public_key_enc,
+                sign_count, transports_mask, device_type, backed_up, created_at
+            )
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            ON CONFLICT (credential_id_hash) DO UPDATE SET
+                credential_id_enc = EXCLUDED.credential_id_enc,
+                public_key_enc = EXCLUDED.public_key_enc,
+                sign_count = EXCLUDED.sign_count,
+                transports_mask = EXCLUDED.transports_mask,
+                device_type = EXCLUDED.device_type,
+                backed_up = EXCLUDED.backed_up
+            WHERE credentials.user_id = EXCLUDED.user_id
+            RETURNING id
+            """,
+            user_id,
+            credential_id_hash,
+            credential_id_enc,
+            public_key_enc,
+            sign_count,
+            transports_mask,
+            device_type,
+            bool(backed_up),
+            time.time() if created_at is None else created_at,
+        )
+        return row is not None
+
+    async def update_credential_sign_count(
+        self,
+        cred_hash: bytes,
+        new_sign_count: int,
+        device_type: Optional[str],
+        backed_up: bool,
+        used_at: Optional[float] = None,
+    ) -> bool:
+        pool = await self._get_pool()
+        status = await pool.execute(
+            _SIGN_COUNT_SQL, cred_hash, new_sign_count, device_type, bool(backed_up), used_at
+        )
+        return _updated(status) == 1
+
+    async def update_credential_sign_counts(self, items: list[SignCountUpdate]) -> int:
+        # executemany discards command tags; per-row execute keeps the CAS result.
+        pool = await self._get_pool()
+        updated = 0
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                for h, n, dt, bu, used in items:
+                    updated += _updated(await conn.execute(_SIGN_COUNT_SQL, h, n, dt, bool(bu), used))
+        return updated
+
+    def write_sign_counts_blocking(self, items: list[SignCountUpdate]) -> int:
+        if self._loop is None:
+            raise RuntimeError("postgres storage has not been opened")
+        return asyncio.run_coroutine_threadsafe(self.update_credential_sign_counts(items), self._loop).result()
+
+    async def list_credentials_page(self, user_id: int, after_id: int, limit: int) -> Sequence[Row]:
+        return await self._fetch(
+            """
+            SELECT id, nickname, created_at, last_used_at, sign_count, transports_mask, device_type, backed_up
+            FROM credentials
+            WHERE user_id = $1 AND id > $2
+            ORDER BY id
+            LIMIT $3
+            """,
+            user_id,
+            after_id,
+            limit,
+        )
+
+    async def rename_credential(self, user_id: int, cred_id: int, nickname: Optional[str]) -> bool:
+        pool = await self._get_pool()
+        status = await pool.execute(
+            "UPDATE credentials SET nickname = $3 WHERE id = $1 AND user_id = $2", cred_id, user_id, nickname
+        )
+        return _updated(status) == 1
+
+    async def delete_credential(self, user_id: int, cred_id: int) -> Optional[bytes]:
+        row = await self._fetchrow(
+            "DELETE FROM credentials WHERE id = $1 AND user_id = $2 RETURNING credential_id_hash", cred_id, user_id
+        )
+        return bytes(row["credential_id_hash"]) if row is not None else None
+
+def make_storage(kind: str = STORAGE_BACKEND) -> Storage:
+    if kind == "sqlite":
+        return SqliteStorage()
+    if kind == "postgres":
+        return PostgresStorage()
+    raise RuntimeError(f"unknown STORAGE_BACKEND {kind!r} (expected 'sqlite' or 'postgres')")
+
+backend = make_storage()
@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+import os
+import re
+import secrets
+import sqlite3
+import sys
+import types
+
+import pytest
+
+import crypto_store
+import db
+import storage
+
+POSTGRES_DSN = os.getenv("TEST_POSTGRES_DSN", "")
+
+
+class FakePgPool:
+    """Just enough of an asyncpg pool to run PostgresStorage's SQL on SQLite.
+
+    Placeholders, casts and the schema DDL are translated; everything else
+    (ON CONFLICT ... WHERE, RETURNING, the CAS predicate) runs as written, so
+    the query text and row mapping are exercised without a server.
+    """
+
+    def __init__(self) -> None:
+        self.conn = sqlite3.connect(":memory:", isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.statements = []
+
+    def _run(self, sql: str, args) -> sqlite3.Cursor:
+        self.statements.append(sql)
+        if "pg_advisory_xact_lock" in sql:
+            return self.conn.execute("SELECT 1")
+        sql = re.sub(r"\$(\d+)(::\w+)?", r"?\1", sql)
+        sql = sql.replace("BIGSERIAL PRIMARY KEY", "INTEGER PRIMARY KEY").replace("ADD COLUMN IF NOT EXISTS", "ADD COLUMN")
+        return self.conn.execute(sql, args)
+
+    async def fetchrow(self, sql, *args):
+        return self._run(sql, args).fetchone()
+
+    async def fetch(self, sql, *args):
+        return self._run(sql, args).fetchall()
+
+    async def execute(self, sql, *args):
+        cur = self._run(sql, args)
+        verb = sql.split()[0].upper()
+        return f"{verb} {cur.rowcount}" if verb in ("UPDATE", "DELETE", "INSERT") else verb
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        self.conn.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    async def close(self) -> None:
+        self.conn.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres", "fake-postgres"])
+def make_backend(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        pool = db.ConnectionPool(path=str(tmp_path / "storage.sqlite3"))
+        monkeypatch.setattr(db, "_pool", pool)
+        db.init_db()  # main's lifespan does this before storage.open()
+        yield storage.SqliteStorage
+        pool.close()
+    elif request.param == "fake-postgres":
+        async def create_pool(dsn, min_size, max_size):
+            return FakePgPool()
+
+        monkeypatch.setitem(sys.modules, "asyncpg", types.SimpleNamespace(create_pool=create_pool))
+        yield lambda: storage.PostgresStorage(dsn="postgresql://fake", min_size=1, max_size=1)
+    else:
+        if not POSTGRES_DSN:
+            pytest.skip("set TEST_POSTGRES_DSN to run against PostgreSQL")
+        pytest.importorskip("asyncpg")
+        yield lambda: storage.PostgresStorage(dsn=POSTGRES_DSN, min_size=1, max_size=4)
+
+
+def run(make_backend, scenario):
+    async def body():
+        backend = make_backend()
+        await backend.open()
+        try:
+            await scenario(backend)
+        finally:
+            await backend.close()
+
+    asyncio.run(body())
+
+
+def test_users(make_backend):
+    async def scenario(s):
+        name, handle = f"st-{secrets.token_hex(4)}", secrets.token_bytes(16)
+        assert await s.get_user(name) is None
+        user = await s.get_or_create_user(name, handle)
+        again = await s.get_or_create_user(name, secrets.token_bytes(16))
+        assert again["id"] == user["id"] and bytes(again["user_handle"]) == handle
+        assert (await s.get_user(name))["id"] == user["id"]
+        assert (await s.get_user_by_handle(handle))["username"] == name
+        assert await s.get_username_by_user_id(user["id"]) == name
+
+    run(make_backend, scenario)
+
+
+def test_credentials_round_trip_through_crypto_store(make_backend):
+    async def scenario(s):
+        name = f"st-{secrets.token_hex(4)}"
+        user = await s.get_or_create_user(name, secrets.token_bytes(16))
+        cid = secrets.token_bytes(16)
+        row = crypto_store.seal_credential(user["id"], cid, b"pk", 0, ["internal"], None, False)
+        await s.insert_or_replace_credential(**row)
+        h = row["credential_id_hash"]
+
+        lengths = {(r["n"], bytes(r["head"])) for r in await s.credential_id_enc_lengths()}
+        assert (len(row["credential_id_enc"]), bytes([crypto_store.BLOB_VERSION])) in lengths
+
+        found = await s.find_credential_by_hash(h)
+        assert crypto_store.credential_from_row(found).credential_id == cid
+        rows = await s.list_user_credentials(user["id"])
+        assert crypto_store.user_credential_ids_from_rows(user["id"], rows) == [cid]
+        assert crypto_store.login_credential_ids_from_rows(await s.find_login_rows(name)) == [cid]
+        assert crypto_store.login_credential_ids_from_rows(await s.find_login_rows(name + "-x")) == []
+
+        await s.update_credential_sign_count(h, 3, "multi_device", True)
+        assert (await s.find_credential_by_hash(h))["sign_count"] == 3
+        await s.update_credential_sign_counts([(h, 7, None, False, 1234.5)])
+        assert (await s.find_credential_by_hash(h))["sign_count"] == 7
+
+        [listed] = await s.list_credentials_page(user["id"], 0, 10)
+        assert listed["last_used_at"] == 1234.5 and listed["created_at"] is not None
+        assert await s.list_credentials_page(user["id"], listed["id"], 10) == []
+        assert await s.rename_credential(user["id"], listed["id"], "laptop")
+        assert not await s.rename_credential(user["id"] + 1, listed["id"], "stolen")
+        assert (await s.list_credentials_page(user["id"], 0, 10))[0]["nickname"] == "laptop"
+        assert await s.delete_credential(user["id"] + 1, listed["id"]) is None
+        assert await s.delete_credential(user["id"], listed["id"]) == h
+        assert await s.find_credential_by_hash(h) is None
+
+    run(make_backend, scenario)
+
+
+def test_sign_count_cas_and_credential_ownership(make_backend):
+    async def scenario(s):
+        user = await s.get_or_create_user(f"st-{secrets.token_hex(4)}", secrets.token_bytes(16))
+        row = crypto_store.seal_credential(user["id"], secrets.token_bytes(16), b"pk", 5, None, None, False)
+        assert await s.insert_or_replace_credential(**row)
+        h = row["credential_id_hash"]
+        assert not await s.update_credential_sign_count(h, 5, None, False)
+        assert await s.update_credential_sign_counts([(h, 4, None, False, None), (h, 6, None, False, None)]) == 1
+        # Another user cannot take over a registered credential ID.
+        other = await s.get_or_create_user(f"st-{secrets.token_hex(4)}", secrets.token_bytes(16))
+        assert not await s.insert_or_replace_credential(**{**row, "user_id": other["id"]})
+        assert (await s.find_credential_by_hash(h))["user_id"] == user["id"]
+
+    run(make_backend, scenario)
+
+
+def test_sqlite_open_leaves_migrations_to_startup(monkeypatch):
+    def no_migrate():
+        raise AssertionError("migrated outside INIT_LOCK_PATH")
+
+    monkeypatch.setattr(db, "init_db", no_migrate)
+    asyncio.run(storage.SqliteStorage().open())
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(RuntimeError):
+        storage.make_storage("mysql")
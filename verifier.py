@@ -0,0 +1,216 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, List, Optional, Union
+
+from cryptography.exceptions import InvalidSignature
+
+import metrics
+from config import VERIFIER_KEY_CACHE_SIZE
+
+# py_webauthn is imported on first use (or by `preload`): importing any part
+# of it loads the whole package, which is a large share of cold start.
+if TYPE_CHECKING:
+    from webauthn.authentication.verify_authentication_response import VerifiedAuthentication
+    from webauthn.helpers.cose import COSEAlgorithmIdentifier
+    from webauthn.helpers.structs import AuthenticationCredential
+
+def preload() -> None:
+    """Import py_webauthn now, e.g. from a background thread after startup."""
+    import webauthn
+
+class VerificationEngine:
+    """Drop-in for `webauthn.verify_authentication_response` that keeps
+    loaded `cryptography` public keys (EC2/RSA/OKP) in a bounded LRU keyed by
+    credential hash, so repeat logins skip COSE decoding and key construction.
+
+    The checks mirror py_webauthn 2.x one for one. Cumulative time spent
+    parsing the assertion, loading keys and verifying signatures is kept in
+    `stats()` (nanoseconds).
+    """
+
+    def __init__(self, max_keys: int = VERIFIER_KEY_CACHE_SIZE) -> None:
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._keys: "OrderedDict[bytes, tuple[bytes, Any, COSEAlgorithmIdentifier]]" = OrderedDict()
+        self._stats = {
+            "verifications": 0,
+            "key_hits": 0,
+            "key_misses": 0,
+            "parse_ns": 0,
+            "key_load_ns": 0,
+            "signature_ns": 0,
+        }
+
+    def _bump(self, **deltas: int) -> None:
+        with self._lock:
+            for k, v in deltas.items():
+                self._stats[k] += v
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            out = dict(self._stats)
+            out["cached_keys"] = len(self._keys)
+        return out
+
+    def invalidate(self, cred_hash: bytes) -> None:
+        with self._lock:
+            self._keys.pop(cred_hash, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys.clear()
+
+    def load_key(self, cred_hash: bytes, credential_public_key: bytes):
+        """Return `(key, alg)` for the COSE-encoded public key, cached by hash.
+
+        The raw COSE bytes are kept alongside the key, so a credential that is
+        re-registered under the same hash with a new key is never served stale.
+        """
+        with self._lock:
+            hit = self._keys.get(cred_hash)
+            if hit is not None and hit[0] == credential_public_key:
+                self._keys.move_to_end(cred_hash)
+                self._stats["key_hits"] += 1
+                return hit[1], hit[2]
+
+        from webauthn.helpers import decode_credential_public_key, decoded_public_key_to_cryptography
+
+        t0 = time.perf_counter_ns()
+        decoded = decode_credential_public_key(credential_public_key)
+        key = decoded_public_key_to_cryptography(decoded)
+        elapsed = time.perf_counter_ns() - t0
+
+        metrics.observe_stage_ns("key_load", elapsed)
+        with self._lock:
+            self._stats["key_misses"] += 1
+            self._stats["key_load_ns"] += elapsed
+            if self.max_keys > 0:
+                self._keys[cred_hash] = (bytes(credential_public_key), key, decoded.alg)
+                self._keys.move_to_end(cred_hash)
+                while len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+        return key, decoded.alg
+
+    def verify_authentication_response(
+        self,
+        *,
+        credential: Union[str, dict, "AuthenticationCredential"],
+        expected_challenge: bytes,
+        expected_rp_id: str,
+        expected_origin: Union[str, List[str]],
+        credential_public_key: bytes,
+        credential_current_sign_count: int,
+        cred_hash: Optional[bytes] = None,
+        require_user_verification: bool = False,
+    ) -> "VerifiedAuthentication":
+        from webauthn.authentication.verify_authentication_response import VerifiedAuthentication
+        from webauthn.helpers import (
+            bytes_to_base64url,
+            byteslike_to_bytes,
+            parse_authentication_credential_json,
+            parse_authenticator_data,
+            parse_backup_flags,
+            parse_client_data_json,
+            verify_signature,
+        )
+        from webauthn.helpers.exceptions import InvalidAuthenticationResponse
+        from webauthn.helpers.structs import ClientDataType, PublicKeyCredentialType, TokenBindingStatus
+
+        t0 = time.perf_counter_ns()
+
+        if isinstance(credential, (str, dict)):
+            credential = parse_authentication_credential_json(credential)
+
+        if bytes_to_base64url(credential.raw_id) != credential.id:
+            raise InvalidAuthenticationResponse("id and raw_id were not equivalent")
+
+        if credential.type != PublicKeyCredentialType.PUBLIC_KEY:
+            raise InvalidAuthenticationResponse(
+                f'Unexpected credential type "{credential.type}", expected "public-key"'
+            )
+
+        response = credential.response
+        client_data_bytes = byteslike_to_bytes(response.client_data_json)
+        authenticator_data_bytes = byteslike_to_bytes(response.authenticator_data)
+        signature_bytes = byteslike_to_bytes(response.signature)
+
+        client_data = parse_client_data_json(client_data_bytes)
+
+        if client_data.type != ClientDataType.WEBAUTHN_GET:
+            raise InvalidAuthenticationResponse(
+                f'Unexpected client data type "{client_data.type}", expected "{ClientDataType.WEBAUTHN_GET}"'
+            )
+
+        if expected_challenge != client_data.challenge:
+            raise InvalidAuthenticationResponse("Client data challenge was not expected challenge")
+
+        if isinstance(expected_origin, str):
+            if expected_origin != client_data.origin:
+                raise InvalidAuthenticationResponse(
+                    f'Unexpected client data origin "{client_data.origin}", expected "{expected_origin}"'
+                )
+        elif client_data.origin not in expected_origin:
+            raise InvalidAuthenticationResponse(
+                f'Unexpected client data origin "{client_data.origin}", expected one of {expected_origin}'
+            )
+
+        if client_data.token_binding and client_data.token_binding.status not in (
+            TokenBindingStatus.SUPPORTED,
+            TokenBindingStatus.PRESENT,
+        ):
+            raise InvalidAuthenticationResponse(
+                f'Unexpected token_binding status of "{client_data.token_binding.status}"'
+            )
+
+        auth_data = parse_authenticator_data(authenticator_data_bytes)
+
+        if auth_data.rp_id_hash != hashlib.sha256(expected_rp_id.encode("utf-8")).digest():
+            raise InvalidAuthenticationResponse("Unexpected RP ID hash")
+
+        if not auth_data.flags.up:
+            raise InvalidAuthenticationResponse("User was not present during authentication")
+
+        if require_user_verification and not auth_data.flags.uv:
+            raise InvalidAuthenticationResponse(
+                "User verification is required but user was not verified during authentication"
+            )
+
+        if (
+            auth_data.sign_count > 0 or credential_current_sign_count > 0
+        ) and auth_data.sign_count <= credential_current_sign_count:
+            raise InvalidAuthenticationResponse(
+                f"Response sign count of {auth_data.sign_count} was not greater than current count of {credential_current_sign_count}"
+            )
+
+        signature_base = authenticator_data_bytes + hashlib.sha256(client_data_bytes).digest()
+        t1 = time.perf_counter_ns()
+        self._bump(parse_ns=t1 - t0)
+        metrics.observe_stage_ns("assertion_parse", t1 - t0)
+
+        if cred_hash is None:
+            cred_hash = hashlib.sha256(credential.raw_id).digest()
+        key, alg = self.load_key(cred_hash, credential_public_key)
+
+        t2 = time.perf_counter_ns()
+        try:
+            verify_signature(public_key=key, signature_alg=alg, signature=signature_bytes, data=signature_base)
+        except InvalidSignature:
+            raise InvalidAuthenticationResponse("Could not verify authentication signature")
+        finally:
+            elapsed = time.perf_counter_ns() - t2
+            self._bump(signature_ns=elapsed, verifications=1)
+            metrics.observe_stage_ns("signature_verify", elapsed)
+
+        backup_flags = parse_backup_flags(auth_data.flags)
+
+        return VerifiedAuthentication(
+            credential_id=credential.raw_id,
+            new_sign_count=auth_data.sign_count,
+            credential_device_type=backup_flags.credential_device_type,
+            credential_backed_up=backup_flags.credential_backed_up,
+            user_verified=auth_data.flags.uv,
+        )
+
+engine = VerificationEngine()
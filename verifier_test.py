@@ -0,0 +1,105 @@
+import hashlib
+import json
+import struct
+
+import cbor2
+import pytest
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from webauthn import verify_authentication_response
+from webauthn.helpers import bytes_to_base64url
+from webauthn.helpers.exceptions import InvalidAuthenticationResponse
+
+from verifier import VerificationEngine
+
+RP_ID = "localhost"
+ORIGIN = "http://localhost:8000"
+CHALLENGE = b"c" * 32
+CRED_ID = b"credential-0001"
+
+
+def es256_cose(key: ec.EllipticCurvePrivateKey) -> bytes:
+    nums = key.public_key().public_numbers()
+    return cbor2.dumps({1: 2, 3: -7, -1: 1, -2: nums.x.to_bytes(32, "big"), -3: nums.y.to_bytes(32, "big")})
+
+
+def assertion(key, sign_count: int = 1, challenge: bytes = CHALLENGE) -> dict:
+    client_data = json.dumps(
+        {"type": "webauthn.get", "challenge": bytes_to_base64url(challenge), "origin": ORIGIN}
+    ).encode()
+    auth_data = hashlib.sha256(RP_ID.encode()).digest() + bytes([0x05]) + struct.pack(">I", sign_count)
+    sig = key.sign(auth_data + hashlib.sha256(client_data).digest(), ec.ECDSA(hashes.SHA256()))
+    return {
+        "id": bytes_to_base64url(CRED_ID),
+        "rawId": bytes_to_base64url(CRED_ID),
+        "type": "public-key",
+        "response": {
+            "clientDataJSON": bytes_to_base64url(client_data),
+            "authenticatorData": bytes_to_base64url(auth_data),
+            "signature": bytes_to_base64url(sig),
+        },
+    }
+
+
+def verify(engine, cred, cose, sign_count=0):
+    return engine.verify_authentication_response(
+        credential=cred,
+        expected_challenge=CHALLENGE,
+        expected_rp_id=RP_ID,
+        expected_origin=ORIGIN,
+        credential_public_key=cose,
+        credential_current_sign_count=sign_count,
+        require_user_verification=True,
+    )
+
+
+def test_matches_library_and_caches_key():
+    key = ec.generate_private_key(ec.SECP256R1())
+    cose = es256_cose(key)
+    engine = VerificationEngine(max_keys=4)
+
+    expected = verify_authentication_response(
+        credential=assertion(key),
+        expected_challenge=CHALLENGE,
+        expected_rp_id=RP_ID,
+        expected_origin=ORIGIN,
+        credential_public_key=cose,
+        credential_current_sign_count=0,
+        require_user_verification=True,
+    )
+    first = verify(engine, assertion(key), cose)
+    second = verify(engine, assertion(key, sign_count=2), cose, sign_count=1)
+
+    assert first == expected
+    assert second.new_sign_count == 2
+    stats = engine.stats()
+    assert stats["key_misses"] == 1 and stats["key_hits"] == 1
+    assert stats["verifications"] == 2 and stats["signature_ns"] > 0
+
+
+def test_rejects_bad_signature_and_stale_key():
+    key = ec.generate_private_key(ec.SECP256R1())
+    other = ec.generate_private_key(ec.SECP256R1())
+    engine = VerificationEngine(max_keys=4)
+    verify(engine, assertion(key), es256_cose(key))
+
+    # Same credential hash, different registered key: cache must not be trusted.
+    with pytest.raises(InvalidAuthenticationResponse):
+        verify(engine, assertion(key), es256_cose(other))
+
+
+def test_rejects_replayed_sign_count_and_challenge():
+    key = ec.generate_private_key(ec.SECP256R1())
+    engine = VerificationEngine()
+    with pytest.raises(InvalidAuthenticationResponse):
+        verify(engine, assertion(key, sign_count=3), es256_cose(key), sign_count=3)
+    with pytest.raises(InvalidAuthenticationResponse):
+        verify(engine, assertion(key, challenge=b"x" * 32), es256_cose(key))
+
+
+def test_key_cache_is_bounded():
+    engine = VerificationEngine(max_keys=2)
+    for i in range(3):
+        key = ec.generate_private_key(ec.SECP256R1())
+        engine.load_key(bytes([i]) * 32, es256_cose(key))
+    assert engine.stats()["cached_keys"] == 2
@@ -0,0 +1,178 @@
+"""Seeded mutation fuzzing of register/verify and login/verify.
+
+Valid payloads from the soft authenticator are mutated (dropped fields,
+wrong types, flipped/truncated/padded base64url, junk strings) and sent
+concurrently through the ASGI app. Every storage, run_db and run_crypto call
+is attributed to the request that made it, so the properties can be checked
+per request:
+
+    - no response is a 5xx;
+    - anything admission rejects gets a 400 without a single DB or crypto call.
+
+Failures print the seed and case index; FUZZ_SEED reruns a failing seed.
+"""
+import asyncio
+import base64
+import copy
+import os
+import random
+import secrets
+
+import admission
+from harness import async_client, collect_calls, spying
+from soft_authenticator import SoftAuthenticator
+
+SEED = int(os.environ.get("FUZZ_SEED", "1337"))
+CASES = 200
+CONCURRENCY = 32
+
+ASSERTION_FIELDS = ("clientDataJSON", "authenticatorData", "signature", "userHandle")
+ATTESTATION_FIELDS = ("clientDataJSON", "attestationObject", "transports")
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def _junk(rng: random.Random):
+    return rng.choice([
+        None, 0, -1, 2**63, True, 1.5, [], {}, "", "=", "!!!!", "A", "AAAAA",
+        "\u0000", "é" * 40, "A" * rng.randint(1, 20000), ["public-key"], {"id": "AA"},
+    ])
+
+
+def _mutate_bytes(rng: random.Random, data: bytes) -> bytes:
+    op = rng.randrange(4)
+    if op == 0 and data:
+        i = rng.randrange(len(data))
+        return data[:i] + bytes([data[i] ^ (1 << rng.randrange(8))]) + data[i + 1:]
+    if op == 1:
+        return data[: rng.randrange(len(data) + 1)]
+    if op == 2:
+        return data + rng.randbytes(rng.randint(1, 64))
+    return rng.randbytes(rng.randint(0, 80))
+
+
+def mutate(rng: random.Random, credential: dict, fields: tuple) -> object:
+    """A copy of `credential` with one to three random mutations applied."""
+    if rng.random() < 0.02:
+        return _junk(rng)
+    out = copy.deepcopy(credential)
+    for _ in range(rng.randint(1, 3)):
+        if not isinstance(out, dict):
+            break
+        target, key = rng.choice([(out, k) for k in ("id", "rawId", "type", "response")] + [("response", f) for f in fields])
+        if target == "response":
+            if not isinstance(out.get("response"), dict):
+                continue
+            target = out["response"]
+        op = rng.randrange(4)
+        if op == 0:
+            target.pop(key, None)
+        elif op == 1:
+            target[key] = _junk(rng)
+        elif isinstance(target.get(key), str):
+            try:
+                raw = _unb64(target[key])
+            except ValueError:
+                raw = target[key].encode()
+            target[key] = _b64(_mutate_bytes(rng, raw))
+            if key in ("id", "rawId") and rng.random() < 0.7:
+                # Usually keep id/rawId consistent so the case gets past the first check.
+                out["id"] = out["rawId"] = target[key]
+    return out
+
+
+async def _run(cases) -> list:
+    """Run each case coroutine concurrently, each with its own call log."""
+    limit = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(case):
+        async with limit:
+            calls = []
+            collect_calls(calls)  # tasks get a copy of the context, so this is per case
+            return (*await case(calls), calls)
+
+    return await asyncio.gather(*(asyncio.create_task(one(c)) for c in cases))
+
+
+def _check(results, check) -> None:
+    failures = []
+    for i, (payload, status, calls) in enumerate(results):
+        assert status < 500, f"seed={SEED} case={i}: {status} for {payload!r}"
+        reason = check(payload) if isinstance(payload, dict) or payload else "empty"
+        if reason:
+            if status != 400 or calls:
+                failures.append((i, reason, status, calls))
+    assert not failures, f"seed={SEED}: admission-rejected input reached the backend: {failures[:5]}"
+
+
+def test_fuzzed_assertions_never_reach_db_or_crypto():
+    rng = random.Random(SEED)
+    username = f"fuzz-{secrets.token_hex(4)}"
+    authenticator = SoftAuthenticator()
+
+    async def main():
+        async with async_client() as client:
+            options = (await client.post("/api/register/options", json={"username": username})).json()
+            r = await client.post(
+                "/api/register/verify", json={"username": username, "credential": authenticator.create(options)}
+            )
+            assert r.status_code == 200
+
+        def case(index: int):
+            case_rng = random.Random(rng.random())
+            usernameless = index % 4 == 0
+
+            async def run(calls):
+                async with async_client() as client:
+                    options = (await client.post("/api/login/options", json={"username": "" if usernameless else username})).json()
+                    payload = mutate(case_rng, authenticator.get(options), ASSERTION_FIELDS)
+                    calls.clear()
+                    r = await client.post("/api/login/verify", json={"credential": payload})
+                    return payload, r.status_code
+
+            return run
+
+        with spying():
+            results = await _run([case(i) for i in range(CASES)])
+
+        _check(results, admission.check_assertion)
+        assert any(calls for *_, calls in results), "no case got past admission; mutations too aggressive"
+
+        # The fuzzing left the real credential usable.
+        async with async_client() as client:
+            options = (await client.post("/api/login/options", json={"username": username})).json()
+            r = await client.post("/api/login/verify", json={"credential": authenticator.get(options)})
+            assert r.status_code == 200
+
+    asyncio.run(main())
+
+
+def test_fuzzed_attestations_never_reach_db_or_crypto():
+    rng = random.Random(SEED + 1)
+
+    def case(index: int):
+        case_rng = random.Random(rng.random())
+        username = f"fuzz-reg-{secrets.token_hex(4)}"
+
+        async def run(calls):
+            async with async_client() as client:
+                options = (await client.post("/api/register/options", json={"username": username})).json()
+                payload = mutate(case_rng, SoftAuthenticator().create(options), ATTESTATION_FIELDS)
+                calls.clear()
+                r = await client.post("/api/register/verify", json={"username": username, "credential": payload})
+                return payload, r.status_code
+
+        return run
+
+    async def main():
+        with spying():
+            return await _run([case(i) for i in range(CASES // 2)])
+
+    results = asyncio.run(main())
+    _check(results, admission.check_attestation)
+    assert any(calls for *_, calls in results), "no case got past admission; mutations too aggressive"
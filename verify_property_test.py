@@ -0,0 +1,107 @@
+"""Property-based tests of the verify paths (hypothesis)."""
+import base64
+import secrets
+
+from fastapi.testclient import TestClient
+from hypothesis import HealthCheck, given, settings, strategies as st
+
+import admission
+from harness import attempt, register
+from main import app
+from soft_authenticator import SoftAuthenticator
+
+# Function-scoped fixtures are not reset between examples, so state is module-level.
+USERNAME = f"prop-{secrets.token_hex(4)}"
+AUTHENTICATOR = SoftAuthenticator()
+SETTINGS = settings(max_examples=150, deadline=None, suppress_health_check=[HealthCheck.too_slow])
+
+json_values = st.recursive(
+    st.none() | st.booleans() | st.integers() | st.floats(allow_nan=False, allow_infinity=False) | st.text(max_size=40),
+    lambda children: st.lists(children, max_size=4) | st.dictionaries(st.text(max_size=10), children, max_size=4),
+    max_leaves=12,
+)
+
+
+def b64url(min_size: int = 0, max_size: int = 300, prefix: bytes = b""):
+    return st.binary(min_size=min_size, max_size=max_size).map(
+        lambda b: base64.urlsafe_b64encode(prefix + b).rstrip(b"=").decode("ascii")
+    )
+
+
+# Mostly well-shaped values, so examples get past admission as well as into it.
+FIELDS = {
+    "clientDataJSON": b64url(16),
+    # This RP's hash with UP|UV set, then anything.
+    "authenticatorData": b64url(prefix=admission._RP_ID_HASH + b"\x05"),
+    "signature": b64url(8, 600),
+    "userHandle": b64url(1, 64),
+    "attestationObject": b64url(37, 600),
+    "transports": st.lists(st.sampled_from(["usb", "nfc", "ble", "internal", "hybrid"]), max_size=3),
+}
+
+
+def credentials(response_fields: tuple):
+    @st.composite
+    def build(draw):
+        credential_id = draw(b64url(1, 64))
+        response = {
+            name: draw(FIELDS[name] | json_values | st.text(max_size=60))
+            for name in response_fields
+            if draw(st.integers(0, 9))  # usually present
+        }
+        credential = {
+            "id": credential_id,
+            "rawId": draw(st.just(credential_id) | b64url()),
+            "type": draw(st.just("public-key") | st.text(max_size=12)),
+            "response": draw(st.just(response) | json_values),
+        }
+        for key in draw(st.sets(st.sampled_from(sorted(credential)), max_size=2)):
+            del credential[key]
+        return credential
+
+    return build()
+
+
+assertions = credentials(("clientDataJSON", "authenticatorData", "signature", "userHandle"))
+attestations = credentials(("clientDataJSON", "attestationObject", "transports"))
+
+
+def setup_module():
+    assert register(TestClient(app), AUTHENTICATOR, USERNAME).status_code == 200
+
+
+@SETTINGS
+@given(json_values)
+def test_admission_never_raises(value):
+    for check in (admission.check_assertion, admission.check_attestation):
+        assert check(value) is None or isinstance(check(value), str)
+
+
+@SETTINGS
+@given(assertions)
+def test_rejected_assertions_cost_no_db_or_crypto(credential):
+    status, calls = attempt(
+        "/api/login/options", {"username": USERNAME}, "/api/login/verify", {"credential": credential}
+    )
+    assert status < 500
+    if admission.check_assertion(credential) or not credential:
+        assert status == 400 and calls == []
+    else:
+        # Well-formed garbage is still never accepted.
+        assert status == 400
+
+
+@SETTINGS
+@given(attestations)
+def test_rejected_attestations_cost_no_db_or_crypto(credential):
+    status, calls = attempt(
+        "/api/register/options",
+        {"username": USERNAME},
+        "/api/register/verify",
+        {"username": USERNAME, "credential": credential},
+    )
+    assert status < 500
+    if admission.check_attestation(credential) or not credential:
+        assert status == 400 and calls == []
+    else:
+        assert status == 400
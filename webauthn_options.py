@@ -0,0 +1,116 @@
+"""Pre-serialized options for register/options and login/options.
+
+Everything but the challenge, the user and the credential lists is fixed by
+config, so it is encoded once at import; each request only splices those
+fields in. The output is byte-for-byte what `generate_*_options` +
+`options_to_json` + `JSONResponse` produced before (webauthn_options_test
+holds it to that), without building py_webauthn structs or round-tripping
+through `json.loads`. Nothing here imports py_webauthn.
+
+The username is encoded with orjson when it is installed (JSON_BACKEND=auto);
+for strings its output is the same as the stdlib encoder's.
+"""
+import base64
+import json
+import secrets
+from typing import Callable, Iterable
+
+from config import JSON_BACKEND, RP_ID, RP_NAME
+
+# py_webauthn's generate_challenge() size and default timeout.
+CHALLENGE_BYTES = 64
+TIMEOUT_MS = 60000
+# py_webauthn's default_supported_pub_key_algs, in its order.
+PUB_KEY_ALGS = (-7, -8, -36, -37, -38, -39, -257, -258, -259)
+
+def b64url_encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+def b64url_decode(data: str) -> bytes:
+    """Unpadded base64url to bytes; raises ValueError or TypeError on bad input."""
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def generate_challenge() -> bytes:
+    return secrets.token_bytes(CHALLENGE_BYTES)
+
+def _stdlib_dumps(obj) -> bytes:
+    # JSONResponse's encoding.
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def make_dumps(kind: str = JSON_BACKEND) -> Callable[[object], bytes]:
+    if kind not in ("auto", "orjson", "json"):
+        raise RuntimeError(f"unknown JSON_BACKEND {kind!r} (expected 'auto', 'orjson' or 'json')")
+    if kind != "json":
+        try:
+            # Optional dependency.
+            import orjson
+        except ImportError:
+            if kind == "orjson":
+                raise RuntimeError("JSON_BACKEND=orjson needs `pip install orjson`") from None
+        else:
+            def _orjson_dumps(obj) -> bytes:
+                try:
+                    return orjson.dumps(obj)
+                except TypeError:
+                    # Whatever orjson rejects (lone surrogates) fails or
+                    # succeeds exactly as it does with the stdlib.
+                    return _stdlib_dumps(obj)
+
+            return _orjson_dumps
+    return _stdlib_dumps
+
+# Per-request values; the fixed fragments below always use the stdlib.
+_dumps = make_dumps()
+
+def _descriptors(ids: Iterable[bytes]) -> bytes:
+    return b"[" + b",".join(b'{"id":"' + b64url_encode(i) + b'","type":"public-key"}' for i in ids) + b"]"
+
+_REG_HEAD = b'{"rp":' + _stdlib_dumps({"name": RP_NAME, "id": RP_ID}) + b',"user":{"id":"'
+_REG_PARAMS = (
+    b',"pubKeyCredParams":'
+    + _stdlib_dumps([{"type": "public-key", "alg": alg} for alg in PUB_KEY_ALGS])
+    + b',"timeout":'
+    + _stdlib_dumps(TIMEOUT_MS)
+    + b',"excludeCredentials":'
+)
+_REG_TAIL = (
+    b',"authenticatorSelection":'
+    + _stdlib_dumps(
+        {
+            "authenticatorAttachment": "platform",
+            "residentKey": "preferred",
+            "requireResidentKey": False,
+            "userVerification": "required",
+        }
+    )
+    + b',"attestation":"none"}'
+)
+
+def registration_options(challenge: bytes, user_id: bytes, username: str, exclude_ids: Iterable[bytes]) -> bytes:
+    name = _dumps(username)
+    return b"".join(
+        (
+            _REG_HEAD,
+            b64url_encode(user_id),
+            b'","name":',
+            name,
+            b',"displayName":',
+            name,
+            b'},"challenge":"',
+            b64url_encode(challenge),
+            b'"',
+            _REG_PARAMS,
+            _descriptors(exclude_ids),
+            _REG_TAIL,
+        )
+    )
+
+_AUTH_MIDDLE = (
+    b'","timeout":' + _stdlib_dumps(TIMEOUT_MS) + b',"rpId":' + _stdlib_dumps(RP_ID) + b',"allowCredentials":'
+)
+_AUTH_TAIL = b',"userVerification":"required"}'
+
+def authentication_options(challenge: bytes, allow_ids: Iterable[bytes]) -> bytes:
+    return b"".join(
+        (b'{"challenge":"', b64url_encode(challenge), _AUTH_MIDDLE, _descriptors(allow_ids), _AUTH_TAIL)
+    )
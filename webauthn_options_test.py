@@ -0,0 +1,73 @@
+import json
+
+import pytest
+from fastapi.responses import JSONResponse
+from webauthn import generate_authentication_options, generate_registration_options, options_to_json
+from webauthn.helpers.structs import (
+    AttestationConveyancePreference,
+    AuthenticatorAttachment,
+    AuthenticatorSelectionCriteria,
+    PublicKeyCredentialDescriptor,
+    ResidentKeyRequirement,
+    UserVerificationRequirement,
+)
+
+import webauthn_options
+from config import RP_ID, RP_NAME
+
+
+def _rendered(options) -> bytes:
+    # What the routes returned before the templates.
+    return JSONResponse(content=json.loads(options_to_json(options))).body
+
+
+def test_registration_options_match_py_webauthn():
+    challenge = webauthn_options.generate_challenge()
+    for username, exclude in [("alice", []), ('Zoë "quoted" \\ <x>', [b"\x00" * 16, b"\xff" * 70])]:
+        expected = generate_registration_options(
+            rp_id=RP_ID,
+            rp_name=RP_NAME,
+            challenge=challenge,
+            user_id=b"u" * 16,
+            user_name=username,
+            user_display_name=username,
+            attestation=AttestationConveyancePreference.NONE,
+            authenticator_selection=AuthenticatorSelectionCriteria(
+                authenticator_attachment=AuthenticatorAttachment.PLATFORM,
+                resident_key=ResidentKeyRequirement.PREFERRED,
+                user_verification=UserVerificationRequirement.REQUIRED,
+            ),
+            exclude_credentials=[PublicKeyCredentialDescriptor(id=c) for c in exclude],
+        )
+        got = webauthn_options.registration_options(challenge, b"u" * 16, username, exclude)
+        assert got == _rendered(expected)
+
+
+def test_authentication_options_match_py_webauthn():
+    challenge = webauthn_options.generate_challenge()
+    for allow in [[], [b"a" * 16, b"b" * 32, b"c" * 1]]:
+        expected = generate_authentication_options(
+            rp_id=RP_ID,
+            challenge=challenge,
+            allow_credentials=[PublicKeyCredentialDescriptor(id=c) for c in allow],
+            user_verification=UserVerificationRequirement.REQUIRED,
+        )
+        assert webauthn_options.authentication_options(challenge, allow) == _rendered(expected)
+
+
+def test_b64url_round_trip():
+    for n in range(8):
+        data = bytes(range(250, 250 + n % 6)) + b"?>" * n
+        assert webauthn_options.b64url_decode(webauthn_options.b64url_encode(data).decode()) == data
+
+
+def test_json_backends_agree():
+    pytest.importorskip("orjson")
+    fast, slow = webauthn_options.make_dumps("orjson"), webauthn_options.make_dumps("json")
+    for s in ["alice", 'q"\\/', "\x00\x1f\x7f\n\t", "Zoë ✓ 𝄞", "  "]:
+        assert fast(s) == slow(s)
+    for dumps in (fast, slow):
+        with pytest.raises(UnicodeEncodeError):
+            dumps("\ud800 lone")
+    with pytest.raises(RuntimeError):
+        webauthn_options.make_dumps("simdjson")
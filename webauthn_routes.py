@@ -1,30 +1,21 @@
-import json
 import secrets
 import time
+from typing import Optional
 
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import JSONResponse
-
-from webauthn import (
-    base64url_to_bytes,
-    generate_authentication_options,
-    generate_registration_options,
-    options_to_json,
-    verify_authentication_response,
-    verify_registration_response,
-)
-from webauthn.helpers.structs import (
-    AttestationConveyancePreference,
-    AuthenticatorAttachment,
-    AuthenticatorSelectionCriteria,
-    PublicKeyCredentialDescriptor,
-    ResidentKeyRequirement,
-    UserVerificationRequirement,
-)
-
-import db
+from fastapi.responses import Response
+
+import admission
+import audit
 import crypto_store
-from config import RP_ID, ORIGIN, RP_NAME, CHALLENGE_TTL_SECONDS
+import metrics
+import verifier
+import webauthn_options
+from challenge_store import store as challenges
+from storage import backend as storage
+from config import RP_ID, ORIGIN
+from executors import run_crypto, run_db
+from metrics import AUTH_FAILURES, AUTH_SUCCESSES
 
 router = APIRouter()
 
@@ -32,77 +23,144 @@ def b64url_encode(data: bytes) -> str:
     import base64
     return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
 
+def _reject(endpoint: str, reason: str, detail: str, status_code: int = 400) -> HTTPException:
+    AUTH_FAILURES.labels(endpoint, reason).inc()
+    audit.failure(endpoint, reason)
+    return HTTPException(status_code=status_code, detail=detail)
+
+async def _limit_username(endpoint: str, username: str) -> None:
+    if not await admission.allow_username(username):
+        raise _reject(endpoint, "rate_limited_user", "too many requests", status_code=429)
+
+async def _json_body(request: Request, endpoint: str) -> dict:
+    with metrics.stage("json_parse"):
+        try:
+            body = await request.json()
+        except admission.BodyTooLarge:
+            raise _reject(endpoint, "body_too_large", "request too large", status_code=413)
+        except Exception:
+            body = None
+    if not isinstance(body, dict):
+        raise _reject(endpoint, "invalid_request", "invalid request")
+    return body
+
+async def _sync_caches() -> None:
+    # Multi-worker mode: one shared-memory read, plus a DB query only after
+    # another worker invalidated something.
+    coherence = crypto_store.coherence
+    if coherence is not None and coherence.stale():
+        await run_db(coherence.sync)
+
+async def _user_credential_ids(user_id: int) -> list[bytes]:
+    await _sync_caches()
+    # Cache hits are a dict lookup; only misses pay for the executor hop.
+    ids = crypto_store.cache.get_user_credential_ids(user_id)
+    if ids is None:
+        generation = crypto_store.cache.generation()
+        with metrics.stage("db_lookup"):
+            rows = await storage.list_user_credentials(user_id)
+        ids = await run_crypto(crypto_store.user_credential_ids_from_rows, user_id, rows, generation)
+    return ids
+
+async def _issue_challenge(
+    kind: str, challenge: bytes, username: Optional[str], user_id: Optional[int] = None
+) -> str:
+    with metrics.stage("challenge_issue"):
+        if challenges.blocking:
+            return await run_db(challenges.issue, kind, challenge, username, user_id)
+        return challenges.issue(kind, challenge, username, user_id)
+
+async def _consume_challenge(request: Request, session_key: str, kind: str):
+    # Pop first: the handle is single-use even if the store lookup fails.
+    handle = request.session.pop(session_key, None)
+    if not handle:
+        return None
+    with metrics.stage("challenge_consume"):
+        if challenges.blocking:
+            return await run_db(challenges.consume, handle, kind)
+        return challenges.consume(handle, kind)
+
+async def _discoverable_owner(credential: dict, user_id: int) -> str:
+    """Username for a usernameless assertion, found via its userHandle.
+
+    The handle must belong to the same account that owns the credential.
+    """
+    try:
+        user_handle = webauthn_options.b64url_decode(credential["response"]["userHandle"])
+    except Exception:
+        raise _reject("login_verify", "missing_user_handle", "webauthn verification failed")
+    with metrics.stage("db_lookup"):
+        user = await storage.get_user_by_handle(user_handle)
+    if user is None or user["id"] != user_id:
+        raise _reject("login_verify", "user_mismatch", "webauthn verification failed")
+    return user["username"]
+
 @router.post("/api/register/options")
 async def register_options(request: Request):
-    body = await request.json()
+    body = await _json_body(request, "register_options")
     username = (body.get("username") or "").strip()
     if not username:
-        raise HTTPException(status_code=400, detail="invalid request")
+        raise _reject("register_options", "invalid_request", "invalid request")
+    await _limit_username("register_options", username)
 
-    user = db.get_user(username)
-    if not user:
-        user = db.get_or_create_user(username, user_handle=secrets.token_bytes(16))
-
-    creds = db.list_user_credentials(user["id"])
-
-    exclude = []
-    for r in creds:
-        cred_id = crypto_store.decrypt_credential_id(r)
-        exclude.append(PublicKeyCredentialDescriptor(id=cred_id))
-
-    options = generate_registration_options(
-        rp_id=RP_ID,
-        rp_name=RP_NAME,
-        user_id=bytes(user["user_handle"]),
-        user_name=username,
-        user_display_name=username,
-        attestation=AttestationConveyancePreference.NONE,
-        authenticator_selection=AuthenticatorSelectionCriteria(
-            authenticator_attachment=AuthenticatorAttachment.PLATFORM,
-            resident_key=ResidentKeyRequirement.PREFERRED,
-            user_verification=UserVerificationRequirement.REQUIRED,
-        ),
-        exclude_credentials=exclude,
-    )
+    # A single upsert; concurrent first registrations share the same row.
+    with metrics.stage("db_lookup"):
+        user = await storage.get_or_create_user(username, user_handle=secrets.token_bytes(16))
+
+    exclude = await _user_credential_ids(user["id"])
+
+    challenge = webauthn_options.generate_challenge()
+    with metrics.stage("options_build"):
+        content = webauthn_options.registration_options(challenge, bytes(user["user_handle"]), username, exclude)
 
-    request.session["reg_challenge"] = b64url_encode(options.challenge)
-    request.session["reg_challenge_issued_at"] = int(time.time())
+    request.session["reg_ctx"] = await _issue_challenge("register", challenge, username)
 
-    return JSONResponse(content=json.loads(options_to_json(options)))
+    return Response(content, media_type="application/json")
 
 @router.post("/api/register/verify")
 async def register_verify(request: Request):
-    body = await request.json()
+    trail = audit.begin("register_verify", admission.client_ip(request.scope))
+    body = await _json_body(request, "register_verify")
     username = (body.get("username") or "").strip()
+    trail["username"] = username or None
     credential = body.get("credential")
     if not username or not credential:
-        raise HTTPException(status_code=400, detail="invalid request")
-
-    user = db.get_user(username)
+        raise _reject("register_verify", "invalid_request", "invalid request")
+    reason = admission.check_attestation(credential)
+    if reason:
+        raise _reject("register_verify", reason, "webauthn verification failed")
+    await _limit_username("register_verify", username)
+
+    with metrics.stage("db_lookup"):
+        user = await storage.get_user(username)
     if not user:
-        raise HTTPException(status_code=400, detail="invalid request")
+        raise _reject("register_verify", "unknown_user", "invalid request")
+
+    pending = await _consume_challenge(request, "reg_ctx", "register")
+    if pending is None or pending.username != username:
+        raise _reject("register_verify", "challenge_expired", "registration expired (start over)")
 
-    expected_challenge_b64 = request.session.pop("reg_challenge", None)
-    issued_at = request.session.pop("reg_challenge_issued_at", None)
-    if not expected_challenge_b64 or not issued_at:
-        raise HTTPException(status_code=400, detail="registration expired (start over)")
-    if int(time.time()) - int(issued_at) > CHALLENGE_TTL_SECONDS:
-        raise HTTPException(status_code=400, detail="registration expired (start over)")
+    # Deferred: py_webauthn's registration path pulls in x509/OpenSSL/TPM
+    # parsing, which startup does not need (main.py preloads it afterwards).
+    from webauthn import verify_registration_response
 
     try:
-        verification = verify_registration_response(
-            credential=credential,
-            expected_challenge=base64url_to_bytes(expected_challenge_b64),
-            expected_rp_id=RP_ID,
-            expected_origin=ORIGIN,
-            require_user_verification=True,
-        )
+        with metrics.stage("attestation_verify"):
+            verification = await run_crypto(
+                verify_registration_response,
+                credential=credential,
+                expected_challenge=pending.challenge,
+                expected_rp_id=RP_ID,
+                expected_origin=ORIGIN,
+                require_user_verification=True,
+            )
     except Exception:
-        raise HTTPException(status_code=400, detail="webauthn verification failed")
+        raise _reject("register_verify", "verification_failed", "webauthn verification failed")
 
     transports = credential.get("response", {}).get("transports")
 
-    crypto_store.save_credential(
+    row = await run_crypto(
+        crypto_store.seal_credential,
         user_id=user["id"],
         credential_id=verification.credential_id,
         public_key=verification.credential_public_key,
@@ -111,88 +169,134 @@ async def register_verify(request: Request):
         device_type=getattr(verification, "credential_device_type", None),
         backed_up=bool(getattr(verification, "credential_backed_up", False)),
     )
+    with metrics.stage("db_write"):
+        saved = await storage.insert_or_replace_credential(**row)
+    if not saved:
+        raise _reject("register_verify", "credential_taken", "webauthn verification failed")
+    await run_db(crypto_store.forget_credential, row["credential_id_hash"], user["id"])
 
     request.session["user"] = {"username": username}
+    AUTH_SUCCESSES.labels("register_verify").inc()
+    trail["cred_hash"] = row["credential_id_hash"]
+    audit.success(trail)
     return {"verified": True}
 
 @router.post("/api/login/options")
 async def login_options(request: Request):
-    body = await request.json()
-    username = (body.get("username") or "").strip()
-    if not username:
-        raise HTTPException(status_code=400, detail="invalid request")
-
-    user = db.get_user(username)
-    if not user:
-        raise HTTPException(status_code=400, detail="invalid request")
-
-    creds = db.list_user_credentials(user["id"])
-    if not creds:
-        raise HTTPException(status_code=400, detail="invalid request")
-
-    allow = []
-    for r in creds:
-        cred_id = crypto_store.decrypt_credential_id(r)
-        allow.append(PublicKeyCredentialDescriptor(id=cred_id))
-
-    options = generate_authentication_options(
-        rp_id=RP_ID,
-        allow_credentials=allow,
-        user_verification=UserVerificationRequirement.REQUIRED,
-    )
-
-    request.session["auth_challenge"] = b64url_encode(options.challenge)
-    request.session["auth_challenge_issued_at"] = int(time.time())
-    request.session["auth_username"] = username
-
-    return JSONResponse(content=json.loads(options_to_json(options)))
+    body = await _json_body(request, "login_options")
+    username = body.get("username") or ""
+    if not isinstance(username, str):
+        raise _reject("login_options", "invalid_request", "invalid request")
+    username = username.strip()
+
+    user_id = None
+    if username:
+        await _limit_username("login_options", username)
+        # Unknown users and users without passkeys get the same 200 response,
+        # padded with decoys, after the same amount of DB and AES work.
+        with metrics.stage("db_lookup"):
+            if crypto_store.decoy_lengths.stale():
+                crypto_store.decoy_lengths.update(await storage.credential_id_enc_lengths())
+            rows = await storage.find_login_rows(username)
+        user_id = rows[0]["uid"]
+        cred_ids = await run_crypto(crypto_store.login_credential_ids_from_rows, rows)
+        allow = crypto_store.login_descriptor_ids(username, cred_ids)
+    else:
+        # Discoverable-credential login: the authenticator picks the account
+        # and login/verify resolves it from the assertion's userHandle.
+        allow = []
+
+    challenge = webauthn_options.generate_challenge()
+    with metrics.stage("options_build"):
+        content = webauthn_options.authentication_options(challenge, allow)
+
+    request.session["auth_ctx"] = await _issue_challenge("login", challenge, username or None, user_id)
+
+    return Response(content, media_type="application/json")
 
 @router.post("/api/login/verify")
 async def login_verify(request: Request):
-    body = await request.json()
+    trail = audit.begin("login_verify", admission.client_ip(request.scope))
+    body = await _json_body(request, "login_verify")
     credential = body.get("credential")
     if not credential:
-        raise HTTPException(status_code=400, detail="invalid request")
-
-    expected_challenge_b64 = request.session.pop("auth_challenge", None)
-    issued_at = request.session.pop("auth_challenge_issued_at", None)
-    if not expected_challenge_b64 or not issued_at:
-        raise HTTPException(status_code=400, detail="login expired (start over)")
-    if int(time.time()) - int(issued_at) > CHALLENGE_TTL_SECONDS:
-        raise HTTPException(status_code=400, detail="login expired (start over)")
+        raise _reject("login_verify", "invalid_request", "invalid request")
+    # Garbage is turned away before it costs a challenge lookup or a DB read.
+    reason = admission.check_assertion(credential)
+    if reason:
+        raise _reject("login_verify", reason, "webauthn verification failed")
+
+    pending = await _consume_challenge(request, "auth_ctx", "login")
+    if pending is None:
+        raise _reject("login_verify", "challenge_expired", "login expired (start over)")
+    trail["username"] = pending.username
+    if pending.username:
+        await _limit_username("login_verify", pending.username)
 
     try:
-        credential_id_bytes = base64url_to_bytes(credential["id"])
+        credential_id_bytes = webauthn_options.b64url_decode(credential["id"])
     except Exception:
-        raise HTTPException(status_code=400, detail="webauthn verification failed")
+        raise _reject("login_verify", "malformed_credential", "webauthn verification failed")
 
     cred_hash = crypto_store.sha256(credential_id_bytes)
-    cred_row = db.find_credential_by_hash(cred_hash)
-    if not cred_row:
-        raise HTTPException(status_code=400, detail="webauthn verification failed")
-
-    public_key = crypto_store.decrypt_public_key(cred_row)
+    trail["cred_hash"] = cred_hash
+    await _sync_caches()
+    cred = crypto_store.cache.get(cred_hash)
+    if cred is None:
+        # Taken before the read: a revoke that lands meanwhile keeps the row out of the cache.
+        generation = crypto_store.cache.generation()
+        with metrics.stage("db_lookup"):
+            row = await storage.find_credential_by_hash(cred_hash)
+        if row is not None:
+            cred = await run_crypto(crypto_store.credential_from_row, row, generation)
+    if not cred:
+        raise _reject("login_verify", "unknown_credential", "webauthn verification failed")
+
+    if pending.username:
+        # The assertion must come from a credential owned by the user the
+        # challenge was issued for (resolved by login/options, so no lookup).
+        if cred.user_id != pending.user_id:
+            raise _reject("login_verify", "user_mismatch", "webauthn verification failed")
+        owner = pending.username
+    else:
+        owner = await _discoverable_owner(credential, cred.user_id)
+        trail["username"] = owner
 
     try:
-        verification = verify_authentication_response(
+        verification = await run_crypto(
+            verifier.engine.verify_authentication_response,
             credential=credential,
-            expected_challenge=base64url_to_bytes(expected_challenge_b64),
+            expected_challenge=pending.challenge,
             expected_rp_id=RP_ID,
             expected_origin=ORIGIN,
-            credential_public_key=public_key,
-            credential_current_sign_count=int(cred_row["sign_count"]),
+            credential_public_key=cred.public_key,
+            credential_current_sign_count=cred.sign_count,
+            cred_hash=cred_hash,
             require_user_verification=True,
         )
-    except Exception:
-        raise HTTPException(status_code=400, detail="webauthn verification failed")
+    except Exception as exc:
+        # A count that went backwards can mean a cloned authenticator.
+        reason = "sign_count_regression" if str(exc).startswith("Response sign count") else "verification_failed"
+        raise _reject("login_verify", reason, "webauthn verification failed")
 
-    crypto_store.update_sign_count(
+    sign_count_args = dict(
         cred_hash=cred_hash,
         new_sign_count=verification.new_sign_count,
         device_type=getattr(verification, "credential_device_type", None),
         backed_up=bool(getattr(verification, "credential_backed_up", False)),
+        used_at=time.time(),
     )
-
-    username = request.session.get("auth_username", "unknown")
-    request.session["user"] = {"username": username}
+    with metrics.stage("db_write"):
+        if crypto_store.sign_count_writer.write_through:
+            advanced = await run_db(crypto_store.update_sign_count, **sign_count_args)
+        else:
+            # Write-behind only touches memory; no executor hop needed.
+            advanced = crypto_store.update_sign_count(**sign_count_args)
+    if not advanced:
+        # A concurrent login with the same count won the compare-and-swap.
+        raise _reject("login_verify", "sign_count_race", "webauthn verification failed")
+
+    request.session["user"] = {"username": owner}
+    AUTH_SUCCESSES.labels("login_verify").inc()
+    audit.success(trail)
     return {"verified": True}
\ No newline at end of file
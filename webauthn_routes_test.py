@@ -0,0 +1,90 @@
+import asyncio
+import secrets
+
+from fastapi.testclient import TestClient
+
+import crypto_store
+from harness import async_client, collect_calls, enroll, spying
+from main import app
+from metrics import AUTH_FAILURES
+from soft_authenticator import SoftAuthenticator, b64url
+
+
+def test_usernameless_login_resolves_user_from_handle():
+    client = TestClient(app)
+    username = f"disc-{secrets.token_hex(4)}"
+    authenticator = enroll(client, username)
+    client.post("/api/logout", json={})
+
+    options = client.post("/api/login/options", json={}).json()
+    assert options["allowCredentials"] == []
+    r = client.post("/api/login/verify", json={"credential": authenticator.get(options)})
+    assert r.status_code == 200
+    assert client.get("/api/me").json()["user"]["username"] == username
+
+
+def test_usernameless_login_rejects_foreign_or_missing_handle():
+    client = TestClient(app)
+    authenticator = enroll(client, f"disc-{secrets.token_hex(4)}")
+    other = enroll(client, f"disc-{secrets.token_hex(4)}")
+    other_handle = next(iter(other.credentials.values())).user_handle
+
+    options = client.post("/api/login/options", json={}).json()
+    assertion = authenticator.get(options)
+    assertion["response"]["userHandle"] = b64url(other_handle)
+    assert client.post("/api/login/verify", json={"credential": assertion}).status_code == 400
+
+    options = client.post("/api/login/options", json={}).json()
+    assertion = authenticator.get(options)
+    del assertion["response"]["userHandle"]
+    assert client.post("/api/login/verify", json={"credential": assertion}).status_code == 400
+
+
+def test_username_login_checks_owner_without_a_lookup():
+    client = TestClient(app)
+    username = f"owner-{secrets.token_hex(4)}"
+    authenticator = enroll(client, username)
+    intruder = enroll(client, f"owner-{secrets.token_hex(4)}")
+
+    async def main():
+        async with async_client() as ac:
+            options = (await ac.post("/api/login/options", json={"username": username})).json()
+            calls = []
+            collect_calls(calls)
+            r = await ac.post("/api/login/verify", json={"credential": authenticator.get(options)})
+            return r.status_code, calls
+
+    with spying():
+        status, calls = asyncio.run(main())
+    assert status == 200
+    assert not any(c.startswith("storage.get_user") or "username" in c for c in calls), calls
+
+    # Another account's passkey is still refused for this username.
+    before = AUTH_FAILURES.value("login_verify", "user_mismatch")
+    options = client.post("/api/login/options", json={"username": username}).json()
+    assertion = intruder.get(options, credential_id=next(iter(intruder.credentials)))
+    assert client.post("/api/login/verify", json={"credential": assertion}).status_code == 400
+    assert AUTH_FAILURES.value("login_verify", "user_mismatch") == before + 1
+
+
+def test_register_and_login_do_aes_only_on_the_crypto_executor():
+    username = f"aes-{secrets.token_hex(4)}"
+    authenticators = [SoftAuthenticator(), SoftAuthenticator()]
+
+    async def main():
+        async with async_client() as ac:
+            for authenticator in authenticators:  # the second one has an exclude list to build
+                crypto_store.cache.clear()
+                options = (await ac.post("/api/register/options", json={"username": username})).json()
+                credential = authenticator.create(options)
+                r = await ac.post("/api/register/verify", json={"username": username, "credential": credential})
+                assert r.status_code == 200
+            for login_name in (username, f"{username}-unknown", ""):
+                crypto_store.cache.clear()
+                options = (await ac.post("/api/login/options", json={"username": login_name})).json()
+                if login_name != f"{username}-unknown":
+                    assertion = authenticators[0].get(options)
+                    assert (await ac.post("/api/login/verify", json={"credential": assertion})).status_code == 200
+
+    with spying():  # fails on AES-GCM outside run_crypto
+        asyncio.run(main())